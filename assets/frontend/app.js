@@ -13,6 +13,61 @@ searchInput.addEventListener('keypress', function(e) {
     }
 });
 
+// Typeahead suggestions, shown through a datalist attached to the search input
+const suggestionList = document.createElement('datalist');
+suggestionList.id = 'search-suggestions';
+document.body.appendChild(suggestionList);
+searchInput.setAttribute('list', suggestionList.id);
+searchInput.setAttribute('autocomplete', 'off');
+
+let suggestTimer = null;
+let latestSuggestPrefix = '';
+searchInput.addEventListener('input', function() {
+    clearTimeout(suggestTimer);
+    suggestTimer = setTimeout(fetchSuggestions, 150);
+});
+
+// Fetch completions for the current input; suggestions never run a full search
+async function fetchSuggestions() {
+    const prefix = searchInput.value.trim();
+    latestSuggestPrefix = prefix;
+    const apiEndpoint = window.CONFIG ? window.CONFIG.API_ENDPOINT : '';
+    if (!prefix || !apiEndpoint) {
+        suggestionList.textContent = '';
+        return;
+    }
+
+    try {
+        const response = await fetch(`${apiEndpoint}/search`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                suggest: prefix,
+                limit: 8
+            })
+        });
+
+        let data = await response.json();
+        if (data.statusCode === 200 && typeof data.body === 'string') {
+            data = JSON.parse(data.body);
+        }
+
+        // Ignore responses that arrive after the user kept typing
+        if (prefix !== latestSuggestPrefix) return;
+
+        suggestionList.textContent = '';
+        for (const suggestion of data.suggestions || []) {
+            const option = document.createElement('option');
+            option.value = suggestion.text;
+            suggestionList.appendChild(option);
+        }
+    } catch (error) {
+        console.warn('Suggest error:', error);
+    }
+}
+
 // Get the currently selected search mode
 function getSelectedMode() {
     for (const radio of modeRadios) {
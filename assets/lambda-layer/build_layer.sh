@@ -10,6 +10,11 @@ mkdir -p python
 # 安装依赖项到python目录
 pip install -r requirements.txt -t python
 
+# 可选：本地CPU embedding后端所需的依赖 (EMBEDDING_BACKEND=onnx)
+if [ "$WITH_ONNX" = "1" ]; then
+    pip install -r requirements-onnx.txt -t python
+fi
+
 # 显示安装的包
 echo "Installed packages:"
 ls -la python
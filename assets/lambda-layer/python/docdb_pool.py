@@ -0,0 +1,397 @@
+"""
+Shared DocumentDB access for the project's Lambda functions
+
+Owns connection URI construction, per-role pool sizing, timeouts and read
+preference, a retry helper for transient errors, and latency/pool statistics.
+Clients are cached at module level so they survive warm invocations; never
+close them from a handler.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from pymongo import MongoClient, _csot, monitoring
+from pymongo.errors import AutoReconnect, NetworkTimeout, ServerSelectionTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Per-role client settings. search serves latency-sensitive reads from the
+# secondaries; ingest reads and writes on the primary with a small pool;
+# admin runs index builds, which can take minutes. With at least one replica,
+# DB_SEARCH_READ_PREFERENCE=secondary keeps search reads off the primary
+# entirely, so bulk ingest never competes with them (with no replica,
+# "secondary" reads fail; keep the default).
+ROLE_PROFILES = {
+    'search': {
+        'read_preference': os.environ.get('DB_SEARCH_READ_PREFERENCE', 'secondaryPreferred'),
+        'max_pool_size': int(os.environ.get('DB_SEARCH_MAX_POOL_SIZE', '20')),
+        'min_pool_size': int(os.environ.get('DB_SEARCH_MIN_POOL_SIZE', '1')),
+        'timeout_ms': int(os.environ.get('DB_SEARCH_TIMEOUT_MS', '60000')),
+    },
+    'ingest': {
+        'read_preference': 'primary',
+        'max_pool_size': int(os.environ.get('DB_INGEST_MAX_POOL_SIZE', '4')),
+        'min_pool_size': 0,
+        'timeout_ms': int(os.environ.get('DB_INGEST_TIMEOUT_MS', '60000')),
+    },
+    'admin': {
+        'read_preference': 'primary',
+        'max_pool_size': 2,
+        'min_pool_size': 0,
+        'timeout_ms': int(os.environ.get('DB_ADMIN_TIMEOUT_MS', '300000')),
+    },
+}
+
+# Segment storage layout. "combined" keeps each segment's text next to its
+# embedding in COLLECTION_NAME. "split" keeps COLLECTION_NAME lean (embedding
+# and metadata only, so the vector-searched working set stays in cache) and
+# moves the text, with the metadata the lexical leg filters on, to
+# CONTENT_COLLECTION_NAME under the same _id.
+SEGMENT_LAYOUT = os.environ.get('SEGMENT_LAYOUT', 'combined')
+CONTENT_COLLECTION_NAME = os.environ.get('CONTENT_COLLECTION_NAME', 'videodata_content')
+CONTENT_FIELDS = ('_id', 'text', 'video_name', 'source', 'start_timestamp_millis', 'end_timestamp_millis',
+                  'ingest_id')
+
+# Segment shards. SEARCH_SHARDS is a JSON list of shards, for example
+# [{"name": "s0"}, {"name": "s1", "uri_env": "SHARD_S1_URI", "db": "VideoData"}]:
+# "uri_env" names the variable holding the shard's connection URI (the
+# default cluster when omitted) and "db" its database (DB_NAME when omitted).
+# Only the segment collections (COLLECTION_NAME and the content store) are
+# sharded; corpus metadata, caches, the video catalog, suggest terms, ingest
+# jobs and rate limits stay on the default cluster. Each video lives on one
+# shard, chosen by SHARD_PARTITION: "hash" spreads videos by rendezvous
+# hashing of video_name (adding a shard only moves the videos that hash to
+# it); "tenant" keeps a tenant's videos together, the tenant being the
+# video_name prefix before SHARD_TENANT_SEPARATOR, placed by SHARD_TENANTS
+# ({"tenant": "shard name"}) or else by hashing the tenant. Empty: no sharding.
+SEARCH_SHARDS = json.loads(os.environ.get('SEARCH_SHARDS', '') or '[]')
+SHARD_PARTITION = os.environ.get('SHARD_PARTITION', 'hash')
+SHARD_TENANT_SEPARATOR = os.environ.get('SHARD_TENANT_SEPARATOR', '/')
+SHARD_TENANTS = json.loads(os.environ.get('SHARD_TENANTS', '') or '{}')
+
+# Errors worth retrying: the operation may succeed on a fresh connection or after failover.
+# NetworkTimeout and ServerSelectionTimeoutError are also what an expired
+# pymongo.timeout() budget raises, so with_retries checks that budget first.
+TRANSIENT_ERRORS = (AutoReconnect, NetworkTimeout, ServerSelectionTimeoutError)
+
+_clients = {}
+_stats = {}
+_clients_lock = threading.Lock()
+
+
+class _Stats(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    """Command latency and connection pool counters for one client"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}
+        self.pool = {'created': 0, 'closed': 0, 'checked_out': 0, 'checked_in': 0, 'checkout_failed': 0}
+
+    def _record(self, event, failed):
+        with self.lock:
+            entry = self.commands.setdefault(event.command_name,
+                                             {'count': 0, 'failed': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            duration_ms = event.duration_micros / 1000.0
+            entry['count'] += 1
+            entry['failed'] += 1 if failed else 0
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+
+    def _count(self, name):
+        with self.lock:
+            self.pool[name] += 1
+
+    # CommandListener
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, failed=False)
+
+    def failed(self, event):
+        self._record(event, failed=True)
+
+    # ConnectionPoolListener
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._count('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count('closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._count('checkout_failed')
+
+    def connection_checked_out(self, event):
+        self._count('checked_out')
+
+    def connection_checked_in(self, event):
+        self._count('checked_in')
+
+    def snapshot(self):
+        with self.lock:
+            commands = {
+                name: {**entry, 'avg_ms': round(entry['total_ms'] / entry['count'], 2) if entry['count'] else 0.0,
+                       'total_ms': round(entry['total_ms'], 2), 'max_ms': round(entry['max_ms'], 2)}
+                for name, entry in self.commands.items()
+            }
+            pool = dict(self.pool)
+        pool['open'] = pool['created'] - pool['closed']
+        pool['in_use'] = pool['checked_out'] - pool['checked_in']
+        return {'commands': commands, 'pool': pool}
+
+
+def build_connection_uri(shard=None):
+    """
+    Build the connection URI from MONGODB_URI, or from the DB_* variables
+
+    For a shard with its own cluster, the URI comes from the variable named
+    by its "uri_env".
+
+    Returns:
+        tuple: (uri, redacted uri safe to log)
+    """
+    uri_env = get_shard(shard).get('uri_env') if shard else None
+    if uri_env:
+        shard_uri = os.environ.get(uri_env)
+        if not shard_uri:
+            raise ValueError(f"{uri_env} environment variable is not set for shard {shard}")
+        return shard_uri, f"{uri_env} (redacted)"
+
+    mongodb_uri = os.environ.get('MONGODB_URI')
+    if mongodb_uri:
+        return mongodb_uri, 'MONGODB_URI (redacted)'
+
+    username = os.environ.get('DB_USERNAME')
+    password = os.environ.get('DB_PASSWORD')
+    db_endpoint = os.environ.get('DB_ENDPOINT')
+    db_port = os.environ.get('DB_PORT', '27017')
+    if not db_endpoint:
+        raise ValueError("Neither DB_ENDPOINT nor MONGODB_URI environment variable is set")
+
+    options = "replicaSet=rs0&readPreference=secondaryPreferred&retryWrites=false&ssl=false"
+    return (f"mongodb://{username}:{password}@{db_endpoint}:{db_port}/?{options}",
+            f"mongodb://{username}:****@{db_endpoint}:{db_port}/?{options}")
+
+
+def get_client(role='search', connect=True, shard=None):
+    """
+    Return the container-wide MongoClient for a role, creating it on first use
+
+    Args:
+        role (str): "search", "ingest" or "admin" (see ROLE_PROFILES)
+        connect (bool): Start the topology handshake immediately. Pass False
+            before a SnapStart snapshot so no sockets or threads are captured.
+        shard (str): Name of a shard with its own cluster (see SEARCH_SHARDS);
+            None for the default cluster
+    """
+    key = f"{role}@{shard}" if shard else role
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        if key in _clients:
+            return _clients[key]
+
+        profile = ROLE_PROFILES[role]
+        uri, redacted_uri = build_connection_uri(shard)
+        logger.info(f"Creating {key} MongoDB client: {redacted_uri}")
+
+        stats = _Stats()
+        client = MongoClient(
+            uri,
+            maxPoolSize=profile['max_pool_size'],
+            minPoolSize=profile['min_pool_size'],
+            socketTimeoutMS=profile['timeout_ms'],
+            connectTimeoutMS=profile['timeout_ms'],
+            serverSelectionTimeoutMS=profile['timeout_ms'],
+            readPreference=profile['read_preference'],
+            retryWrites=False,  # DocumentDB does not support retryable writes
+            ssl=False,
+            connect=connect,
+            event_listeners=[stats]
+        )
+        _stats[key] = stats
+        _clients[key] = client
+        return client
+
+
+def get_database(role='search', db_name=None, connect=True):
+    """Return the project database (DB_NAME, default VideoData) on the role's client"""
+    return get_client(role, connect)[db_name or os.environ.get('DB_NAME', 'VideoData')]
+
+
+def get_collection(role='search', collection_name=None, connect=True):
+    """Return the segments collection (COLLECTION_NAME, default videodata) on the role's client"""
+    return get_database(role, connect=connect)[collection_name or os.environ.get('COLLECTION_NAME', 'videodata')]
+
+
+def is_split_layout():
+    """True when segment text lives in CONTENT_COLLECTION_NAME (see SEGMENT_LAYOUT)"""
+    return SEGMENT_LAYOUT == 'split'
+
+
+def get_content_collection(role='search', connect=True):
+    """Return the collection holding segment text: the content store in the split layout"""
+    if is_split_layout():
+        return get_database(role, connect=connect)[CONTENT_COLLECTION_NAME]
+    return get_collection(role, connect=connect)
+
+
+def is_sharded():
+    """True when the segment collections are spread over SEARCH_SHARDS"""
+    return bool(SEARCH_SHARDS)
+
+
+def shard_names():
+    return [shard['name'] for shard in SEARCH_SHARDS]
+
+
+def get_shard(name):
+    for shard in SEARCH_SHARDS:
+        if shard['name'] == name:
+            return shard
+    raise ValueError(f"Unknown shard: {name}")
+
+
+def _rendezvous(key):
+    """The shard with the highest hash of (shard, key): stable as shards are added or removed"""
+    return max(shard_names(), key=lambda name: hashlib.sha256(f"{name}\x00{key}".encode('utf-8')).digest())
+
+
+def tenant_of(video_name):
+    """Tenant prefix of a video name, or None when it has none"""
+    if SHARD_TENANT_SEPARATOR and SHARD_TENANT_SEPARATOR in video_name:
+        return video_name.split(SHARD_TENANT_SEPARATOR, 1)[0]
+    return None
+
+
+def shard_for_video(video_name):
+    """Name of the shard holding a video's segments, or None when not sharded"""
+    if not SEARCH_SHARDS:
+        return None
+    if SHARD_PARTITION == 'tenant':
+        tenant = tenant_of(video_name)
+        if tenant is not None:
+            return SHARD_TENANTS.get(tenant) or _rendezvous(f"tenant:{tenant}")
+    return _rendezvous(video_name)
+
+
+def get_shard_database(shard, role='search', connect=True):
+    """Return a shard's database; shards without "uri_env" share the default cluster's client"""
+    config = get_shard(shard)
+    client = get_client(role, connect, shard) if config.get('uri_env') else get_client(role, connect)
+    return client[config.get('db') or os.environ.get('DB_NAME', 'VideoData')]
+
+
+def get_segment_database(video_name, role='search', connect=True):
+    """Return the database holding a video's segments: its shard's, or the project database"""
+    shard = shard_for_video(video_name)
+    if shard is None:
+        return get_database(role, connect=connect)
+    return get_shard_database(shard, role, connect)
+
+
+def split_segment(doc):
+    """Split a segment document into its (lean, content) halves"""
+    lean = {key: value for key, value in doc.items() if key != 'text'}
+    content = {key: doc.get(key) for key in CONTENT_FIELDS}
+    return lean, content
+
+
+def create_content_indexes(collection):
+    """Create the text and video/timestamp indexes the lexical leg uses on the content store"""
+    logger.info(f"Creating text index on {collection.name}...")
+    collection.create_index([("text", "text")], name="text_index")
+    collection.create_index([("video_name", 1), ("start_timestamp_millis", 1), ("end_timestamp_millis", 1)],
+                            name="video_name_1_start_timestamp_millis_1_end_timestamp_millis_1")
+
+
+def create_segment_indexes(collection, dimensions, text_index=True):
+    """
+    Create the text, timestamp, per-video and vector indexes on a segments collection
+
+    Shared by init-db and the reindex tool so every segments collection is
+    indexed the same way. In the split layout the text index belongs on the
+    content store instead (text_index=False). Returns True if the vector
+    index was created.
+    """
+    if text_index:
+        logger.info(f"Creating text index on {collection.name}...")
+        collection.create_index([("text", "text")], name="text_index")
+
+    logger.info("Creating timestamp index...")
+    collection.create_index([("start_timestamp_millis", 1), ("end_timestamp_millis", 1)],
+                            name="start_timestamp_millis_1_end_timestamp_millis_1")
+
+    # Used by video-scoped and time-windowed searches, and by per-video deletes
+    logger.info("Creating video/timestamp index...")
+    collection.create_index([("video_name", 1), ("start_timestamp_millis", 1), ("end_timestamp_millis", 1)],
+                            name="video_name_1_start_timestamp_millis_1_end_timestamp_millis_1")
+
+    # Vector index for embeddings (DocumentDB 5.0.0+); dimensions must match the embedding backend
+    logger.info(f"Creating vector index for {dimensions}-dimension embeddings...")
+    try:
+        collection.create_index([("embedding", "vector")],
+                                name="vector_index",
+                                vectorOptions={
+                                    "type": "ivfflat",
+                                    "dimensions": dimensions,
+                                    "similarity": "cosine",
+                                    "lists": 1000
+                                })
+        logger.info("Vector index created successfully")
+        return True
+    except Exception as e:
+        logger.error(f"Error creating vector index: {str(e)}")
+        logger.warning("Failed to create vector index. Make sure DocumentDB version supports vector indexes (5.0.0+)")
+        return False
+
+
+def with_retries(operation, attempts=3, backoff_seconds=0.2):
+    """
+    Run operation(), retrying transient connection errors with exponential backoff
+
+    Only use this for idempotent operations: a write that timed out may
+    already have been applied. Inside a pymongo.timeout() block the error is
+    raised as is once the budget would run out before the next attempt, so
+    retries never stretch a stage past its deadline.
+    """
+    for attempt in range(attempts):
+        try:
+            return operation()
+        except TRANSIENT_ERRORS as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_seconds * (2 ** attempt)
+            remaining = _csot.remaining()
+            if remaining is not None and remaining <= delay:
+                raise
+            logger.warning(f"Transient DocumentDB error ({str(e)}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def get_stats():
+    """Pool and per-command latency statistics for every client created in this container"""
+    return {role: stats.snapshot() for role, stats in list(_stats.items())}
@@ -0,0 +1,180 @@
+"""
+Pluggable text-embedding backends shared by ingest and search
+
+Every stored segment records the backend_id of the backend that embedded it,
+and searches only compare vectors that share the query's backend_id.
+"""
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Backend used when none is named: "titan" (Bedrock) or "onnx" (in-process CPU model)
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'titan')
+# Output size requested from Titan v2, which supports 256, 512 and 1024.
+# Ingest, init-db and search must agree on it: the vector index is built at this size.
+EMBEDDING_DIMENSIONS = int(os.environ.get('EMBEDDING_DIMENSIONS', '1024'))
+TITAN_DIMENSIONS = (256, 512, 1024)
+# Directory holding model.onnx and tokenizer.json for the onnx backend
+EMBEDDING_MODEL_PATH = os.environ.get('EMBEDDING_MODEL_PATH', '/opt/models/embedding')
+ONNX_MAX_TOKENS = int(os.environ.get('ONNX_MAX_TOKENS', '256'))
+ONNX_THREADS = int(os.environ.get('ONNX_THREADS', '0'))  # 0 lets onnxruntime decide
+
+# Documents ingested before backends were recorded were all embedded by Titan v2
+LEGACY_BACKEND_ID = 'titan-v2'
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+class EmbeddingBackend:
+    """Interface implemented by every embedding backend"""
+
+    # Stable identifier stored on each document as embedding_backend
+    backend_id = None
+
+    @property
+    def dimensions(self):
+        raise NotImplementedError
+
+    def embed(self, text):
+        """Return the embedding of one text as a list of floats"""
+        raise NotImplementedError
+
+    def embed_many(self, texts):
+        """Return embeddings for several texts; backends that can batch override this"""
+        return [self.embed(text) for text in texts]
+
+    def document_filter(self):
+        """MongoDB filter selecting the documents embedded by this backend"""
+        if self.backend_id == LEGACY_BACKEND_ID:
+            # $in with None also matches documents without the field
+            return {"embedding_backend": {"$in": [self.backend_id, None]}}
+        return {"embedding_backend": self.backend_id}
+
+
+class TitanEmbeddingBackend(EmbeddingBackend):
+    """Amazon Titan Text Embeddings v2 through Bedrock, at 256, 512 or 1024 dimensions"""
+
+    model_id = "amazon.titan-embed-text-v2:0"
+
+    def __init__(self, bedrock_client=None, dimensions=EMBEDDING_DIMENSIONS):
+        if dimensions not in TITAN_DIMENSIONS:
+            raise ValueError(f"Titan v2 embeddings must have one of {TITAN_DIMENSIONS} dimensions, not {dimensions}")
+        if bedrock_client is None:
+            import boto3
+            bedrock_client = boto3.client('bedrock-runtime', region_name=os.environ.get('DEPLOY_REGION', 'us-west-2'))
+        self.bedrock_client = bedrock_client
+        self._dimensions = dimensions
+        # Vectors of different sizes never share an index, so the size is part of the id
+        self.backend_id = LEGACY_BACKEND_ID if dimensions == 1024 else f"{LEGACY_BACKEND_ID}-{dimensions}"
+
+    @property
+    def dimensions(self):
+        return self._dimensions
+
+    def embed(self, text):
+        response = self.bedrock_client.invoke_model(
+            modelId=self.model_id,
+            contentType="application/json",
+            accept="application/json",
+            body=json.dumps({
+                "inputText": text,
+                "dimensions": self._dimensions
+            })
+        )
+        response_body = json.loads(response['body'].read())
+        return response_body['embedding']
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """
+    Small sentence-embedding model (e.g. all-MiniLM-L6-v2 exported to ONNX) run
+    in-process on the CPU: mean pooling over token states, L2-normalized
+
+    Needs onnxruntime, tokenizers and numpy (see lambda-layer/requirements-onnx.txt)
+    and the model files under EMBEDDING_MODEL_PATH.
+    """
+
+    def __init__(self, model_path=EMBEDDING_MODEL_PATH, dimensions=None):
+        try:
+            import numpy as np
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The onnx embedding backend needs onnxruntime, tokenizers and numpy "
+                              "(install lambda-layer/requirements-onnx.txt)") from e
+
+        self.np = np
+        self.backend_id = f"onnx:{os.path.basename(os.path.normpath(model_path))}"
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=ONNX_MAX_TOKENS)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = ort.InferenceSession(os.path.join(model_path, 'model.onnx'), options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self._dimensions = None
+        if dimensions is not None and dimensions != self.dimensions:
+            raise ValueError(f"The ONNX model produces {self.dimensions}-dimension embeddings, not {dimensions}")
+
+    @property
+    def dimensions(self):
+        if self._dimensions is None:
+            self._dimensions = len(self.embed("dimension probe"))
+        return self._dimensions
+
+    def embed(self, text):
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts):
+        np = self.np
+        encodings = self.tokenizer.encode_batch([text or "" for text in texts])
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'token_type_ids': np.zeros_like(input_ids),
+        }
+        token_states = self.session.run(None, {name: value for name, value in feeds.items()
+                                               if name in self.input_names})[0]
+
+        mask = attention_mask[..., None].astype(token_states.dtype)
+        pooled = (token_states * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+
+def get_embedding_backend(name=None, bedrock_client=None, dimensions=None):
+    """
+    Return the container-wide backend for name (default EMBEDDING_BACKEND)
+
+    Args:
+        name (str): "titan" or "onnx"
+        bedrock_client: Bedrock runtime client for the titan backend (optional)
+        dimensions (int): Embedding size (optional, EMBEDDING_DIMENSIONS for titan,
+            the model's own size for onnx)
+    """
+    name = name or EMBEDDING_BACKEND
+    key = (name, dimensions)
+    backend = _backends.get(key)
+    if backend is not None:
+        return backend
+
+    with _backends_lock:
+        if key not in _backends:
+            if name == 'titan':
+                _backends[key] = TitanEmbeddingBackend(bedrock_client, dimensions or EMBEDDING_DIMENSIONS)
+            elif name == 'onnx':
+                _backends[key] = OnnxEmbeddingBackend(dimensions=dimensions)
+            else:
+                raise ValueError(f"Unknown embedding backend: {name}")
+            logger.info(f"Initialized embedding backend {_backends[key].backend_id}")
+        return _backends[key]
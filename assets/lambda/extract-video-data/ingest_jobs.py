@@ -0,0 +1,125 @@
+"""
+长视频分片入库的任务状态（ingest_jobs集合）
+
+每个result.json对应一个任务文档，_id由S3位置确定，重复的S3事件不会重复派发：
+
+{
+    "_id": "<uuid5>",
+    "video_name": "...",
+    "status": "running" | "finalizing" | "complete",
+    "dispatched": true,
+    "shard_count": 3,
+    "completed_shards": 1,
+    "shards": {"0": {"chapter_start": 0, "chapter_end": 4, "status": "running", "done": [0, 1]}, ...}
+}
+
+shards.<n>.done是该分片已写入的章节检查点；最后一个完成的分片把status从running改为
+finalizing，取得写入视频摘要的权利。
+"""
+import datetime
+import os
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+import docdb_pool
+
+INGEST_JOBS_COLLECTION_NAME = os.environ.get('INGEST_JOBS_COLLECTION_NAME', 'ingest_jobs')
+
+
+def _jobs(db):
+    return db[INGEST_JOBS_COLLECTION_NAME]
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+def job_id_for(bucket, key):
+    """同一个S3对象总是得到同一个任务ID"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"s3://{bucket}/{key}"))
+
+
+def create_job(db, job_id, video_name, bucket, key, ranges):
+    """
+    创建任务文档，返回是否需要派发分片
+
+    任务已存在但尚未派发完成（协调者中途失败后重试）时也返回True；重复派发是安全的，
+    因为分片按检查点跳过已完成的章节，写入也是幂等的。
+    """
+    try:
+        _jobs(db).insert_one({
+            '_id': job_id,
+            'video_name': video_name,
+            'bucket': bucket,
+            'key': key,
+            'status': 'running',
+            'dispatched': False,
+            'shard_count': len(ranges),
+            'completed_shards': 0,
+            'shards': {
+                str(shard): {'chapter_start': start, 'chapter_end': end, 'status': 'running', 'done': []}
+                for shard, (start, end) in enumerate(ranges)
+            },
+            'created_at': _now(),
+            'updated_at': _now()
+        })
+        return True
+    except DuplicateKeyError:
+        job = docdb_pool.with_retries(lambda: _jobs(db).find_one({'_id': job_id}, {'dispatched': 1}))
+        return job is not None and not job.get('dispatched')
+
+
+def mark_dispatched(db, job_id):
+    _jobs(db).update_one({'_id': job_id}, {'$set': {'dispatched': True, 'updated_at': _now()}})
+
+
+def get_done_chapters(db, job_id, shard):
+    """返回分片已写入的章节编号集合"""
+    job = docdb_pool.with_retries(lambda: _jobs(db).find_one({'_id': job_id}, {f'shards.{shard}.done': 1}))
+    if job is None:
+        raise ValueError(f"Unknown ingest job {job_id}")
+    return set(job.get('shards', {}).get(str(shard), {}).get('done', []))
+
+
+def mark_chapter_done(db, job_id, shard, chapter_index):
+    _jobs(db).update_one({'_id': job_id}, {
+        '$addToSet': {f'shards.{shard}.done': chapter_index},
+        '$set': {'updated_at': _now()}
+    })
+
+
+def mark_shard_failed(db, job_id, shard, error):
+    _jobs(db).update_one({'_id': job_id}, {
+        '$set': {f'shards.{shard}.status': 'failed', f'shards.{shard}.error': error, 'updated_at': _now()}
+    })
+
+
+def complete_shard(db, job_id, shard):
+    """
+    标记分片完成，返回调用者是否应当收尾（写入视频摘要）
+
+    completed_shards只在分片第一次完成时递增；全部分片完成后，只有一个调用者
+    能把status从running改为finalizing。
+    """
+    jobs = _jobs(db)
+    jobs.update_one(
+        {'_id': job_id, f'shards.{shard}.status': {'$ne': 'complete'}},
+        {'$set': {f'shards.{shard}.status': 'complete', 'updated_at': _now()}, '$inc': {'completed_shards': 1}}
+    )
+    job = docdb_pool.with_retries(lambda: jobs.find_one({'_id': job_id}, {'completed_shards': 1, 'shard_count': 1}))
+    if job is None or job['completed_shards'] < job['shard_count']:
+        return False
+    claimed = jobs.update_one({'_id': job_id, 'status': 'running'},
+                              {'$set': {'status': 'finalizing', 'updated_at': _now()}})
+    return claimed.modified_count == 1
+
+
+def release_finalize(db, job_id):
+    """收尾失败时交还收尾权，重试的分片调用可以再次收尾"""
+    _jobs(db).update_one({'_id': job_id, 'status': 'finalizing'},
+                         {'$set': {'status': 'running', 'updated_at': _now()}})
+
+
+def finish_job(db, job_id):
+    _jobs(db).update_one({'_id': job_id}, {'$set': {'status': 'complete', 'updated_at': _now()}})
@@ -1,24 +1,129 @@
+import time
+_INIT_STARTED = time.perf_counter()
+
 import json
 import boto3
 import os
 from botocore.exceptions import ClientError
 import pymongo
-from pymongo import MongoClient
+import docdb_pool
+import ingest_jobs
+import video_lifecycle
+from write_pacer import WritePacer
+from embedding_backends import get_embedding_backend
+import math
 import re
 import sys
 import socket
 import uuid
+from collections import Counter
+
+_IMPORTS_DONE = time.perf_counter()
+
+# Collection and _id of the corpus generation counter that keys search-side caches
+META_COLLECTION_NAME = os.environ.get('META_COLLECTION_NAME', 'corpus_meta')
+GENERATION_DOC_ID = 'corpus_generation'
+
+# 联想词（typeahead）集合及每个视频提取的关键词数量
+SUGGEST_COLLECTION_NAME = os.environ.get('SUGGEST_COLLECTION_NAME', 'suggest_terms')
+SUGGEST_TERMS_PER_VIDEO = int(os.environ.get('SUGGEST_TERMS_PER_VIDEO', '50'))
+
+# 提取关键词时忽略的常见英文停用词
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has
+have having he her here hers him his how i if in into is it its itself just like me more most my
+no nor not now of off on once only or other our out over own same she should so some such than
+that the their them then there these they this those through to too under until up very was we
+were what when where which while who whom why will with would you your yours video shows scene
+""".split())
+
+# 长视频分片入库：章节数达到SHARD_MIN_CHAPTERS时，按每片SHARD_CHAPTERS个章节拆分，
+# 分片数不超过MAX_SHARDS。需要本函数具有调用自身的lambda:InvokeFunction权限
+INGEST_SHARDING = os.environ.get('INGEST_SHARDING', 'false').lower() == 'true'
+SHARD_MIN_CHAPTERS = int(os.environ.get('SHARD_MIN_CHAPTERS', '8'))
+SHARD_CHAPTERS = int(os.environ.get('SHARD_CHAPTERS', '4'))
+MAX_SHARDS = int(os.environ.get('MAX_SHARDS', '20'))
+
+# 源视频所在的前缀（video-input/<视频名>），删除它才会删除视频
+VIDEO_INPUT_PREFIX = os.environ.get('VIDEO_INPUT_PREFIX', 'video-input')
+
+# 诊断输出（版本信息、连接探测）默认关闭，避免拖慢冷启动
+DIAGNOSTICS = os.environ.get('DIAGNOSTICS', 'false').lower() == 'true'
+# 连接探测的超时时间（秒）
+CONNECTION_TEST_TIMEOUT = float(os.environ.get('CONNECTION_TEST_TIMEOUT', '5'))
+
+# 容器内复用的客户端，在初始化阶段创建一次
+_bedrock_client = None
+_s3_client = None
+_lambda_client = None
+
+# 入库写入限速器，速率在热调用之间保留（见write_pacer.py）
+write_pacer = WritePacer()
+
+# 启动阶段耗时（秒），在第一次调用时打印
+startup_profile = {'imports': round(_IMPORTS_DONE - _INIT_STARTED, 4)}
+_cold_start = True
+
+
+def get_bedrock_client():
+    """返回容器内共享的Bedrock runtime客户端"""
+    global _bedrock_client
+    if _bedrock_client is None:
+        region = os.environ.get('DEPLOY_REGION', 'us-west-2')
+        _bedrock_client = boto3.client('bedrock-runtime', region_name=region)
+    return _bedrock_client
+
+
+def get_s3_client():
+    """返回容器内共享的S3客户端"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3')
+    return _s3_client
+
+
+def get_lambda_client():
+    """返回容器内共享的Lambda客户端，用于派发分片"""
+    global _lambda_client
+    if _lambda_client is None:
+        _lambda_client = boto3.client('lambda')
+    return _lambda_client
+
+
+def init_clients():
+    """创建共享客户端并记录耗时"""
+    started = time.perf_counter()
+    get_bedrock_client()
+    get_s3_client()
+    # 本地模型后端在这里加载，避免首次调用时才读取模型文件
+    get_embedding_backend(bedrock_client=get_bedrock_client())
+    startup_profile['clients'] = round(time.perf_counter() - started, 4)
+
+
+# SnapStart模式下客户端在恢复后创建，避免凭证和连接被写入快照
+if os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'snap-start':
+    try:
+        from snapshot_restore_py import register_after_restore
+        register_after_restore(init_clients)
+    except ImportError:
+        print("snapshot_restore_py not available, clients will be built on first use")
+else:
+    init_clients()
+startup_profile['init_total'] = round(time.perf_counter() - _INIT_STARTED, 4)
 
 
 class VideoDataProcessor:
     def __init__(self):
-        # Initialize Bedrock client
-        region = os.environ.get('DEPLOY_REGION', 'us-west-2')
-        self.bedrock_client = boto3.client('bedrock-runtime', region_name=region)
-        # 打印版本信息以便调试
-        print(f"Python version: {sys.version}")
-        print(f"PyMongo version: {pymongo.__version__}")
-        print(f"boto3 version: {boto3.__version__}")
+        # 复用初始化阶段创建的Bedrock客户端
+        self.bedrock_client = get_bedrock_client()
+        # embedding后端由EMBEDDING_BACKEND选择，其backend_id会写入每条文档
+        self.embedding_backend = get_embedding_backend(bedrock_client=self.bedrock_client)
+        if DIAGNOSTICS:
+            # 打印版本信息以便调试
+            print(f"Python version: {sys.version}")
+            print(f"PyMongo version: {pymongo.__version__}")
+            print(f"boto3 version: {boto3.__version__}")
 
     def test_connection(self):
         try:
@@ -43,7 +148,8 @@ class VideoDataProcessor:
                 port = int(parts[1]) if len(parts) > 1 else 27017
             
             # 不打印完整的连接信息，只打印主机和端口
-            socket.create_connection((host, port), timeout=60)
+            with socket.create_connection((host, port), timeout=CONNECTION_TEST_TIMEOUT):
+                pass
             print(f"Successfully connected to {host}:{port}")
         except Exception as e:
             print(f"Connection failed: {e}")
@@ -51,7 +157,7 @@ class VideoDataProcessor:
 
     def get_json_from_s3(self, bucket, key):
         """从S3读取JSON文件"""
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         try:
             response = s3_client.get_object(
                 Bucket=bucket,
@@ -92,17 +198,7 @@ class VideoDataProcessor:
             text = str(text)
 
         try:
-            response = self.bedrock_client.invoke_model(
-                modelId="amazon.titan-embed-text-v2:0",
-                contentType="application/json",
-                accept="application/json",
-                body=json.dumps({
-                    "inputText": text
-                })
-            )
-
-            response_body = json.loads(response['body'].read())
-            return response_body['embedding']
+            return self.embedding_backend.embed(text)
         except Exception as e:
             print(f"Error in get_embeddings: {str(e)}")
             print(f"Input text (first 100 chars): {text[:100] if len(text) > 100 else text}")
@@ -180,122 +276,116 @@ class VideoDataProcessor:
 
         return chunks
 
-    def test_connection(self):
-        try:
-            # 从环境变量获取连接信息
-            mongodb_uri = os.environ.get('MONGODB_URI')
-            
-            if not mongodb_uri:
-                # 如果没有设置MONGODB_URI，尝试使用其他环境变量
-                db_endpoint = os.environ.get('DB_ENDPOINT')
-                db_port = os.environ.get('DB_PORT', '27017')
-                
-                if not db_endpoint:
-                    print("Neither MONGODB_URI nor DB_ENDPOINT environment variable is set, skipping connection test")
-                    return
-                
-                host = db_endpoint
-                port = int(db_port)
-            else:
-                # 解析URI以获取主机和端口
-                parts = mongodb_uri.split('@')[1].split('/')[0].split(':')
-                host = parts[0]
-                port = int(parts[1]) if len(parts) > 1 else 27017
-            
-            # 不打印完整的连接信息，只打印主机和端口
-            socket.create_connection((host, port), timeout=60)
-            print(f"Successfully connected to {host}:{port}")
-        except Exception as e:
-            print(f"Connection failed: {e}")
-            # 不抛出异常，让函数继续执行
-
     def flatten_video_data(self, video_data, video_name):
         flattened_data = []
 
         # 处理视频摘要
         video_summary = video_data.get('video_summary', {})
-        flattened_summary = {
+        flattened_data.append(self.flatten_video_summary(video_summary, video_name))
+
+        # 处理章节
+        for chapter in video_data.get('chapters', []):
+            flattened_data.extend(self.flatten_chapter(chapter, video_name))
+
+        return flattened_data
+
+    def flatten_video_summary(self, video_summary, video_name):
+        """把视频摘要转换为一条扁平文档"""
+        return {
             "video_name": video_name,
             "source": "video_summary",
             "text": video_summary.get('text', ""),
             "embedding": video_summary.get('embedding', []),
+            # 记录生成embedding的后端，检索时只比较同一后端的向量
+            "embedding_backend": self.embedding_backend.backend_id,
             "start_timestamp_millis": None,
             "end_timestamp_millis": None
         }
-        flattened_data.append(flattened_summary)
 
-        # 处理章节
-        chapters = video_data.get('chapters', [])
-        for chapter in chapters:
-            chapter_summary = chapter.get('chapter_summary', {})
-            flattened_chapter_summary = {
+    def flatten_chapter(self, chapter, video_name):
+        """把一个章节的摘要和转录块转换为扁平文档"""
+        backend_id = self.embedding_backend.backend_id
+        chapter_summary = chapter.get('chapter_summary', {})
+        flattened_data = [{
+            "video_name": video_name,
+            "source": f"chapter_{chapter.get('chapter_index', 0)}_summary",
+            "text": chapter_summary.get('text', ""),
+            "embedding": chapter_summary.get('embedding', []),
+            "embedding_backend": backend_id,
+            "start_timestamp_millis": chapter.get('start_timestamp_millis'),
+            "end_timestamp_millis": chapter.get('end_timestamp_millis')
+        }]
+
+        # 处理章节转录块
+        for chunk in chapter.get('transcript_chunks', []):
+            flattened_data.append({
                 "video_name": video_name,
-                "source": f"chapter_{chapter.get('chapter_index', 0)}_summary",
-                "text": chapter_summary.get('text', ""),
-                "embedding": chapter_summary.get('embedding', []),
+                "source": f"chapter_{chapter.get('chapter_index', 0)}_transcript_chunk_{chunk.get('chunk_index', 0)}",
+                "text": chunk.get('text', ""),
+                "embedding": chunk.get('embedding', []),
+                "embedding_backend": backend_id,
                 "start_timestamp_millis": chapter.get('start_timestamp_millis'),
                 "end_timestamp_millis": chapter.get('end_timestamp_millis')
-            }
-            flattened_data.append(flattened_chapter_summary)
-
-            # 处理章节转录块
-            transcript_chunks = chapter.get('transcript_chunks', [])
-            for chunk in transcript_chunks:
-                flattened_chunk = {
-                    "video_name": video_name,
-                    "source": f"chapter_{chapter.get('chapter_index', 0)}_transcript_chunk_{chunk.get('chunk_index', 0)}",
-                    "text": chunk.get('text', ""),
-                    "embedding": chunk.get('embedding', []),
-                    "start_timestamp_millis": chapter.get('start_timestamp_millis'),
-                    "end_timestamp_millis": chapter.get('end_timestamp_millis')
-                }
-                flattened_data.append(flattened_chunk)
+            })
 
         return flattened_data
 
-    def store_in_documentdb(self, flattened_data):
-        """存储数据到DocumentDB的videodata集合"""
-        try:
-            # Retrieve MongoDB URI from environment variable
-            mongodb_uri = os.environ.get('MONGODB_URI')
-            if not mongodb_uri:
-                # 如果没有设置MONGODB_URI，尝试使用其他环境变量构建
-                db_endpoint = os.environ.get('DB_ENDPOINT')
-                db_username = os.environ.get('DB_USERNAME')
-                db_password = os.environ.get('DB_PASSWORD')
-                db_port = os.environ.get('DB_PORT', '27017')
-                
-                if db_endpoint:
-                    mongodb_uri = f"mongodb://{db_username}:{db_password}@{db_endpoint}:{db_port}/?replicaSet=rs0&readPreference=secondaryPreferred&retryWrites=false&ssl=false"
-                else:
-                    raise ValueError("Neither MONGODB_URI nor DB_ENDPOINT environment variable is set")
-
-            # Create a MongoDB client with increased timeout
-            client = MongoClient(mongodb_uri, socketTimeoutMS=60000, connectTimeoutMS=60000)
+    def store_in_documentdb(self, flattened_data, source_key=None):
+        """
+        存储数据到DocumentDB的videodata集合
 
-            # Specify the database and collection
-            db_name = os.environ.get('DB_NAME', 'VideoData')
-            collection_name = os.environ.get('COLLECTION_NAME', 'videodata')
-            db = client[db_name]
-            collection = db[collection_name]
+        视频已有文档时作为替换处理：新文档在切换前不可见，切换后旧文档被分批删除
+        （见video_lifecycle.py）。
+        """
+        try:
+            # 使用共享层中的连接池，客户端在热调用之间复用
+            db = docdb_pool.get_database('ingest')
 
             # 批量插入数据
             if flattened_data:
+                video_name = flattened_data[0]['video_name']
+                # 配置了SEARCH_SHARDS时文档写入视频所在的数据分片，元数据仍在默认集群
+                segment_db, collection = self.segment_collections(video_name)
+                ingest_id = str(uuid.uuid4())
+                if video_lifecycle.begin_ingest(db, collection, video_name, ingest_id):
+                    # 让搜索端在新文档写入前加载replacing状态
+                    self.bump_corpus_generation(db)
+
                 # 为每条数据添加唯一ID并确保embedding是普通Python列表
                 for item in flattened_data:
                     item['_id'] = str(uuid.uuid4())
+                    item['ingest_id'] = ingest_id
                     
                     # 确保embedding是普通Python列表
                     if 'embedding' in item and hasattr(item['embedding'], 'tolist'):
                         item['embedding'] = item['embedding'].tolist()
 
-                result = collection.insert_many(flattened_data)
-                print(f"Successfully stored {len(result.inserted_ids)} flattened documents in DocumentDB.")
+                def insert_batch(batch):
+                    if docdb_pool.is_split_layout():
+                        # 分离存储：先写入文本内容，再写入可被向量检索的精简文档，保证检索到的片段都能取到文本
+                        lean_docs, content_docs = zip(*(docdb_pool.split_segment(item) for item in batch))
+                        segment_db[docdb_pool.CONTENT_COLLECTION_NAME].insert_many(list(content_docs))
+                        return collection.insert_many(list(lean_docs))
+                    return collection.insert_many(batch)
+
+                # INGEST_QOS开启时分批限速写入，避免挤占搜索
+                results = write_pacer.write(flattened_data, insert_batch)
+                inserted = sum(len(result.inserted_ids) for result in results)
+                print(f"Successfully stored {inserted} flattened documents in DocumentDB.")
+
+                # 更新联想词索引；失败不影响视频数据入库
+                terms = []
+                try:
+                    terms = self.update_suggest_terms(db, video_name, flattened_data)
+                except Exception as e:
+                    print(f"Error updating suggest terms: {str(e)}")
+
+                # 切换到新文档并删除旧文档
+                self.swap_in(db, video_name, ingest_id, source_key, terms)
             else:
                 print("No data to store")
 
-            # Close the connection
-            client.close()
+            print(f"DocumentDB stats: {json.dumps(docdb_pool.get_stats())}")
         except pymongo.errors.ServerSelectionTimeoutError as timeout_error:
             print(f"Timeout error connecting to DocumentDB: {str(timeout_error)}")
             print(f"Please check your network connection and DocumentDB cluster status.")
@@ -308,31 +398,247 @@ class VideoDataProcessor:
             print(f"boto3 version: {boto3.__version__}")
             raise
 
+    def segment_collections(self, video_name):
+        """视频文档所在的数据库和videodata集合：配置了SEARCH_SHARDS时为视频所在的数据分片"""
+        segment_db = docdb_pool.get_segment_database(video_name, 'ingest')
+        return segment_db, segment_db[os.environ.get('COLLECTION_NAME', 'videodata')]
+
+    def bump_corpus_generation(self, db):
+        """递增语料代数计数器，搜索缓存的键包含该值，因此旧缓存不会再被命中"""
+        result = db[META_COLLECTION_NAME].find_one_and_update(
+            {'_id': GENERATION_DOC_ID},
+            {'$inc': {'generation': 1}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        print(f"Corpus generation is now {result.get('generation') if result else 'unknown'}")
+
+    def extract_salient_terms(self, flattened_data, max_terms=SUGGEST_TERMS_PER_VIDEO):
+        """从摘要和转录块中提取高频关键词（单词和双词短语），摘要权重加倍"""
+        counts = Counter()
+        bigram_occurrences = Counter()
+        for item in flattened_data:
+            text = item.get('text') or ""
+            if not isinstance(text, str):
+                continue
+            boost = 2 if item.get('source', '').endswith('summary') else 1
+            # 按句子切分，避免跨句组成双词短语
+            for sentence in re.split(r'[.!?;:\n]+', text.lower()):
+                tokens = re.findall(r"[a-z0-9][a-z0-9'-]*", sentence)
+                for i, token in enumerate(tokens):
+                    if len(token) < 3 or token in STOPWORDS:
+                        continue
+                    counts[token] += boost
+                    if i + 1 < len(tokens):
+                        following = tokens[i + 1]
+                        if len(following) >= 3 and following not in STOPWORDS:
+                            bigram = f"{token} {following}"
+                            counts[bigram] += boost
+                            bigram_occurrences[bigram] += 1
+        # 双词短语只有出现多次才保留
+        return [term for term, _ in counts.most_common()
+                if ' ' not in term or bigram_occurrences[term] > 1][:max_terms]
+
+    def update_suggest_terms(self, db, video_name, flattened_data):
+        """把视频名称和关键词写入联想词集合，权重为包含该词的视频数；返回写入的关键词"""
+        terms = self.extract_salient_terms(flattened_data)
+        entries = [('video', video_name)] + [('term', term) for term in terms]
+        requests = [
+            pymongo.UpdateOne(
+                {'_id': f"{kind}:{text}"},
+                {'$set': {'text': text, 'kind': kind}, '$inc': {'weight': 1}},
+                upsert=True
+            )
+            for kind, text in entries
+        ]
+        db[SUGGEST_COLLECTION_NAME].bulk_write(requests, ordered=False)
+        print(f"Updated {len(requests)} suggest entries for video {video_name}")
+        return terms
+
+    def retract_suggest_terms(self, db, video_name, terms):
+        """撤销一次update_suggest_terms的计数，权重降到0的条目被删除"""
+        entries = [('video', video_name)] + [('term', term) for term in terms]
+        requests = [pymongo.UpdateOne({'_id': f"{kind}:{text}"}, {'$inc': {'weight': -1}}) for kind, text in entries]
+        suggest = db[SUGGEST_COLLECTION_NAME]
+        suggest.bulk_write(requests, ordered=False)
+        suggest.delete_many({'_id': {'$in': [f"{kind}:{text}" for kind, text in entries]}, 'weight': {'$lte': 0}})
+
+    def swap_in(self, db, video_name, ingest_id, source_key, terms):
+        """切换视频到新的入库结果，递增语料代数，再分批删除旧文档并撤销旧的联想词计数"""
+        previous = video_lifecycle.activate_ingest(db, video_name, ingest_id, source_key, terms)
+        self.bump_corpus_generation(db)
+
+        # 切换之后才开始的另一次替换的文档也要保留
+        staged = (video_lifecycle.get_entry(db, video_name) or {}).get('staged_ingest')
+        segment_db, collection = self.segment_collections(video_name)
+        deleted = video_lifecycle.delete_segments(segment_db, collection, video_name, write_pacer,
+                                                  [keep for keep in (ingest_id, staged) if keep])
+        if previous and previous.get('active_ingest') is not None:
+            try:
+                self.retract_suggest_terms(db, video_name, previous.get('terms', []))
+            except Exception as e:
+                print(f"Error retracting suggest terms: {str(e)}")
+        video_lifecycle.mark_stable(db, video_name, ingest_id)
+        if deleted:
+            print(f"Replaced {video_name}: removed {deleted} segments of earlier ingests")
+
+    def is_delete_event(self, event):
+        """EventBridge的Object Deleted事件或S3的ObjectRemoved通知"""
+        if event.get('detail-type') == 'Object Deleted':
+            return True
+        try:
+            return event['Records'][0]['eventName'].startswith('ObjectRemoved')
+        except (KeyError, IndexError, AttributeError):
+            return False
+
+    def delete_video(self, bucket, key):
+        """
+        源视频或其当前生效的result.json被删除时删除视频的所有文档
+
+        视频先被标记为deleting，立即从搜索结果中消失，再分批删除文档。视频目录下的
+        其他对象（被替换掉的旧result.json、BDA的其他输出）被删除时视频保留。
+        """
+        video_name = self.get_video_name(key)
+        db = docdb_pool.get_database('ingest')
+        entry = video_lifecycle.get_entry(db, video_name)
+        if not self.is_source_video_key(key) and (entry is None or entry.get('source_key') != key):
+            print(f"{bucket}/{key} is neither the source video nor the active result of {video_name}, keeping the video")
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'Ignored deletion, video kept', 'video_name': video_name})
+            }
+
+        segment_db, collection = self.segment_collections(video_name)
+
+        previous = video_lifecycle.mark_deleting(db, video_name)
+        self.bump_corpus_generation(db)
+        deleted = video_lifecycle.delete_segments(segment_db, collection, video_name, write_pacer)
+        if previous and previous.get('active_ingest') is not None:
+            try:
+                self.retract_suggest_terms(db, video_name, previous.get('terms', []))
+            except Exception as e:
+                print(f"Error retracting suggest terms: {str(e)}")
+        video_lifecycle.remove_entry(db, video_name)
+        self.bump_corpus_generation(db)
+        print(f"Deleted {deleted} segments of {video_name}")
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'Deleted video data', 'video_name': video_name, 'deleted_segments': deleted})
+        }
+
+    def get_event_location(self, event):
+        """从EventBridge或S3事件中获取bucket和key，无法识别时返回(None, None)"""
+        if 'detail' in event and 'bucket' in event['detail'] and 'object' in event['detail']:
+            return event['detail']['bucket']['name'], event['detail']['object']['key']
+        # 尝试从S3事件中获取
+        try:
+            record = event['Records'][0]
+            return record['s3']['bucket']['name'], record['s3']['object']['key']
+        except (KeyError, IndexError):
+            return None, None
+
+    def is_source_video_key(self, key):
+        """源视频本身的key，格式: video-input/Friends.mp4"""
+        parts = key.split('/')
+        return len(parts) == 2 and parts[0] == VIDEO_INPUT_PREFIX and bool(parts[1])
+
+    def get_video_name(self, key):
+        """从S3 key提取视频名称"""
+        # 文件路径格式: video-output/Friends.mp4/uuid/0/standard_output/0/result.json，源视频为video-input/Friends.mp4
+        # 视频名称在第二部分
+        parts = key.split('/')
+        if len(parts) >= 2:
+            return parts[1]  # 第二部分是视频名称
+        # 如果路径格式不符合预期，使用备用方法
+        return self.extract_video_name(key)
+
+    def get_video_summary_text(self, video_data):
+        """获取视频级别的摘要文本"""
+        if 'video' in video_data and 'summary' in video_data['video']:
+            return video_data['video']['summary']
+        # 尝试从chapters中获取summary
+        for chapter in video_data.get('chapters', []):
+            if 'summary' in chapter:
+                return chapter['summary']
+        return ""
+
+    def get_transcript_text(self, chapter):
+        """获取章节的转录文本"""
+        chapter_transcript = chapter.get('transcript', {})
+        if isinstance(chapter_transcript, dict):
+            if 'representation' in chapter_transcript and 'text' in chapter_transcript['representation']:
+                return chapter_transcript['representation']['text']
+            elif 'text' in chapter_transcript:
+                return chapter_transcript['text']
+            return ""
+        return str(chapter_transcript)
+
+    def build_chapter_data(self, chapter):
+        """切分一个章节的转录文本，并为转录块和章节摘要生成embedding"""
+        chapter_index = chapter.get('chapter_index', 0)
+        chapter_summary = chapter.get('summary', '')
+
+        transcript_text = self.get_transcript_text(chapter)
+        print(f"Chapter {chapter_index}: Transcript length: {len(transcript_text)}")
+
+        # 将转录文本分割成块
+        transcript_chunks = self.split_transcript_into_chunks(transcript_text)
+        print(f"Chapter {chapter_index}: Split transcript into {len(transcript_chunks)} chunks")
+
+        # 为每个块生成embeddings
+        chunk_data = []
+        for i, chunk in enumerate(transcript_chunks):
+            chunk_embedding = self.get_embeddings(chunk)
+            # 确保embedding是普通Python列表
+            if hasattr(chunk_embedding, 'tolist'):
+                chunk_embedding = chunk_embedding.tolist()
+            chunk_data.append({
+                'chunk_index': i,
+                'text': chunk,
+                'embedding': chunk_embedding
+            })
+
+        # 获取章节摘要的embedding并确保是普通Python列表
+        chapter_summary_embedding = self.get_embeddings(chapter_summary)
+        if hasattr(chapter_summary_embedding, 'tolist'):
+            chapter_summary_embedding = chapter_summary_embedding.tolist()
+
+        return {
+            'chapter_index': chapter_index,
+            'start_timestamp_millis': chapter.get('start_timestamp_millis'),
+            'end_timestamp_millis': chapter.get('end_timestamp_millis'),
+            'start_frame_index': chapter.get('start_frame_index'),
+            'end_frame_index': chapter.get('end_frame_index'),
+            'duration_millis': chapter.get('duration_millis'),
+            'chapter_summary': {
+                'text': chapter_summary,
+                'embedding': chapter_summary_embedding
+            },
+            'transcript_chunks': chunk_data
+        }
+
     def process_video_data(self, event):
         try:
             # Test the connection to DocumentDB
-            self.test_connection()
+            if DIAGNOSTICS:
+                self.test_connection()
 
             print(f"Received event: {json.dumps(event)}")
             
-            # 从EventBridge事件中获取bucket和key
-            if 'detail' in event and 'bucket' in event['detail'] and 'object' in event['detail']:
-                bucket = event['detail']['bucket']['name']
-                key = event['detail']['object']['key']
-            else:
-                # 尝试从S3事件中获取
-                try:
-                    record = event['Records'][0]
-                    bucket = record['s3']['bucket']['name']
-                    key = record['s3']['object']['key']
-                except (KeyError, IndexError):
-                    print("Could not extract bucket and key from event")
-                    return {
-                        'statusCode': 400,
-                        'body': json.dumps({
-                            'error': 'Invalid event format'
-                        })
-                    }
+            # 从EventBridge事件或S3事件中获取bucket和key
+            bucket, key = self.get_event_location(event)
+            if bucket is None:
+                print("Could not extract bucket and key from event")
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({
+                        'error': 'Invalid event format'
+                    })
+                }
+
+            if self.is_delete_event(event):
+                return self.delete_video(bucket, key)
             
             print(f"Attempting to read JSON from S3: {bucket}/{key}")
             # 读取JSON文件内容
@@ -349,83 +655,18 @@ class VideoDataProcessor:
             
             print(f"Retrieved video_data keys: {list(video_data.keys())}")
             
-            # 从S3 key提取视频名称
-            # 文件路径格式: video_input/Friends.mp4/uuid/0/standard_output/0/result.json
-            # 视频名称在第二部分
-            parts = key.split('/')
-            if len(parts) >= 2:
-                video_name = parts[1]  # 第二部分是视频名称
-            else:
-                # 如果路径格式不符合预期，使用备用方法
-                video_name = self.extract_video_name(key)
-            
-            # 生成视频级别的embeddings
-            video_summary = ""
-            if 'video' in video_data and 'summary' in video_data['video']:
-                video_summary = video_data['video']['summary']
-            else:
-                # 尝试从chapters中获取summary
-                for chapter in video_data.get('chapters', []):
-                    if 'summary' in chapter:
-                        video_summary = chapter['summary']
-                        break
+            video_name = self.get_video_name(key)
 
-            # 准备章节数据数组
-            chapters_data = []
-            for chapter in video_data.get('chapters', []):
-                chapter_index = chapter.get('chapter_index', 0)
-                chapter_summary = chapter.get('summary', '')
+            # 章节较多的长视频拆分为多个分片，由并行的worker调用处理
+            chapters = video_data.get('chapters', [])
+            if INGEST_SHARDING and len(chapters) >= SHARD_MIN_CHAPTERS:
+                return self.dispatch_shards(bucket, key, video_name, chapters)
 
-                # 获取章节的转录文本
-                chapter_transcript = chapter.get('transcript', {})
-                transcript_text = ""
-
-                if isinstance(chapter_transcript, dict):
-                    if 'representation' in chapter_transcript and 'text' in chapter_transcript['representation']:
-                        transcript_text = chapter_transcript['representation']['text']
-                    elif 'text' in chapter_transcript:
-                        transcript_text = chapter_transcript['text']
-                else:
-                    transcript_text = str(chapter_transcript)
-
-                print(f"Chapter {chapter_index}: Transcript length: {len(transcript_text)}")
-
-                # 将转录文本分割成块
-                transcript_chunks = self.split_transcript_into_chunks(transcript_text)
-                print(f"Chapter {chapter_index}: Split transcript into {len(transcript_chunks)} chunks")
-
-                # 为每个块生成embeddings
-                chunk_data = []
-                for i, chunk in enumerate(transcript_chunks):
-                    chunk_embedding = self.get_embeddings(chunk)
-                    # 确保embedding是普通Python列表
-                    if hasattr(chunk_embedding, 'tolist'):
-                        chunk_embedding = chunk_embedding.tolist()
-                    chunk_data.append({
-                        'chunk_index': i,
-                        'text': chunk,
-                        'embedding': chunk_embedding
-                    })
+            # 生成视频级别的embeddings
+            video_summary = self.get_video_summary_text(video_data)
 
-                # 获取章节摘要的embedding并确保是普通Python列表
-                chapter_summary_embedding = self.get_embeddings(chapter_summary)
-                if hasattr(chapter_summary_embedding, 'tolist'):
-                    chapter_summary_embedding = chapter_summary_embedding.tolist()
-
-                chapter_data = {
-                    'chapter_index': chapter_index,
-                    'start_timestamp_millis': chapter.get('start_timestamp_millis'),
-                    'end_timestamp_millis': chapter.get('end_timestamp_millis'),
-                    'start_frame_index': chapter.get('start_frame_index'),
-                    'end_frame_index': chapter.get('end_frame_index'),
-                    'duration_millis': chapter.get('duration_millis'),
-                    'chapter_summary': {
-                        'text': chapter_summary,
-                        'embedding': chapter_summary_embedding
-                    },
-                    'transcript_chunks': chunk_data
-                }
-                chapters_data.append(chapter_data)
+            # 准备章节数据数组
+            chapters_data = [self.build_chapter_data(chapter) for chapter in chapters]
 
             # 获取视频摘要的embedding并确保是普通Python列表
             video_summary_embedding = self.get_embeddings(video_summary)
@@ -446,7 +687,7 @@ class VideoDataProcessor:
             flattened_data = self.flatten_video_data(doc_data, video_name)
 
             # 存储到DocumentDB的videodata集合
-            self.store_in_documentdb(flattened_data)
+            self.store_in_documentdb(flattened_data, source_key=key)
 
             return {
                 'statusCode': 200,
@@ -468,7 +709,159 @@ class VideoDataProcessor:
                 })
             }
 
+    def dispatch_shards(self, bucket, key, video_name, chapters):
+        """协调者模式：把章节按范围拆分成分片，异步调用本函数处理每个分片"""
+        chapters_per_shard = max(SHARD_CHAPTERS, math.ceil(len(chapters) / MAX_SHARDS))
+        ranges = [(start, min(start + chapters_per_shard, len(chapters)))
+                  for start in range(0, len(chapters), chapters_per_shard)]
+
+        db = docdb_pool.get_database('ingest')
+        job_id = ingest_jobs.job_id_for(bucket, key)
+        if not ingest_jobs.create_job(db, job_id, video_name, bucket, key, ranges):
+            # 同一个result.json的重复事件，分片已经派发过
+            print(f"Ingest job {job_id} for {bucket}/{key} already exists, not dispatching again")
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'Ingest job already dispatched', 'job_id': job_id})
+            }
+
+        # 替换已有视频时，分片写入的文档在收尾切换前不可见
+        if video_lifecycle.begin_ingest(db, self.segment_collections(video_name)[1], video_name, job_id):
+            self.bump_corpus_generation(db)
+
+        function_name = os.environ['AWS_LAMBDA_FUNCTION_NAME']
+        for shard, (start, end) in enumerate(ranges):
+            get_lambda_client().invoke(
+                FunctionName=function_name,
+                InvocationType='Event',
+                Payload=json.dumps({'ingest_shard': {
+                    'job_id': job_id,
+                    'shard': shard,
+                    'bucket': bucket,
+                    'key': key,
+                    'video_name': video_name,
+                    'chapter_start': start,
+                    'chapter_end': end
+                }})
+            )
+        ingest_jobs.mark_dispatched(db, job_id)
+        print(f"Dispatched {len(ranges)} shards of up to {chapters_per_shard} chapters for {video_name} (job {job_id})")
+
+        return {
+            'statusCode': 202,
+            'body': json.dumps({
+                'message': 'Dispatched chapter shards',
+                'job_id': job_id,
+                'video_name': video_name,
+                'total_chapters': len(chapters),
+                'shards': len(ranges)
+            })
+        }
+
+    def process_shard(self, shard_event):
+        """
+        Worker模式：处理一个章节范围
+
+        每个章节写入后记录检查点，重试时跳过已完成的章节；文档_id由任务和来源确定，
+        重复写入是幂等的。最后一个完成的分片负责写入视频摘要。失败时抛出异常，由Lambda异步调用重试。
+        """
+        job_id = shard_event['job_id']
+        shard = shard_event['shard']
+        video_name = shard_event['video_name']
+        db = docdb_pool.get_database('ingest')
+
+        video_data = self.get_json_from_s3(shard_event['bucket'], shard_event['key'])
+        if video_data is None:
+            raise RuntimeError(f"Failed to retrieve {shard_event['bucket']}/{shard_event['key']} from S3")
+
+        done = ingest_jobs.get_done_chapters(db, job_id, shard)
+        chapters = video_data.get('chapters', [])[shard_event['chapter_start']:shard_event['chapter_end']]
+        try:
+            for chapter in chapters:
+                chapter_index = chapter.get('chapter_index', 0)
+                if chapter_index in done:
+                    print(f"Shard {shard}: chapter {chapter_index} already stored, skipping")
+                    continue
+                chapter_data = self.build_chapter_data(chapter)
+                self.upsert_segments(video_name, self.flatten_chapter(chapter_data, video_name), job_id)
+                ingest_jobs.mark_chapter_done(db, job_id, shard, chapter_index)
+        except Exception as e:
+            ingest_jobs.mark_shard_failed(db, job_id, shard, str(e))
+            raise
+
+        print(f"Shard {shard} of job {job_id} stored {len(chapters)} chapters")
+        if ingest_jobs.complete_shard(db, job_id, shard):
+            self.finalize_job(db, job_id, video_name, video_data, shard_event['key'])
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'job_id': job_id, 'shard': shard, 'chapters': len(chapters)})
+        }
+
+    def finalize_job(self, db, job_id, video_name, video_data, source_key=None):
+        """所有分片成功后写入视频摘要、更新联想词，并切换到本次入库的文档"""
+        try:
+            video_summary = self.get_video_summary_text(video_data)
+            video_summary_embedding = self.get_embeddings(video_summary)
+            if hasattr(video_summary_embedding, 'tolist'):
+                video_summary_embedding = video_summary_embedding.tolist()
+            summary_doc = self.flatten_video_summary(
+                {'text': video_summary, 'embedding': video_summary_embedding}, video_name)
+            self.upsert_segments(video_name, [summary_doc], job_id)
+
+            # 联想词只需要文本，重新切分转录即可，无需再读回已写入的文档
+            text_items = [summary_doc]
+            for chapter in video_data.get('chapters', []):
+                text_items.append({'source': 'chapter_summary', 'text': chapter.get('summary', '')})
+                text_items.extend({'source': 'transcript_chunk', 'text': chunk}
+                                  for chunk in self.split_transcript_into_chunks(self.get_transcript_text(chapter)))
+            terms = []
+            try:
+                terms = self.update_suggest_terms(db, video_name, text_items)
+            except Exception as e:
+                print(f"Error updating suggest terms: {str(e)}")
+
+            self.swap_in(db, video_name, job_id, source_key, terms)
+            ingest_jobs.finish_job(db, job_id)
+            print(f"Ingest job {job_id} for {video_name} complete")
+        except Exception:
+            # 释放收尾权，让重试的调用可以再次收尾
+            ingest_jobs.release_finalize(db, job_id)
+            raise
+
+    def upsert_segments(self, video_name, segments, job_id):
+        """以确定性_id幂等写入文档（分片重试时不会产生重复数据），写入视频所在的库"""
+        segment_db, collection = self.segment_collections(video_name)
+        namespace = uuid.UUID(job_id)
+        for item in segments:
+            item['_id'] = str(uuid.uuid5(namespace, item['source']))
+            item['ingest_id'] = job_id
+
+        def upsert_batch(batch):
+            lean_requests = []
+            content_requests = []
+            for item in batch:
+                if docdb_pool.is_split_layout():
+                    lean, content = docdb_pool.split_segment(item)
+                    content_requests.append(pymongo.ReplaceOne({'_id': item['_id']}, content, upsert=True))
+                    lean_requests.append(pymongo.ReplaceOne({'_id': item['_id']}, lean, upsert=True))
+                else:
+                    lean_requests.append(pymongo.ReplaceOne({'_id': item['_id']}, item, upsert=True))
+            if content_requests:
+                segment_db[docdb_pool.CONTENT_COLLECTION_NAME].bulk_write(content_requests, ordered=False)
+            if lean_requests:
+                collection.bulk_write(lean_requests, ordered=False)
+
+        write_pacer.write(segments, upsert_batch)
+
 
 def lambda_handler(event, context):
+    global _cold_start
+    if _cold_start:
+        _cold_start = False
+        print(f"Cold start, startup profile (seconds): {json.dumps(startup_profile)}")
     processor = VideoDataProcessor()
+    # 协调者派发的分片事件
+    if 'ingest_shard' in event:
+        return processor.process_shard(event['ingest_shard'])
     return processor.process_video_data(event)
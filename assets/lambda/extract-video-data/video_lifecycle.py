@@ -0,0 +1,115 @@
+"""
+视频的替换与删除（video_catalog集合）
+
+每个视频一个目录文档，_id为视频名称：
+
+{
+    "_id": "Friends.mp4",
+    "state": "stable" | "replacing" | "deleting",
+    "active_ingest": "<ingest_id>",
+    "source_key": "video-output/Friends.mp4/<uuid>/0/standard_output/0/result.json",
+    "terms": ["..."]
+}
+
+每次入库写入的文档都带有ingest_id。搜索端对处于replacing状态的视频只返回
+ingest_id等于active_ingest的文档，对deleting状态的视频不返回任何文档，因此：
+
+- 替换：begin_ingest先把视频标记为replacing（新文档写入期间不可见），写完后
+  activate_ingest把active_ingest改为新的ingest_id——新旧文档的切换是一次单文档更新，
+  对搜索是原子的；随后delete_segments分批删除旧文档，最后标记为stable。
+- 删除：mark_deleting后视频立即从搜索结果中消失，再分批删除文档，最后删除目录文档。
+
+每次状态变化后调用者都要递增语料代数，搜索端按代数重新加载处于过渡状态的视频。
+"""
+import datetime
+import os
+
+import docdb_pool
+
+VIDEO_CATALOG_COLLECTION_NAME = os.environ.get('VIDEO_CATALOG_COLLECTION_NAME', 'video_catalog')
+# 每批删除的文档数
+VIDEO_DELETE_BATCH_SIZE = int(os.environ.get('VIDEO_DELETE_BATCH_SIZE', '200'))
+
+
+def _catalog(db):
+    return db[VIDEO_CATALOG_COLLECTION_NAME]
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+def get_entry(db, video_name):
+    return docdb_pool.with_retries(lambda: _catalog(db).find_one({'_id': video_name}))
+
+
+def begin_ingest(db, collection, video_name, ingest_id):
+    """
+    视频已有文档时标记为replacing，使新写入的文档在切换前不可见
+
+    返回True表示视频正在被替换（调用者需要递增语料代数）。首次入库的视频无需隐藏，
+    文档写入即可见。
+    """
+    entry = get_entry(db, video_name)
+    if entry is None and docdb_pool.with_retries(
+            lambda: collection.find_one({'video_name': video_name}, {'_id': 1})) is None:
+        return False
+    # 没有目录文档的旧数据不带ingest_id，active_ingest为None时这些文档保持可见
+    _catalog(db).update_one({'_id': video_name}, {
+        '$set': {'state': 'replacing', 'staged_ingest': ingest_id, 'updated_at': _now()},
+        '$setOnInsert': {'active_ingest': None, 'terms': []}
+    }, upsert=True)
+    return True
+
+
+def activate_ingest(db, video_name, ingest_id, source_key, terms):
+    """切换到新的入库结果，返回切换前的目录文档（首次入库时为None）"""
+    previous = get_entry(db, video_name)
+    _catalog(db).update_one({'_id': video_name}, {
+        '$set': {'state': 'replacing', 'active_ingest': ingest_id, 'source_key': source_key,
+                 'terms': list(terms), 'updated_at': _now()},
+        '$unset': {'staged_ingest': ''}
+    }, upsert=True)
+    return previous
+
+
+def mark_stable(db, video_name, ingest_id):
+    """旧文档删除完成；期间若已有更新的入库切换进来则保持原状态"""
+    _catalog(db).update_one({'_id': video_name, 'active_ingest': ingest_id, 'staged_ingest': {'$exists': False}},
+                            {'$set': {'state': 'stable', 'updated_at': _now()}})
+
+
+def mark_deleting(db, video_name):
+    """标记删除，返回删除前的目录文档"""
+    previous = get_entry(db, video_name)
+    _catalog(db).update_one({'_id': video_name}, {'$set': {'state': 'deleting', 'updated_at': _now()}},
+                            upsert=True)
+    return previous
+
+
+def remove_entry(db, video_name):
+    _catalog(db).delete_one({'_id': video_name, 'state': 'deleting'})
+
+
+def delete_segments(db, collection, video_name, pacer, keep_ingest_ids=()):
+    """
+    分批删除视频的文档（分离存储时同时删除内容集合中的文本），返回删除的文档数
+
+    db和collection为视频文档所在的数据库和集合，配置了SEARCH_SHARDS时是视频所在的数据分片。
+
+    保留keep_ingest_ids中各次入库写入的文档。按video_name查询走video_name/时间戳
+    复合索引，不会扫描整个集合；批次之间按写入限速器的速率间隔。
+    """
+    query = {'video_name': video_name}
+    if keep_ingest_ids:
+        query['ingest_id'] = {'$nin': list(keep_ingest_ids)}
+    ids = [doc['_id'] for doc in docdb_pool.with_retries(lambda: list(collection.find(query, {'_id': 1})))]
+
+    def delete_batch(batch):
+        # 先删除可被向量检索的精简文档，避免检索到已没有文本的片段
+        result = collection.delete_many({'_id': {'$in': batch}})
+        if docdb_pool.is_split_layout():
+            db[docdb_pool.CONTENT_COLLECTION_NAME].delete_many({'_id': {'$in': batch}})
+        return result.deleted_count
+
+    return sum(pacer.write(ids, delete_batch, batch_size=VIDEO_DELETE_BATCH_SIZE))
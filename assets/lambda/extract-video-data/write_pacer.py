@@ -0,0 +1,133 @@
+"""
+入库写入限速（ingest QoS）
+
+批量入库与搜索共用同一个DocumentDB实例，一次写入整个视频的文档还会触发IVF向量索引维护，
+使搜索延迟出现尖峰。INGEST_QOS=true时，写入按INGEST_WRITE_BATCH_SIZE拆成小批次，
+按速率（文档/秒）匀速写入，并根据观测到的写入延迟和副本延迟自适应调整速率（AIMD）：
+
+- 批次写入延迟的滑动平均超过INGEST_WRITE_LATENCY_TARGET_MS，或副本延迟超过
+  INGEST_MAX_REPLICA_LAG_MS时，速率减半，最低INGEST_MIN_DOCS_PER_SECOND；
+- 否则每批次加回最大速率的十分之一，最高INGEST_WRITE_DOCS_PER_SECOND。
+
+速率状态保存在容器内，热调用之间保留；多个入库容器并发时各自限速，总写入速率约为
+容器数乘以单容器速率。副本延迟来自CloudWatch的DBClusterReplicaLagMaximum指标，
+需要设置INGEST_REPLICA_LAG_CLUSTER并授予cloudwatch:GetMetricStatistics权限。
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import boto3
+
+INGEST_QOS = os.environ.get('INGEST_QOS', 'false').lower() == 'true'
+INGEST_WRITE_BATCH_SIZE = int(os.environ.get('INGEST_WRITE_BATCH_SIZE', '50'))
+INGEST_WRITE_DOCS_PER_SECOND = float(os.environ.get('INGEST_WRITE_DOCS_PER_SECOND', '200'))
+INGEST_MIN_DOCS_PER_SECOND = float(os.environ.get('INGEST_MIN_DOCS_PER_SECOND', '10'))
+INGEST_WRITE_LATENCY_TARGET_MS = float(os.environ.get('INGEST_WRITE_LATENCY_TARGET_MS', '250'))
+INGEST_MAX_REPLICA_LAG_MS = float(os.environ.get('INGEST_MAX_REPLICA_LAG_MS', '1000'))
+# DocumentDB集群标识；为空时不检查副本延迟
+INGEST_REPLICA_LAG_CLUSTER = os.environ.get('INGEST_REPLICA_LAG_CLUSTER', '')
+# CloudWatch指标按分钟聚合，读取结果缓存这么久
+REPLICA_LAG_CHECK_SECONDS = 60
+# 写入延迟滑动平均中最新一次观测的权重
+LATENCY_SMOOTHING = 0.3
+
+
+class WritePacer:
+    """按速率拆批写入，并根据写入延迟和副本延迟调整速率"""
+
+    def __init__(self, enabled=INGEST_QOS, batch_size=INGEST_WRITE_BATCH_SIZE,
+                 max_rate=INGEST_WRITE_DOCS_PER_SECOND, min_rate=INGEST_MIN_DOCS_PER_SECOND,
+                 latency_target_ms=INGEST_WRITE_LATENCY_TARGET_MS, max_lag_ms=INGEST_MAX_REPLICA_LAG_MS,
+                 lag_cluster=INGEST_REPLICA_LAG_CLUSTER):
+        self.enabled = enabled
+        self.batch_size = max(1, batch_size)
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.latency_target_ms = latency_target_ms
+        self.max_lag_ms = max_lag_ms
+        self.lag_cluster = lag_cluster
+        self.rate = max_rate
+        self.latency_ms = None
+        self.next_write_at = 0.0
+        self.lag = (None, 0.0)  # (副本延迟毫秒, 读取时间)
+        self.cloudwatch = None
+        self.lock = threading.Lock()
+
+    def write(self, items, write_batch, batch_size=None):
+        """
+        分批调用write_batch(batch)写入items，返回各批次返回值的列表
+
+        batch_size默认为INGEST_WRITE_BATCH_SIZE。未启用时不限速，且未指定batch_size时
+        一次写入全部items。
+        """
+        if not self.enabled and batch_size is None:
+            return [write_batch(items)] if items else []
+        batch_size = max(1, batch_size or self.batch_size)
+        results = []
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            if not self.enabled:
+                results.append(write_batch(batch))
+                continue
+            self.wait_turn(len(batch))
+            started = time.monotonic()
+            results.append(write_batch(batch))
+            self.observe((time.monotonic() - started) * 1000)
+        return results
+
+    def wait_turn(self, count):
+        """等到按当前速率轮到这count个文档写入"""
+        with self.lock:
+            now = time.monotonic()
+            start_at = max(now, self.next_write_at)
+            self.next_write_at = start_at + count / self.rate
+        if start_at > now:
+            time.sleep(start_at - now)
+
+    def observe(self, latency_ms):
+        """记录一次批次写入延迟并调整速率"""
+        lag_ms = self.replica_lag_ms()
+        with self.lock:
+            if self.latency_ms is None:
+                self.latency_ms = latency_ms
+            else:
+                self.latency_ms = LATENCY_SMOOTHING * latency_ms + (1 - LATENCY_SMOOTHING) * self.latency_ms
+            previous = self.rate
+            if self.latency_ms > self.latency_target_ms or (lag_ms is not None and lag_ms > self.max_lag_ms):
+                self.rate = max(self.min_rate, self.rate / 2)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+            rate, smoothed = self.rate, self.latency_ms
+        if rate < previous:
+            print(f"Slowing ingest writes to {rate:.1f} docs/s "
+                  f"(write latency {smoothed:.0f} ms, replica lag {lag_ms if lag_ms is not None else 'n/a'} ms)")
+
+    def replica_lag_ms(self):
+        """集群最大副本延迟（毫秒），未配置或读取失败时返回None"""
+        if not self.lag_cluster:
+            return None
+        lag_ms, read_at = self.lag
+        if time.monotonic() - read_at < REPLICA_LAG_CHECK_SECONDS:
+            return lag_ms
+        try:
+            if self.cloudwatch is None:
+                self.cloudwatch = boto3.client('cloudwatch')
+            now = datetime.now(timezone.utc)
+            response = self.cloudwatch.get_metric_statistics(
+                Namespace='AWS/DocDB',
+                MetricName='DBClusterReplicaLagMaximum',
+                Dimensions=[{'Name': 'DBClusterIdentifier', 'Value': self.lag_cluster}],
+                StartTime=now - timedelta(minutes=5),
+                EndTime=now,
+                Period=60,
+                Statistics=['Maximum']
+            )
+            datapoints = sorted(response.get('Datapoints', []), key=lambda point: point['Timestamp'])
+            lag_ms = datapoints[-1]['Maximum'] if datapoints else None
+        except Exception as e:
+            print(f"Error reading replica lag: {str(e)}")
+            lag_ms = None
+        self.lag = (lag_ms, time.monotonic())
+        return lag_ms
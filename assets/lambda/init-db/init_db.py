@@ -2,7 +2,9 @@ import json
 import boto3
 import os
 import time
-from pymongo import MongoClient
+import docdb_pool
+import reindex
+from embedding_backends import get_embedding_backend
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 import logging
 import socket
@@ -13,15 +15,58 @@ logging.basicConfig(level=getattr(logging, log_level),
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def index_segment_store(db, collection_name, dimensions):
+    """(Re)create the segment indexes on collection_name, and on the content store in the split layout"""
+    collection = db[collection_name]
+
+    # The vector index is sized for the configured embedding backend;
+    # refuse to rebuild it over vectors of another size (migrate with reindex instead)
+    sample = collection.find_one({"embedding.0": {"$exists": True}}, {"embedding": 1})
+    if sample and len(sample['embedding']) != dimensions:
+        raise ValueError(f"{collection_name} holds {len(sample['embedding'])}-dimension embeddings but "
+                         f"{dimensions} are configured; reindex into a new collection to change the size")
+
+    # 获取现有索引
+    existing_indexes = collection.index_information()
+    logger.info(f"Existing indexes: {existing_indexes}")
+
+    # 删除任何可能冲突的索引
+    for index_name in list(existing_indexes.keys()):
+        if index_name != '_id_':  # 保留主键索引
+            logger.info(f"Dropping index: {index_name}")
+            try:
+                collection.drop_index(index_name)
+            except Exception as e:
+                logger.warning(f"Error dropping index {index_name}: {str(e)}")
+
+    # Create text, timestamp, per-video and vector indexes; in the split
+    # layout the text index lives on the content store
+    split = docdb_pool.is_split_layout()
+    docdb_pool.create_segment_indexes(collection, dimensions, text_index=not split)
+    if split:
+        try:
+            docdb_pool.create_content_indexes(db[docdb_pool.CONTENT_COLLECTION_NAME])
+        except Exception as e:
+            logger.warning(f"Error creating content store indexes: {str(e)}")
+
 def lambda_handler(event, context):
+    # Manual invocations: re-embed the corpus into a new collection and
+    # compare its recall against the current one (see reindex.py)
+    if isinstance(event, dict) and event.get('action') == 'reindex':
+        return reindex.run(event, context)
+    if isinstance(event, dict) and event.get('action') == 'compare_recall':
+        return reindex.compare_recall(event)
+    if isinstance(event, dict) and event.get('action') == 'split_layout':
+        return reindex.split_layout(event, context)
+    if isinstance(event, dict) and event.get('action') == 'reconcile':
+        return reindex.reconcile(event, context)
+
     max_retries = 5
     retry_delay = 30  # 秒
     
     for attempt in range(max_retries):
         try:
             # Get connection information from environment variables
-            username = os.environ.get('DB_USERNAME')
-            password = os.environ.get('DB_PASSWORD')
             db_endpoint = os.environ.get('DB_ENDPOINT')
             db_port = os.environ.get('DB_PORT', '27017')
             db_name = os.environ.get('DB_NAME', 'VideoData')
@@ -40,18 +85,8 @@ def lambda_handler(event, context):
             except Exception as dns_error:
                 logger.warning(f"DNS resolution failed or skipped: {str(dns_error)}")
             
-            # 构建 MongoDB URI
-            mongodb_uri = f"mongodb://{username}:{password}@{db_endpoint}:{db_port}/?replicaSet=rs0&readPreference=secondaryPreferred&retryWrites=false&ssl=false"
-            logger.info(f"MongoDB URI (redacted): mongodb://{username}:****@{db_endpoint}:{db_port}/?replicaSet=rs0&readPreference=secondaryPreferred&retryWrites=false&ssl=false")
-            
-            # Connect to MongoDB/DocumentDB with increased timeouts
-            client = MongoClient(
-                mongodb_uri, 
-                socketTimeoutMS=300000,  # 5分钟
-                connectTimeoutMS=300000,  # 5分钟
-                serverSelectionTimeoutMS=300000,  # 5分钟
-                ssl=False  # 禁用SSL/TLS
-            )
+            # Connect through the shared pool module (admin profile: primary reads, long timeouts)
+            client = docdb_pool.get_client('admin')
             
             # Test connection
             logger.info(f"Attempt {attempt + 1}: Testing connection to DocumentDB...")
@@ -59,46 +94,45 @@ def lambda_handler(event, context):
             logger.info("Connection to DocumentDB successful")
             
             db = client[db_name]
-            collection = db[collection_name]
             
-            # 获取现有索引
-            existing_indexes = collection.index_information()
-            logger.info(f"Existing indexes: {existing_indexes}")
-            
-            # 删除任何可能冲突的索引
-            for index_name in list(existing_indexes.keys()):
-                if index_name != '_id_':  # 保留主键索引
-                    logger.info(f"Dropping index: {index_name}")
-                    try:
-                        collection.drop_index(index_name)
-                    except Exception as e:
-                        logger.warning(f"Error dropping index {index_name}: {str(e)}")
+            # Segment collections live on each shard when SEARCH_SHARDS is set,
+            # and in the project database otherwise
+            dimensions = get_embedding_backend().dimensions
+            if docdb_pool.is_sharded():
+                for shard in docdb_pool.shard_names():
+                    logger.info(f"Indexing segment collections on shard {shard}...")
+                    index_segment_store(docdb_pool.get_shard_database(shard, 'admin'), collection_name, dimensions)
+            else:
+                index_segment_store(db, collection_name, dimensions)
 
-            # Create text index for text search with specific name
-            logger.info("Creating text index...")
-            collection.create_index([("text", "text")], 
-                                   name="text_index")
-            
-            # Create timestamp index
-            logger.info("Creating timestamp index...")
-            collection.create_index([("start_timestamp_millis", 1), ("end_timestamp_millis", 1)],
-                                   name="start_timestamp_millis_1_end_timestamp_millis_1")
-            
-            # Create vector index for embeddings (for DocumentDB 5.0.0)
-            logger.info("Creating vector index for embeddings...")
+            # Create TTL index on the shared search response cache
+            cache_collection_name = os.environ.get('CACHE_COLLECTION_NAME', 'search_cache')
+            cache_ttl_seconds = int(os.environ.get('SEARCH_CACHE_TTL_SECONDS', '3600'))
+            logger.info("Creating search cache TTL index...")
+            try:
+                db[cache_collection_name].create_index([("created_at", 1)],
+                                                       name="created_at_ttl",
+                                                       expireAfterSeconds=cache_ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Error creating search cache TTL index: {str(e)}")
+
+            # Create TTL index on the rate limit buckets and in-flight counters
+            rate_limit_collection_name = os.environ.get('RATE_LIMIT_COLLECTION_NAME', 'rate_limits')
+            logger.info("Creating rate limit TTL index...")
+            try:
+                db[rate_limit_collection_name].create_index([("expires_at", 1)],
+                                                            name="expires_at_ttl",
+                                                            expireAfterSeconds=0)
+            except Exception as e:
+                logger.warning(f"Error creating rate limit TTL index: {str(e)}")
+
+            # Create weight index on the typeahead suggestions, loaded highest weight first
+            suggest_collection_name = os.environ.get('SUGGEST_COLLECTION_NAME', 'suggest_terms')
+            logger.info("Creating suggest weight index...")
             try:
-                collection.create_index([("embedding", "vector")],
-                                       name="vector_index",
-                                       vectorOptions={
-                                           "type": "ivfflat",
-                                           "dimensions": 1024,
-                                           "similarity": "cosine",
-                                           "lists": 1000
-                                       })
-                logger.info("Vector index created successfully")
+                db[suggest_collection_name].create_index([("weight", -1)], name="weight_-1")
             except Exception as e:
-                logger.error(f"Error creating vector index: {str(e)}")
-                logger.warning("Failed to create vector index. Make sure DocumentDB version supports vector indexes (5.0.0+)")
+                logger.warning(f"Error creating suggest weight index: {str(e)}")
 
             logger.info("Database initialization completed successfully")
             
@@ -0,0 +1,335 @@
+"""
+Re-embed the segments collection into a new collection with another embedding backend
+
+Invoke the init-db function manually with:
+
+{
+    "action": "reindex",
+    "target_collection": "videodata_onnx",
+    "backend": "onnx",                  # optional, default EMBEDDING_BACKEND
+    "dimensions": 256,                  # optional, e.g. a smaller Titan v2 output
+    "source_collection": "videodata",   # optional, default COLLECTION_NAME
+    "batch_size": 32,                   # optional
+    "resume_after": "<_id>"             # optional, from a previous "partial" response
+}
+
+The source collection keeps serving searches while the target is filled. A
+run that nears the Lambda timeout returns "partial" with a resume_after
+cursor; invoke again with it until "complete". Writes are idempotent upserts
+by _id, so re-running a batch is harmless.
+
+The copy is a single pass in _id order, so videos ingested, replaced or
+deleted while it runs are missed or left behind. The completing run
+therefore reconciles the target with the source per (video_name, ingest_id):
+groups gone from the source are deleted from the target, and segments the
+target lacks are embedded and added. To switch over, pause ingest (e.g. set
+the ingest function's reserved concurrency to 0), reconcile once more with
+
+{
+    "action": "reconcile",
+    "target_collection": "videodata_onnx",
+    "backend": "onnx",                  # backend/dimensions of the target, as above
+    "source_collection": "videodata"    # optional, default COLLECTION_NAME
+}
+
+then point the search and ingest functions' COLLECTION_NAME (and
+EMBEDDING_BACKEND) at the target and resume ingest.
+
+Before switching, check how far the new vectors move the results with
+
+{
+    "action": "compare_recall",
+    "target_collection": "videodata_256",
+    "dimensions": 256,                  # backend/dimensions of the target, as above
+    "queries": ["..."],                 # optional, default: sampled segment texts
+    "sample_size": 50,                  # optional
+    "k": 10                             # optional
+}
+
+which reports the overlap of each query's top k between the two collections.
+
+To move an existing collection to the split layout (SEGMENT_LAYOUT=split),
+run
+
+{
+    "action": "split_layout",
+    "source_collection": "videodata",   # optional, default COLLECTION_NAME
+    "batch_size": 32,                   # optional
+    "resume_after": "<_id>"             # optional, as above
+}
+
+which copies each segment's text to CONTENT_COLLECTION_NAME and then removes
+it from the segments collection, batch by batch. Set SEGMENT_LAYOUT=split on
+every function (and run init-db for the content store indexes) before
+starting it: search hydrates text from either place, but until the move
+finishes the lexical leg only sees the texts already in the content store.
+
+With SEARCH_SHARDS set, the segment collections live on each shard, so every
+action above takes a "shard" naming the one to work on and is run once per
+shard, each with its own resume_after cursor. compare_recall then measures
+the shard's own top k.
+"""
+import logging
+import os
+from collections import Counter
+
+from pymongo import ReplaceOne, UpdateOne
+
+import docdb_pool
+from embedding_backends import get_embedding_backend
+
+logger = logging.getLogger(__name__)
+
+REINDEX_BATCH_SIZE = int(os.environ.get('REINDEX_BATCH_SIZE', '32'))
+# Stop taking new batches when less than this much of the invocation remains
+REINDEX_STOP_MARGIN_MS = int(os.environ.get('REINDEX_STOP_MARGIN_MS', '60000'))
+META_COLLECTION_NAME = os.environ.get('META_COLLECTION_NAME', 'corpus_meta')
+GENERATION_DOC_ID = 'corpus_generation'
+
+
+def _segment_database(event):
+    """The database holding the segment collections: the project one, or the event's shard"""
+    if not docdb_pool.is_sharded():
+        return docdb_pool.get_database('admin')
+    shard = event.get('shard')
+    if shard not in docdb_pool.shard_names():
+        raise ValueError(f"{event.get('action')} with SEARCH_SHARDS set needs a shard, "
+                         f"one of {docdb_pool.shard_names()}")
+    return docdb_pool.get_shard_database(shard, 'admin')
+
+
+def _shard_field(event):
+    return {'shard': event.get('shard')} if docdb_pool.is_sharded() else {}
+
+
+def _bump_corpus_generation():
+    # Corpus metadata stays on the project database when sharded
+    docdb_pool.get_database('admin')[META_COLLECTION_NAME].update_one(
+        {"_id": GENERATION_DOC_ID}, {"$inc": {"generation": 1}}, upsert=True)
+
+
+def run(event, context):
+    source_name = event.get('source_collection') or os.environ.get('COLLECTION_NAME', 'videodata')
+    target_name = event.get('target_collection')
+    if not target_name or target_name == source_name:
+        raise ValueError("reindex needs a target_collection different from the source collection")
+    batch_size = int(event.get('batch_size') or REINDEX_BATCH_SIZE)
+    resume_after = event.get('resume_after')
+
+    backend = get_embedding_backend(event.get('backend'), dimensions=event.get('dimensions'))
+    db = _segment_database(event)
+    source = db[source_name]
+    target = db[target_name]
+
+    if resume_after is None:
+        # Build the indexes up front, sized for the new backend; in the split
+        # layout the text stays in the shared content store under the same _id
+        docdb_pool.create_segment_indexes(target, backend.dimensions, text_index=not docdb_pool.is_split_layout())
+
+    logger.info(f"Reindexing {source_name} -> {target_name} with {backend.backend_id}"
+                f"{f' after {resume_after}' if resume_after else ''}")
+
+    reindexed, resume_after = _for_each_batch(
+        source, {"embedding": 0}, batch_size, resume_after, context,
+        lambda docs: _reembed_batch(db, target, backend, docs)
+    )
+    result = {'reindexed': reindexed, 'backend': backend.backend_id, 'target_collection': target_name,
+              **_shard_field(event)}
+    if resume_after is not None:
+        return {'status': 'partial', 'resume_after': resume_after, **result}
+
+    # Catch up with the ingests and deletes that ran behind the cursor
+    result.update(_reconcile(db, source, target, backend, batch_size))
+
+    # Cached search responses must not outlive the swap to the new collection
+    _bump_corpus_generation()
+
+    logger.info(f"Reindex complete: {reindexed} documents written to {target_name}, {result}")
+    return {'status': 'complete', **result}
+
+
+def reconcile(event, context):
+    """Bring a reindexed target up to date with its source (see the module docstring)"""
+    source_name = event.get('source_collection') or os.environ.get('COLLECTION_NAME', 'videodata')
+    target_name = event.get('target_collection')
+    if not target_name or target_name == source_name:
+        raise ValueError("reconcile needs a target_collection different from the source collection")
+    batch_size = int(event.get('batch_size') or REINDEX_BATCH_SIZE)
+
+    backend = get_embedding_backend(event.get('backend'), dimensions=event.get('dimensions'))
+    db = _segment_database(event)
+    result = _reconcile(db, db[source_name], db[target_name], backend, batch_size)
+    _bump_corpus_generation()
+    logger.info(f"Reconciled {target_name} with {source_name}: {result}")
+    return {'status': 'complete', 'target_collection': target_name, **_shard_field(event), **result}
+
+
+def _ingest_groups(collection):
+    """Segment count per (video_name, ingest_id); segments from before ingest_id group under None"""
+    return Counter((doc.get('video_name'), doc.get('ingest_id'))
+                   for doc in collection.find({}, {"video_name": 1, "ingest_id": 1}))
+
+
+def _reconcile(db, source, target, backend, batch_size):
+    """
+    Delete target segments whose (video_name, ingest_id) group left the source,
+    and re-embed the source segments missing from groups that differ
+
+    Every ingest writes a video's segments under a new ingest_id, so a group
+    with the same count on both sides holds the same segments.
+    """
+    source_groups = _ingest_groups(source)
+    target_groups = _ingest_groups(target)
+    removed = added = 0
+    for video_name, ingest_id in target_groups.keys() - source_groups.keys():
+        removed += target.delete_many({"video_name": video_name, "ingest_id": ingest_id}).deleted_count
+
+    for (video_name, ingest_id), count in source_groups.items():
+        if target_groups.get((video_name, ingest_id)) == count:
+            continue
+        group = {"video_name": video_name, "ingest_id": ingest_id}
+        source_ids = {doc['_id'] for doc in source.find(group, {"_id": 1})}
+        target_ids = {doc['_id'] for doc in target.find(group, {"_id": 1})}
+        stale = list(target_ids - source_ids)
+        if stale:
+            removed += target.delete_many({"_id": {"$in": stale}}).deleted_count
+        missing = sorted(source_ids - target_ids)
+        for start in range(0, len(missing), batch_size):
+            docs = list(source.find({"_id": {"$in": missing[start:start + batch_size]}}, {"embedding": 0}))
+            added += _reembed_batch(db, target, backend, docs)
+    return {'reconciled_added': added, 'reconciled_removed': removed}
+
+
+def split_layout(event, context):
+    """Move segment text from the segments collection to the content store"""
+    source_name = event.get('source_collection') or os.environ.get('COLLECTION_NAME', 'videodata')
+    batch_size = int(event.get('batch_size') or REINDEX_BATCH_SIZE)
+
+    db = _segment_database(event)
+    source = db[source_name]
+    content = db[docdb_pool.CONTENT_COLLECTION_NAME]
+
+    def move_batch(docs):
+        # Copy first, so a segment's text is always in at least one place
+        content.bulk_write([ReplaceOne({"_id": doc['_id']}, docdb_pool.split_segment(doc)[1], upsert=True)
+                            for doc in docs], ordered=False)
+        source.bulk_write([UpdateOne({"_id": doc['_id']}, {"$unset": {"text": ""}}) for doc in docs],
+                          ordered=False)
+        return len(docs)
+
+    moved, resume_after = _for_each_batch(
+        source, {field: 1 for field in docdb_pool.CONTENT_FIELDS}, batch_size, event.get('resume_after'),
+        context, move_batch, query={"text": {"$exists": True}}
+    )
+    result = {'moved': moved, 'content_collection': docdb_pool.CONTENT_COLLECTION_NAME, **_shard_field(event)}
+    if resume_after is not None:
+        return {'status': 'partial', 'resume_after': resume_after, **result}
+    logger.info(f"Split layout complete: {moved} texts moved out of {source_name}")
+    return {'status': 'complete', **result}
+
+
+def _for_each_batch(source, projection, batch_size, resume_after, context, handle_batch, query=None):
+    """
+    Feed the source documents to handle_batch in _id order, resuming after
+    resume_after, until done or the invocation nears its timeout
+
+    Returns:
+        tuple: (documents handled, _id to resume after, or None when done)
+    """
+    query = dict(query or {})
+    if resume_after is not None:
+        query["_id"] = {"$gt": resume_after}
+    cursor = source.find(query, projection).sort("_id", 1).batch_size(batch_size)
+
+    handled = 0
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            handled += handle_batch(batch)
+            last_id = batch[-1]['_id']
+            batch = []
+            if context is not None and context.get_remaining_time_in_millis() < REINDEX_STOP_MARGIN_MS:
+                cursor.close()
+                logger.info(f"Stopping early after {handled} documents, resume after {last_id}")
+                return handled, last_id
+    if batch:
+        handled += handle_batch(batch)
+    return handled, None
+
+
+def _reembed_batch(db, target, backend, docs):
+    # In the split layout the source is lean and the text comes from the content store
+    missing = [doc['_id'] for doc in docs if 'text' not in doc]
+    if missing:
+        texts = {doc['_id']: doc.get('text', '')
+                 for doc in db[docdb_pool.CONTENT_COLLECTION_NAME].find({"_id": {"$in": missing}}, {"text": 1})}
+        for doc in docs:
+            doc.setdefault('text', texts.get(doc['_id'], ''))
+
+    embeddings = backend.embed_many([doc.get('text', '') for doc in docs])
+    requests = []
+    for doc, embedding in zip(docs, embeddings):
+        doc['embedding'] = embedding
+        doc['embedding_backend'] = backend.backend_id
+        if docdb_pool.is_split_layout():
+            doc = docdb_pool.split_segment(doc)[0]
+        requests.append(ReplaceOne({"_id": doc['_id']}, doc, upsert=True))
+    target.bulk_write(requests, ordered=False)
+    return len(requests)
+
+
+def compare_recall(event):
+    """
+    Overlap of the top k between the source (current) and target (reindexed)
+    collections, searched with their own backends, as recall@k of the target
+    measured against the results served today
+    """
+    source_name = event.get('source_collection') or os.environ.get('COLLECTION_NAME', 'videodata')
+    target_name = event.get('target_collection')
+    if not target_name:
+        raise ValueError("compare_recall needs a target_collection")
+    k = int(event.get('k') or 10)
+
+    db = _segment_database(event)
+    source_backend = get_embedding_backend()
+    target_backend = get_embedding_backend(event.get('backend'), dimensions=event.get('dimensions'))
+
+    queries = event.get('queries')
+    if not queries:
+        sample_size = int(event.get('sample_size') or 50)
+        text_collection = (db[docdb_pool.CONTENT_COLLECTION_NAME] if docdb_pool.is_split_layout()
+                           else db[source_name])
+        sampled = text_collection.aggregate([{"$sample": {"size": sample_size}}, {"$project": {"text": 1}}])
+        queries = [doc['text'][:300] for doc in sampled if doc.get('text')]
+
+    recalls = []
+    for query in queries:
+        expected = _top_ids(db[source_name], source_backend, source_backend.embed(query), k)
+        if not expected:
+            continue
+        found = _top_ids(db[target_name], target_backend, target_backend.embed(query), k)
+        recalls.append(len(expected & found) / len(expected))
+
+    report = {
+        'queries': len(recalls),
+        'k': k,
+        'source': {'collection': source_name, 'backend': source_backend.backend_id},
+        'target': {'collection': target_name, 'backend': target_backend.backend_id},
+        'mean_recall': round(sum(recalls) / len(recalls), 4) if recalls else None,
+        'min_recall': round(min(recalls), 4) if recalls else None,
+        **_shard_field(event),
+    }
+    logger.info(f"Recall comparison: {report}")
+    return report
+
+
+def _top_ids(collection, backend, embedding, k):
+    pipeline = [
+        {"$search": {"vectorSearch": {"vector": embedding, "path": "embedding", "similarity": "cosine",
+                                      "k": k * 3, "efSearch": 64}}},
+        {"$match": backend.document_filter()},
+        {"$limit": k},
+        {"$project": {"_id": 1}}
+    ]
+    return {doc['_id'] for doc in collection.aggregate(pipeline)}
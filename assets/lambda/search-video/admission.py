@@ -0,0 +1,365 @@
+"""
+Admission control in front of the search path
+
+Two checks run before a request touches DocumentDB or Bedrock:
+
+- Per-client rate limit: a token bucket per API key (or source IP when the
+  request carries no key), refilled at RATE_LIMIT_RPS up to RATE_LIMIT_BURST.
+  The bucket lives in DocumentDB (RATE_LIMIT_COLLECTION_NAME) so every
+  container enforces the same limit. It is kept as a GCRA "theoretical
+  arrival time", which is equivalent to a token bucket and needs one field
+  updated by compare-and-set. A container takes RATE_LIMIT_LEASE tokens at a
+  time and spends them locally for up to RATE_LIMIT_LEASE_SECONDS, so most
+  requests cost no store round trip. Excess requests get a 429.
+- Overload: the number of searches in flight across all containers, counted
+  in the same collection per ADMISSION_WINDOW_SECONDS window (the window must
+  outlast the longest request, so an invocation killed before it could
+  decrement drops out after two windows). Above ADMISSION_MAX_INFLIGHT a
+  request gets a 503; batches are shed first, above ADMISSION_BATCH_SHARE of
+  the limit. The count costs two primary writes per admitted search (one in,
+  one out) plus a primary read of the previous window at most once a second
+  per container.
+
+Both responses carry Retry-After. The store is read and written on the
+primary: a lagging secondary would hand the compare-and-set a stale bucket
+and refuse requests the limit allows. If the store is unreachable within
+ADMISSION_STORE_TIMEOUT_MS, rate limiting falls back to a bucket per
+container and the overload check to a cap of ADMISSION_LOCAL_MAX_INFLIGHT
+queries in flight in this container, so a failover or network blip does not
+shed searches the secondaries could still serve. Only after
+ADMISSION_SHED_AFTER_FAILURES consecutive counter failures is the counter's
+own cluster taken to be overloaded and requests shed. A decrement that fails
+is kept and retried with the next release, so it does not inflate the count
+for the rest of its window.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pymongo
+from pymongo import ReadPreference
+from pymongo.errors import DuplicateKeyError
+
+import docdb_pool
+
+logger = logging.getLogger(__name__)
+
+# Per-client limit; 0 disables rate limiting
+RATE_LIMIT_RPS = float(os.environ.get('RATE_LIMIT_RPS', '0'))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', '20'))
+# Tokens taken from the shared bucket at once and how long unused ones stay valid
+RATE_LIMIT_LEASE = int(os.environ.get('RATE_LIMIT_LEASE', '5'))
+RATE_LIMIT_LEASE_SECONDS = float(os.environ.get('RATE_LIMIT_LEASE_SECONDS', '1'))
+RATE_LIMIT_SHARED = os.environ.get('RATE_LIMIT_SHARED', 'true').lower() == 'true'
+RATE_LIMIT_COLLECTION_NAME = os.environ.get('RATE_LIMIT_COLLECTION_NAME', 'rate_limits')
+# Searches in flight across all containers; 0 disables overload shedding
+ADMISSION_MAX_INFLIGHT = int(os.environ.get('ADMISSION_MAX_INFLIGHT', '0'))
+ADMISSION_BATCH_SHARE = float(os.environ.get('ADMISSION_BATCH_SHARE', '0.8'))
+ADMISSION_WINDOW_SECONDS = int(os.environ.get('ADMISSION_WINDOW_SECONDS', '60'))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.environ.get('ADMISSION_RETRY_AFTER_SECONDS', '2'))
+ADMISSION_STORE_TIMEOUT_MS = int(os.environ.get('ADMISSION_STORE_TIMEOUT_MS', '100'))
+# Queries in flight in one container while the in-flight counter is unreachable; 0 for no cap
+ADMISSION_LOCAL_MAX_INFLIGHT = int(os.environ.get('ADMISSION_LOCAL_MAX_INFLIGHT', '50'))
+# Consecutive in-flight counter failures before requests are shed; 0 never sheds on failures
+ADMISSION_SHED_AFTER_FAILURES = int(os.environ.get('ADMISSION_SHED_AFTER_FAILURES', '10'))
+
+# Lost compare-and-set races before a request is refused
+CAS_ATTEMPTS = 3
+# How long the previous window's in-flight count is reused before it is read again
+PREVIOUS_WINDOW_CACHE_SECONDS = 1.0
+
+
+def _store_database():
+    """The admission store, read on the primary so compare-and-set sees the latest values"""
+    return docdb_pool.get_database().with_options(read_preference=ReadPreference.PRIMARY)
+
+
+def _expiry(seconds_from_now):
+    return datetime.fromtimestamp(time.time() + seconds_from_now, timezone.utc)
+
+
+def client_id(event):
+    """API key (hashed, never stored in clear) or source IP of an API Gateway proxy event"""
+    request_context = event.get('requestContext') or {}
+    identity = request_context.get('identity') or {}
+    headers = {str(name).lower(): value for name, value in (event.get('headers') or {}).items()}
+    api_key = identity.get('apiKey') or headers.get('x-api-key')
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:24]
+    source_ip = identity.get('sourceIp') or (headers.get('x-forwarded-for') or '').split(',')[0].strip()
+    return f"ip:{source_ip}" if source_ip else 'anonymous'
+
+
+def request_cost(body):
+    """Tokens a request spends: one per query"""
+    queries = body.get('queries')
+    return max(1, len(queries)) if isinstance(queries, list) else 1
+
+
+class TokenBucket:
+    """Thread-safe GCRA token bucket: rate tokens per second, up to burst at once"""
+
+    def __init__(self, rate, burst):
+        self.interval = 1.0 / rate
+        self.tolerance = burst * self.interval
+        self.tat = 0.0
+        self.lock = threading.Lock()
+
+    def take(self, cost=1):
+        """Return (allowed, retry_after_seconds)"""
+        now = time.time()
+        with self.lock:
+            new_tat = max(self.tat, now) + cost * self.interval
+            if new_tat - now > self.tolerance:
+                return False, new_tat - self.tolerance - now
+            self.tat = new_tat
+            return True, 0.0
+
+
+class RateLimiter:
+    """Per-client token buckets kept in DocumentDB, spent through short local leases"""
+
+    def __init__(self, rate=RATE_LIMIT_RPS, burst=RATE_LIMIT_BURST, lease=RATE_LIMIT_LEASE,
+                 lease_seconds=RATE_LIMIT_LEASE_SECONDS, shared=RATE_LIMIT_SHARED):
+        self.rate = rate
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.tolerance = burst * self.interval
+        self.burst = burst
+        self.lease = max(1, lease)
+        self.lease_seconds = lease_seconds
+        self.shared = shared
+        # client -> [tokens left, expires_at]
+        self.leases = {}
+        # Used when the store is disabled or unreachable
+        self.local_buckets = {}
+        self.lock = threading.Lock()
+
+    def enabled(self):
+        return self.rate > 0
+
+    def take(self, db, client, cost=1):
+        """Return (allowed, retry_after_seconds) for a request of the given cost"""
+        now = time.time()
+        with self.lock:
+            lease = self.leases.get(client)
+            if lease and lease[1] > now and lease[0] >= cost:
+                lease[0] -= cost
+                return True, 0.0
+
+        if self.shared:
+            try:
+                with pymongo.timeout(ADMISSION_STORE_TIMEOUT_MS / 1000.0):
+                    granted, retry_after = self._take_shared(db[RATE_LIMIT_COLLECTION_NAME], client, cost)
+                if granted:
+                    with self.lock:
+                        self.leases[client] = [granted - cost, time.time() + self.lease_seconds]
+                    return True, 0.0
+                return False, retry_after
+            except Exception as e:
+                logger.warning(f"Rate limit store unavailable, limiting per container: {str(e)}")
+
+        with self.lock:
+            bucket = self.local_buckets.get(client)
+            if bucket is None:
+                bucket = self.local_buckets[client] = TokenBucket(self.rate, self.burst)
+        return bucket.take(cost)
+
+    def _take_shared(self, collection, client, cost):
+        """
+        Take a lease (or at least cost tokens) from the shared bucket; return
+        (tokens granted, retry_after_seconds)
+        """
+        key = f"bucket:{client}"
+        for _ in range(CAS_ATTEMPTS):
+            doc = collection.find_one({'_id': key})
+            now = time.time()
+            tat = max(doc['tat'] if doc else 0.0, now)
+            for amount in sorted({max(cost, self.lease), cost}, reverse=True):
+                new_tat = tat + amount * self.interval
+                if new_tat - now <= self.tolerance:
+                    break
+            else:
+                return 0, tat + cost * self.interval - self.tolerance - now
+
+            # The document can go once the bucket would be full again
+            fields = {'tat': new_tat, 'expires_at': _expiry(new_tat - now)}
+            if doc is None:
+                try:
+                    collection.insert_one({'_id': key, **fields})
+                    return amount, 0.0
+                except DuplicateKeyError:
+                    continue
+            result = collection.update_one({'_id': key, 'tat': doc['tat']}, {'$set': fields})
+            if result.modified_count == 1:
+                return amount, 0.0
+        # Other containers keep winning the race for this client's bucket: it is busy
+        return 0, cost * self.interval
+
+
+class InflightCounter:
+    """Searches in flight across all containers, counted per time window"""
+
+    def __init__(self, window_seconds=ADMISSION_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self.previous = (None, 0, 0.0)  # (window, count, read_at)
+        self.lock = threading.Lock()
+
+    def enter(self, db, cost):
+        """Count a request in; return (window, in-flight count including it)"""
+        collection = db[RATE_LIMIT_COLLECTION_NAME]
+        window = int(time.time() // self.window_seconds)
+        doc = collection.find_one_and_update(
+            {'_id': f"inflight:{window}"},
+            {'$inc': {'count': cost}, '$setOnInsert': {'expires_at': _expiry(3 * self.window_seconds)}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        return window, doc.get('count', cost) + self._previous_count(collection, window - 1)
+
+    def leave(self, db, window, cost):
+        db[RATE_LIMIT_COLLECTION_NAME].update_one({'_id': f"inflight:{window}"}, {'$inc': {'count': -cost}})
+
+    def _previous_count(self, collection, window):
+        with self.lock:
+            cached_window, count, read_at = self.previous
+            if cached_window == window and time.time() - read_at < PREVIOUS_WINDOW_CACHE_SECONDS:
+                return count
+        doc = collection.find_one({'_id': f"inflight:{window}"})
+        count = max(0, doc.get('count', 0)) if doc else 0
+        with self.lock:
+            self.previous = (window, count, time.time())
+        return count
+
+
+class Ticket:
+    """An admitted request; release it when the request completes"""
+
+    def __init__(self, window=None, cost=1, local=False):
+        self.window = window
+        self.cost = cost
+        # Counted in this container only, while the in-flight counter was unreachable
+        self.local = local
+
+
+class AdmissionController:
+    def __init__(self, rate_limiter=None, inflight=None, max_inflight=ADMISSION_MAX_INFLIGHT,
+                 local_max_inflight=ADMISSION_LOCAL_MAX_INFLIGHT, shed_after_failures=ADMISSION_SHED_AFTER_FAILURES):
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.inflight = inflight if inflight is not None else InflightCounter()
+        self.max_inflight = max_inflight
+        self.local_max_inflight = local_max_inflight
+        self.shed_after_failures = shed_after_failures
+        self.counter_failures = 0
+        self.local_inflight = 0
+        # window -> decrements that could not be written yet
+        self.pending_releases = {}
+        self.lock = threading.Lock()
+
+    def enabled(self):
+        return self.rate_limiter.enabled() or self.max_inflight > 0
+
+    def admit(self, event, body, cors_headers):
+        """
+        Return (ticket, None) for an admitted request, or (None, response)
+        with a 429 or 503 for one shed before any search work
+        """
+        if not self.enabled():
+            return None, None
+        cost = request_cost(body)
+        db = _store_database()
+
+        if self.rate_limiter.enabled():
+            client = client_id(event)
+            allowed, retry_after = self.rate_limiter.take(db, client, cost)
+            if not allowed:
+                logger.warning(f"Rate limit exceeded for {client}, retry after {retry_after:.2f} s")
+                return None, self._reject(429, "Rate limit exceeded", retry_after, cors_headers)
+
+        if self.max_inflight <= 0:
+            return Ticket(cost=cost), None
+        try:
+            with pymongo.timeout(ADMISSION_STORE_TIMEOUT_MS / 1000.0):
+                window, inflight = self.inflight.enter(db, cost)
+        except Exception as e:
+            return self._admit_locally(cost, cors_headers, e)
+        with self.lock:
+            self.counter_failures = 0
+
+        limit = self.max_inflight * (ADMISSION_BATCH_SHARE if 'queries' in body else 1.0)
+        # The overload signal, one line per request for a metric filter
+        logger.info(f"Admission load: {json.dumps({'inflight': inflight, 'limit': self.max_inflight})}")
+        ticket = Ticket(window, cost)
+        if inflight > limit:
+            self.release(ticket)
+            logger.warning(f"Search overloaded ({inflight} in flight, limit {self.max_inflight}), shedding request")
+            return None, self._reject(503, "Search is overloaded", ADMISSION_RETRY_AFTER_SECONDS, cors_headers,
+                                      {'inflight': inflight, 'limit': self.max_inflight})
+        return ticket, None
+
+    def _admit_locally(self, cost, cors_headers, error):
+        """Admit against this container's own in-flight count while the shared counter is unreachable"""
+        with self.lock:
+            self.counter_failures += 1
+            failures = self.counter_failures
+            if self.shed_after_failures > 0 and failures >= self.shed_after_failures:
+                shed = 'counter'
+            elif self.local_max_inflight > 0 and self.local_inflight + cost > self.local_max_inflight:
+                shed = 'local'
+            else:
+                shed = None
+                self.local_inflight += cost
+        if shed == 'counter':
+            logger.warning(f"In-flight counter failed {failures} times in a row, shedding request: {str(error)}")
+            return None, self._reject(503, "Search is overloaded", ADMISSION_RETRY_AFTER_SECONDS, cors_headers)
+        if shed == 'local':
+            logger.warning(f"In-flight counter unavailable and {self.local_inflight} queries in flight "
+                           f"in this container, shedding request: {str(error)}")
+            return None, self._reject(503, "Search is overloaded", ADMISSION_RETRY_AFTER_SECONDS, cors_headers)
+        logger.warning(f"In-flight counter unavailable, admitting against the container limit: {str(error)}")
+        return Ticket(cost=cost, local=True), None
+
+    def release(self, ticket):
+        if ticket is None:
+            return
+        if ticket.local:
+            with self.lock:
+                self.local_inflight -= ticket.cost
+            ticket.local = False
+        if ticket.window is None:
+            return
+        with self.lock:
+            pending, self.pending_releases = self.pending_releases, {}
+        pending[ticket.window] = pending.get(ticket.window, 0) + ticket.cost
+        ticket.window = None
+
+        # Windows older than the previous one are no longer counted
+        oldest_counted = int(time.time() // self.inflight.window_seconds) - 1
+        db = _store_database()
+        for window, cost in pending.items():
+            if window < oldest_counted:
+                continue
+            try:
+                with pymongo.timeout(ADMISSION_STORE_TIMEOUT_MS / 1000.0):
+                    self.inflight.leave(db, window, cost)
+            except Exception as e:
+                logger.warning(f"Error releasing in-flight count, retrying with the next release: {str(e)}")
+                with self.lock:
+                    self.pending_releases[window] = self.pending_releases.get(window, 0) + cost
+
+    @staticmethod
+    def _reject(status_code, error, retry_after, cors_headers, load=None):
+        retry_after = max(1, math.ceil(retry_after))
+        body = {'error': error, 'retry_after_seconds': retry_after}
+        if load:
+            body['load'] = load
+        return {
+            'statusCode': status_code,
+            'headers': {**cors_headers, 'Retry-After': str(retry_after),
+                        'Access-Control-Expose-Headers': 'Retry-After'},
+            'body': json.dumps(body)
+        }
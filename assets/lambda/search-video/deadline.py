@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# API Gateway closes the integration after 29 s regardless of the Lambda timeout
+API_TIMEOUT_MS = int(os.environ.get('API_TIMEOUT_MS', '29000'))
+# Time reserved for serializing and returning the response
+RESPONSE_MARGIN_MS = int(os.environ.get('RESPONSE_MARGIN_MS', '500'))
+
+
+def parse_budget_ms(value):
+    """
+    Validate a client-supplied "budget_ms"
+
+    Returns:
+        tuple: (budget in ms or None when absent, error message or None)
+    """
+    if value is None:
+        return None, None
+    # bool is an int subclass; true/false are not budgets
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value < float('inf'):
+        return None, 'budget_ms must be a non-negative number of milliseconds'
+    return int(value), None
+
+
+class Deadline:
+    """Wall-clock budget for one search request, shared by all of its stages"""
+
+    def __init__(self, budget_ms=None):
+        self.budget_ms = budget_ms
+        self.started_at = time.monotonic()
+        self.expires_at = None if budget_ms is None else self.started_at + budget_ms / 1000.0
+        # Milliseconds spent per stage, summed over every query sharing the deadline
+        self.stage_ms = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_request(cls, context=None, client_budget_ms=None):
+        """
+        Derive the request deadline from the Lambda context, the API Gateway
+        limit and an optional client-supplied budget, whichever is tightest
+        """
+        budgets = [API_TIMEOUT_MS - RESPONSE_MARGIN_MS]
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            budgets.append(context.get_remaining_time_in_millis() - RESPONSE_MARGIN_MS)
+        if client_budget_ms is not None:
+            budgets.append(int(client_budget_ms))
+        return cls(max(0, min(budgets)))
+
+    def elapsed_ms(self):
+        return int((time.monotonic() - self.started_at) * 1000)
+
+    def record(self, stage, started_at):
+        """Add the time since started_at (a time.monotonic() reading) to a stage"""
+        elapsed = (time.monotonic() - started_at) * 1000
+        with self.lock:
+            self.stage_ms[stage] = round(self.stage_ms.get(stage, 0.0) + elapsed, 1)
+
+    @contextmanager
+    def timed(self, stage):
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, started_at)
+
+    def remaining_ms(self):
+        """Milliseconds left, or None for an unbounded deadline"""
+        if self.expires_at is None:
+            return None
+        return max(0, int((self.expires_at - time.monotonic()) * 1000))
+
+    def has_at_least(self, ms):
+        remaining = self.remaining_ms()
+        return remaining is None or remaining >= ms
+
+    def stage_timeout(self, stage_budget_ms=None):
+        """
+        Seconds a stage may take: its own budget capped by what is left overall.
+        Returns None when neither bound applies.
+        """
+        limits = [ms for ms in (stage_budget_ms, self.remaining_ms()) if ms is not None]
+        if not limits:
+            return None
+        # Never hand out 0: pymongo treats a zero timeout as "no timeout"
+        return max(0.001, min(limits) / 1000.0)
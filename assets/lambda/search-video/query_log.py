@@ -0,0 +1,178 @@
+"""
+Sampled query log for capacity planning and load replay
+
+A sampled share of search requests (QUERY_LOG_SAMPLE_RATE) is recorded as
+one JSON line each: the query's keyed hash, the request parameters, the
+search path, result count and per-stage timings. The query text itself is
+only kept with QUERY_LOG_INCLUDE_TEXT=true; without it the log still sizes
+caches (repeat rates by hash) but cannot be replayed. Hashes are only
+written when QUERY_LOG_HASH_KEY is set: an unkeyed hash of a short query
+is recovered by hashing guesses.
+
+Records are buffered per container and written by a background thread every
+QUERY_LOG_FLUSH_RECORDS records or QUERY_LOG_FLUSH_SECONDS, to
+QUERY_LOG_DESTINATION: "s3://bucket/prefix" (the function needs
+s3:PutObject there) or a local directory. Buffered records are lost if the
+container is retired before they are flushed.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOG_SAMPLE_RATE = float(os.environ.get('QUERY_LOG_SAMPLE_RATE', '0'))
+QUERY_LOG_DESTINATION = os.environ.get('QUERY_LOG_DESTINATION', '')
+QUERY_LOG_INCLUDE_TEXT = os.environ.get('QUERY_LOG_INCLUDE_TEXT', 'false').lower() == 'true'
+# Key for the query hash, so short queries cannot be recovered by hashing guesses;
+# without one, records carry no query hash
+QUERY_LOG_HASH_KEY = os.environ.get('QUERY_LOG_HASH_KEY', '')
+QUERY_LOG_FLUSH_RECORDS = int(os.environ.get('QUERY_LOG_FLUSH_RECORDS', '100'))
+QUERY_LOG_FLUSH_SECONDS = int(os.environ.get('QUERY_LOG_FLUSH_SECONDS', '60'))
+
+# Request fields recorded alongside the query, enough to replay the request
+REQUEST_FIELDS = ('mode', 'top_k', 'budget_ms', 'video_names', 'video_name', 'start_millis', 'end_millis',
+                  'group_by', 'group_limit', 'segments_per_group', 'response_mode', 'snippet_chars',
+                  'reranker', 'route_by', 'route_limit', 'similar_to', 'exclude_same_video')
+
+
+def query_hash(query, key=QUERY_LOG_HASH_KEY):
+    """Keyed hash of the normalized query text"""
+    if not key:
+        raise ValueError("QUERY_LOG_HASH_KEY is not set")
+    normalized = ' '.join(str(query).lower().split())
+    return hmac.new(key.encode('utf-8'), normalized.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+class QueryLogger:
+    """Container-wide sampled query log buffer"""
+
+    def __init__(self, sample_rate=QUERY_LOG_SAMPLE_RATE, destination=QUERY_LOG_DESTINATION,
+                 include_text=QUERY_LOG_INCLUDE_TEXT, hash_key=QUERY_LOG_HASH_KEY):
+        self.sample_rate = sample_rate if destination else 0.0
+        self.destination = destination
+        self.include_text = include_text
+        self.hash_key = hash_key
+        if self.sample_rate > 0 and not hash_key:
+            logger.warning("QUERY_LOG_HASH_KEY is not set, query log records will carry no query hash")
+        self.container_id = uuid.uuid4().hex[:12]
+        self.sequence = 0
+        self.buffer = []
+        self.buffer_started = time.monotonic()
+        self.lock = threading.Lock()
+        self.executor = None
+        self._s3 = None
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record(self, kind, body, response, deadline):
+        """
+        Record one request if it is sampled
+
+        Args:
+            kind (str): "search", "batch" or "similar"
+            body (dict): Parsed request body
+            response (dict): The handler's API Gateway response
+            deadline (Deadline): The request deadline, carrying the stage timings
+        """
+        if not self.sampled():
+            return
+        try:
+            self._append(self._build_record(kind, body, response, deadline))
+        except Exception as e:
+            logger.warning(f"Error recording query log entry: {str(e)}")
+
+    def _build_record(self, kind, body, response, deadline):
+        record = {
+            'ts': datetime.now(timezone.utc).isoformat(),
+            'kind': kind,
+            'request': {field: body[field] for field in REQUEST_FIELDS if field in body},
+            'status': response.get('statusCode'),
+            'total_ms': deadline.elapsed_ms(),
+            'stage_ms': dict(deadline.stage_ms),
+            'sample_rate': self.sample_rate,
+        }
+        if kind == 'batch':
+            queries = [item.get('query') if isinstance(item, dict) else item for item in body.get('queries') or []]
+            if self.hash_key:
+                record['query_hashes'] = [query_hash(query, self.hash_key) for query in queries]
+            if self.include_text:
+                record['request']['queries'] = body.get('queries')
+        elif body.get('query') is not None:
+            if self.hash_key:
+                record['query_hash'] = query_hash(body['query'], self.hash_key)
+            if self.include_text:
+                record['request']['query'] = body['query']
+
+        if response.get('statusCode') == 200:
+            response_body = json.loads(response['body'])
+            if kind == 'batch':
+                record['result_count'] = sum(len(item.get('frontend_results') or [])
+                                             for item in response_body.get('batch_results', []))
+            else:
+                record['result_count'] = len(response_body.get('frontend_results') or [])
+                record['search_path'] = response_body.get('search_path')
+        return record
+
+    def _append(self, record):
+        with self.lock:
+            self.buffer.append(record)
+            due = (len(self.buffer) >= QUERY_LOG_FLUSH_RECORDS or
+                   time.monotonic() - self.buffer_started >= QUERY_LOG_FLUSH_SECONDS)
+            if not due:
+                return
+            records, self.buffer = self.buffer, []
+            self.buffer_started = time.monotonic()
+            self.sequence += 1
+            sequence = self.sequence
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1)
+        # Written off the request path; a frozen container resumes the write on its next invocation
+        self.executor.submit(self._write, records, sequence)
+
+    def flush(self):
+        """Write out whatever is buffered and wait for pending writes"""
+        with self.lock:
+            records, self.buffer = self.buffer, []
+            self.buffer_started = time.monotonic()
+            self.sequence += 1
+            sequence = self.sequence
+            executor = self.executor
+        if executor is not None:
+            executor.submit(lambda: None).result()
+        if records:
+            self._write(records, sequence)
+
+    def _write(self, records, sequence):
+        now = datetime.now(timezone.utc)
+        name = f"dt={now:%Y-%m-%d}/{now:%H%M%S}-{self.container_id}-{sequence:06d}.jsonl"
+        payload = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+        try:
+            if self.destination.startswith('s3://'):
+                bucket, _, prefix = self.destination[len('s3://'):].partition('/')
+                key = f"{prefix.rstrip('/')}/{name}" if prefix else name
+                self._s3_client().put_object(Bucket=bucket, Key=key, Body=payload.encode('utf-8'),
+                                             ContentType='application/x-ndjson')
+            else:
+                path = os.path.join(self.destination, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write(payload)
+            logger.info(f"Wrote {len(records)} query log records to {self.destination}")
+        except Exception as e:
+            logger.warning(f"Error writing {len(records)} query log records: {str(e)}")
+
+    def _s3_client(self):
+        if self._s3 is None:
+            import boto3
+            self._s3 = boto3.client('s3')
+        return self._s3
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from snippets import query_terms
+
+logger = logging.getLogger(__name__)
+
+# Reranker used when a request does not name one: "auto" tries Cohere and
+# falls back to the local scorer, "cohere" or "local" use only that backend
+DEFAULT_RERANKER = os.environ.get('RERANKER', 'auto')
+RERANKER_CHOICES = ('auto', 'cohere', 'local')
+
+COHERE_RERANK_MODEL_ID = os.environ.get('COHERE_RERANK_MODEL_ID', 'cohere.rerank-v3-5:0')
+# After a Cohere timeout, throttle or error, "auto" skips Cohere for this long
+COHERE_COOLDOWN_SECONDS = int(os.environ.get('COHERE_COOLDOWN_SECONDS', '30'))
+
+# Local scorer feature weights; the score is their weighted mean, in [0, 1]
+LOCAL_WEIGHT_VECTOR = float(os.environ.get('LOCAL_RERANK_WEIGHT_VECTOR', '0.4'))
+LOCAL_WEIGHT_TEXT = float(os.environ.get('LOCAL_RERANK_WEIGHT_TEXT', '0.2'))
+LOCAL_WEIGHT_COVERAGE = float(os.environ.get('LOCAL_RERANK_WEIGHT_COVERAGE', '0.3'))
+LOCAL_WEIGHT_PHRASE = float(os.environ.get('LOCAL_RERANK_WEIGHT_PHRASE', '0.1'))
+# Vector rank at which the rank feature halves
+LOCAL_RANK_HALF_LIFE = float(os.environ.get('LOCAL_RERANK_RANK_HALF_LIFE', '5'))
+
+
+class CohereReranker:
+    """Cohere Rerank v3.5 on Bedrock"""
+
+    name = 'cohere'
+
+    def __init__(self, bedrock_client):
+        self.bedrock_client = bedrock_client
+        self.lock = threading.Lock()
+        self.unhealthy_until = 0.0
+
+    def is_healthy(self):
+        return time.time() >= self.unhealthy_until
+
+    def mark_unhealthy(self, reason):
+        with self.lock:
+            self.unhealthy_until = time.time() + COHERE_COOLDOWN_SECONDS
+        logger.error(f"Cohere rerank {reason}, using the local reranker for {COHERE_COOLDOWN_SECONDS}s")
+
+    def score(self, query, documents, results):
+        """Return one relevance score per document, in document order"""
+        response = self.bedrock_client.invoke_model(
+            modelId=COHERE_RERANK_MODEL_ID,
+            contentType="application/json",
+            accept="application/json",
+            body=json.dumps({
+                "api_version": 2,
+                "query": query,
+                "documents": documents,
+                "top_n": len(documents)
+            })
+        )
+        response_body = json.loads(response.get('body').read())
+        scores = [0.0] * len(documents)
+        for item in response_body['results']:
+            scores[item['index']] = item['relevance_score']
+        return scores
+
+
+class LocalReranker:
+    """
+    In-process scorer over the signals the search legs already produced
+
+    Features, each in [0, 1]: the vector-leg rank, the text score relative to
+    the best one in the candidate set, the share of query terms found in the
+    text, and whether the whole query appears as a phrase. Cheap enough to
+    run on every request, so it also stands in when Cohere is unavailable.
+    """
+
+    name = 'local'
+
+    def score(self, query, documents, results):
+        """Return one relevance score per document, in document order"""
+        terms = query_terms(query)
+        term_patterns = [re.compile(r"\b" + re.escape(term), re.IGNORECASE) for term in terms]
+        phrase = ' '.join(query.lower().split())
+        max_text_score = max((result.get('text_score') or 0.0 for result in results), default=0.0)
+        total_weight = (LOCAL_WEIGHT_VECTOR + LOCAL_WEIGHT_TEXT + LOCAL_WEIGHT_COVERAGE + LOCAL_WEIGHT_PHRASE) or 1.0
+
+        scores = []
+        for text, result in zip(documents, results):
+            text = text or ""
+            vector_rank = result.get('vector_rank')
+            vector_feature = 0.0 if vector_rank is None else 0.5 ** (vector_rank / LOCAL_RANK_HALF_LIFE)
+            text_feature = (result.get('text_score') or 0.0) / max_text_score if max_text_score else 0.0
+            coverage = sum(1 for pattern in term_patterns if pattern.search(text)) / len(terms) if terms else 0.0
+            phrase_match = 1.0 if len(terms) > 1 and phrase in ' '.join(text.lower().split()) else 0.0
+            scores.append((LOCAL_WEIGHT_VECTOR * vector_feature + LOCAL_WEIGHT_TEXT * text_feature +
+                           LOCAL_WEIGHT_COVERAGE * coverage + LOCAL_WEIGHT_PHRASE * phrase_match) / total_weight)
+        return scores
@@ -0,0 +1,110 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', '256'))
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get('SEARCH_CACHE_TTL_SECONDS', '3600'))
+SEARCH_CACHE_SHARED = os.environ.get('SEARCH_CACHE_SHARED', 'true').lower() == 'true'
+CACHE_COLLECTION_NAME = os.environ.get('CACHE_COLLECTION_NAME', 'search_cache')
+META_COLLECTION_NAME = os.environ.get('META_COLLECTION_NAME', 'corpus_meta')
+
+# _id of the document in META_COLLECTION_NAME holding the corpus generation counter
+GENERATION_DOC_ID = 'corpus_generation'
+
+
+def get_corpus_generation(db):
+    """Read the corpus generation counter that ingest bumps after every successful write"""
+    doc = db[META_COLLECTION_NAME].find_one({'_id': GENERATION_DOC_ID})
+    return doc.get('generation', 0) if doc else 0
+
+
+def make_cache_key(generation, namespace, *parts):
+    """Build a cache key; the generation makes entries from an older corpus unreachable"""
+    raw = json.dumps([generation, namespace, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LocalCache:
+    """Thread-safe in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_size=SEARCH_CACHE_SIZE, ttl_seconds=SEARCH_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return copy.deepcopy(value)
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl_seconds, copy.deepcopy(value))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+class SearchCache:
+    """
+    Two-tier search response cache
+
+    The in-process tier survives warm invocations of one container; the shared
+    tier is a DocumentDB collection visible to every container. Both are keyed
+    by the corpus generation, so an ingest makes all earlier entries unreachable.
+    """
+
+    def __init__(self, local_cache=None):
+        self.local = local_cache if local_cache is not None else LocalCache()
+
+    def get(self, db, key):
+        value = self.local.get(key)
+        if value is not None:
+            logger.info("Search cache hit (local)")
+            return value
+
+        if SEARCH_CACHE_SHARED:
+            try:
+                doc = db[CACHE_COLLECTION_NAME].find_one({'_id': key})
+                if doc and doc.get('expires_at', 0) >= time.time():
+                    logger.info("Search cache hit (shared)")
+                    self.local.set(key, doc['value'])
+                    return doc['value']
+            except Exception as e:
+                logger.warning(f"Error reading shared search cache: {str(e)}")
+
+        return None
+
+    def set(self, db, key, value):
+        self.local.set(key, value)
+
+        if SEARCH_CACHE_SHARED:
+            try:
+                expires_at = time.time() + SEARCH_CACHE_TTL_SECONDS
+                db[CACHE_COLLECTION_NAME].replace_one(
+                    {'_id': key},
+                    {'_id': key, 'value': value, 'expires_at': expires_at,
+                     'created_at': datetime.now(timezone.utc)},
+                    upsert=True
+                )
+            except Exception as e:
+                logger.warning(f"Error writing shared search cache: {str(e)}")
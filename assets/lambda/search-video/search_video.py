@@ -1,8 +1,32 @@
+import time
+_INIT_STARTED = time.perf_counter()
+
+import copy
+import heapq
 import json
+import math
+import re
+import threading
 import boto3
 import os
-from pymongo import MongoClient
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from botocore.config import Config
+import pymongo
 import logging
+import docdb_pool
+from embedding_backends import get_embedding_backend
+from admission import AdmissionController
+from deadline import Deadline, parse_budget_ms
+from query_log import QueryLogger
+from rerankers import DEFAULT_RERANKER, RERANKER_CHOICES, CohereReranker, LocalReranker
+from search_cache import LocalCache, SearchCache, get_corpus_generation, make_cache_key
+from semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticCache
+from snippets import SNIPPET_CHARS, slim_results
+from suggest import SuggestIndexHolder
+from visibility import VisibilityFilter
+import warmup
+
+_IMPORTS_DONE = time.perf_counter()
 
 # Configure logging
 log_level = os.environ.get('LOG_LEVEL', 'INFO')
@@ -10,52 +34,291 @@ logging.basicConfig(level=getattr(logging, log_level),
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Batch search limits
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', '50'))
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', '8'))
+
+# Minimum rerank relevance score for a result to be returned, calibrated for Cohere
+MIN_RELEVANCE_SCORE = 0.05
+# The local scorer's weighted features rarely fall below MIN_RELEVANCE_SCORE
+# (a vector hit at rank 10 alone scores 0.1), so it has its own threshold,
+# and its answers are cut to top_k
+LOCAL_MIN_RELEVANCE_SCORE = float(os.environ.get('LOCAL_MIN_RELEVANCE_SCORE', '0.2'))
+
+# Per-client rate limits and overload shedding, checked before any search work
+admission = AdmissionController()
+
+# Response cache shared by every invocation served by this container
+response_cache = SearchCache()
+
+# Segments of videos being replaced or deleted, excluded from every search
+visibility_filter = VisibilityFilter()
+
+# Reranked responses indexed by query embedding, reused for near-duplicate queries
+semantic_cache = SemanticCache()
+
+# Texts of hot segments, used to hydrate vector results in the split layout
+CONTENT_CACHE_SIZE = int(os.environ.get('CONTENT_CACHE_SIZE', '4096'))
+CONTENT_CACHE_TTL_SECONDS = int(os.environ.get('CONTENT_CACHE_TTL_SECONDS', '3600'))
+content_cache = LocalCache(CONTENT_CACHE_SIZE, CONTENT_CACHE_TTL_SECONDS)
+
+# Sampled query log (off unless QUERY_LOG_SAMPLE_RATE and QUERY_LOG_DESTINATION are set)
+query_logger = QueryLogger()
+
+# Query embeddings shared by every request served by this container, keyed by
+# (backend_id, query text); filled ahead of traffic by the init warm-up
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', '2048'))
+EMBEDDING_CACHE_TTL_SECONDS = int(os.environ.get('EMBEDDING_CACHE_TTL_SECONDS', '86400'))
+embedding_cache = LocalCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS)
+
+# In-memory typeahead index, reloaded when ingest bumps the corpus generation
+suggest_index = SuggestIndexHolder()
+
+# Per-stage latency budgets (ms); each is also capped by the request deadline
+EMBEDDING_BUDGET_MS = int(os.environ.get('EMBEDDING_BUDGET_MS', '3000'))
+SEARCH_LEG_BUDGET_MS = int(os.environ.get('SEARCH_LEG_BUDGET_MS', '5000'))
+RERANK_BUDGET_MS = int(os.environ.get('RERANK_BUDGET_MS', '5000'))
+# Rerank is skipped when less than this is left of the request deadline
+RERANK_MIN_BUDGET_MS = int(os.environ.get('RERANK_MIN_BUDGET_MS', '1500'))
+# Read timeout for Bedrock calls; the stage budgets stop waiting earlier
+BEDROCK_READ_TIMEOUT = int(os.environ.get('BEDROCK_READ_TIMEOUT', '10'))
+
+# Scatter-gather over docdb_pool.SEARCH_SHARDS: each shard returns
+# ceil(top_k * SHARD_K_FACTOR / shards) hits per leg, at least SHARD_MIN_K, so
+# the global top_k survives an uneven spread of matches. A shard that does not
+# answer within SEARCH_LEG_BUDGET_MS is left out and named in "missing_shards".
+SHARD_K_FACTOR = float(os.environ.get('SHARD_K_FACTOR', '2'))
+SHARD_MIN_K = int(os.environ.get('SHARD_MIN_K', '5'))
+
+# Scoped searches over at most this many documents are scored exactly. Each
+# scored document ships its full embedding (about 14 KB of BSON at 1024
+# dimensions) and is scored in Python: 250 documents cost about 3.5 MB and
+# 20 ms of CPU, 2000 about 28 MB and 170 ms. Larger scopes use the
+# approximate search with SCOPED_VECTOR_K_FACTOR times the candidates.
+SCOPED_EXACT_MAX_DOCS = int(os.environ.get('SCOPED_EXACT_MAX_DOCS', '250'))
+# Candidate multiplier for approximate vector search over larger scopes
+SCOPED_VECTOR_K_FACTOR = int(os.environ.get('SCOPED_VECTOR_K_FACTOR', '10'))
+
+# Grouping defaults: how many groups to keep and how many segments within each
+DEFAULT_GROUP_LIMIT = int(os.environ.get('DEFAULT_GROUP_LIMIT', '10'))
+DEFAULT_SEGMENTS_PER_GROUP = int(os.environ.get('DEFAULT_SEGMENTS_PER_GROUP', '2'))
+
+# Hierarchical transcript search: how many chapters or videos the summary
+# stage shortlists before the chunks inside them are scored
+DEFAULT_ROUTE_CHAPTERS = int(os.environ.get('DEFAULT_ROUTE_CHAPTERS', '20'))
+DEFAULT_ROUTE_VIDEOS = int(os.environ.get('DEFAULT_ROUTE_VIDEOS', '5'))
+MAX_ROUTE_LIMIT = 100
+CHAPTER_SUMMARY_PATTERN = re.compile(r"^chapter_(\d+)_summary$")
+
+# Largest top_k a search request may ask for
+MAX_TOP_K = int(os.environ.get('MAX_TOP_K', '100'))
+
+# Maximum number of documents whose full text one fetch_text request may return
+MAX_FETCH_TEXT = int(os.environ.get('MAX_FETCH_TEXT', '100'))
+
+# Reciprocal rank fusion constant used to order results when rerank is skipped
+RRF_K = 60
+
+
+class SearchCancelled(Exception):
+    """The search was answered another way (the semantic cache) before its vector leg started"""
+
+# Runs the embedding and rerank calls so the request can stop waiting on them
+stage_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('STAGE_MAX_WORKERS', '8')))
+# Runs the per-shard search legs; separate so shard queries never wait behind Bedrock calls
+shard_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('SHARD_MAX_WORKERS', '16')))
+
+# Run the connection diagnostics (document counts, index listing, sample reads).
+# They cost several round trips, so they are off the request path by default.
+SEARCH_DIAGNOSTICS = os.environ.get('SEARCH_DIAGNOSTICS', 'false').lower() == 'true'
+
+# SnapStart snapshots the init phase; sockets and pymongo monitor threads must not
+# be captured in it, so in that mode clients are built after restore instead
+SNAPSHOT_INIT = os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'snap-start'
+
+# Bedrock client shared by every invocation served by this container
+_bedrock_client = None
+# Rerankers shared by the container, so Cohere's health is remembered across requests
+_cohere_reranker = None
+local_reranker = LocalReranker()
+
+# Startup timings (seconds), logged once with the first invocation
+startup_profile = {'imports': round(_IMPORTS_DONE - _INIT_STARTED, 4)}
+_cold_start = True
+
+def build_scope_filter(scope):
+    """
+    Translate a search scope into a MongoDB filter
+
+    A time window keeps segments overlapping [start_millis, end_millis]; video
+    summaries carry no timestamps and so drop out of time-scoped searches.
+    """
+    if not scope:
+        return {}
+
+    scope_filter = {}
+    video_names = scope.get('video_names')
+    if video_names:
+        scope_filter['video_name'] = video_names[0] if len(video_names) == 1 else {'$in': video_names}
+    if scope.get('end_millis') is not None:
+        scope_filter['start_timestamp_millis'] = {'$lte': scope['end_millis']}
+    if scope.get('start_millis') is not None:
+        scope_filter['end_timestamp_millis'] = {'$gte': scope['start_millis']}
+    return scope_filter
+
+def group_key(result, group_by):
+    """Return the (video_name, chapter_index) group a result belongs to"""
+    if group_by != 'chapter':
+        return (result.get('video_name'), None)
+    # Sources look like "chapter_3_summary" or "chapter_3_transcript_chunk_0";
+    # the video summary forms its own group
+    match = re.match(r'chapter_(\d+)_', result.get('source') or '')
+    return (result.get('video_name'), int(match.group(1)) if match else None)
+
+def group_results(results, grouping, score_key):
+    """
+    Collapse results into per-video (or per-chapter) groups
+
+    Groups are ordered by their best segment's score; each keeps its top
+    segments_per_group segments and at most group_limit groups are kept.
+
+    Args:
+        results (list): Results carrying score_key
+        grouping (dict): Validated grouping from parse_grouping
+        score_key (str): Result field to rank by, e.g. 'fusion_score'
+
+    Returns:
+        tuple: (kept results in group order, group summaries)
+    """
+    groups = {}
+    for result in sorted(results, key=lambda x: x.get(score_key) or 0, reverse=True):
+        segments = groups.setdefault(group_key(result, grouping['group_by']), [])
+        if len(segments) < grouping['segments_per_group']:
+            segments.append(result)
+
+    kept_results = []
+    summaries = []
+    # dicts keep insertion order, so groups are already ordered by their best score
+    for (video_name, chapter_index), segments in list(groups.items())[:grouping['group_limit']]:
+        kept_results.extend(segments)
+        summary = {
+            "video_name": video_name,
+            "best_segment_id": segments[0]['_id'],
+            "score": segments[0].get(score_key),
+            "segment_ids": [segment['_id'] for segment in segments]
+        }
+        if grouping['group_by'] == 'chapter':
+            summary["chapter_index"] = chapter_index
+        summaries.append(summary)
+    return kept_results, summaries
+
+def get_mongo_client():
+    """Return the container-wide search MongoClient from the shared docdb_pool layer module"""
+    # Outside snapshot mode the topology handshake starts in background
+    # threads right away, overlapping the rest of the init phase.
+    return docdb_pool.get_client('search', connect=not SNAPSHOT_INIT)
+
+def per_shard_k(top_k, shard_count):
+    """Hits each shard returns per leg so the merged lists still hold the global top_k"""
+    if shard_count <= 1:
+        return top_k
+    return max(SHARD_MIN_K, math.ceil(top_k * SHARD_K_FACTOR / shard_count))
+
+def merge_shard_results(results_by_shard, limit, score_field):
+    """
+    Merge per-shard ranked lists into one global top list ordered by score_field
+
+    Only scores compare across shards, so every hit must carry one: text
+    scores, or exact cosine scores (see VideoSearch.score_exactly for the
+    IVF hits, which come back unscored).
+    """
+    hits = [result for results in results_by_shard for result in results]
+    return heapq.nlargest(limit, hits, key=lambda result: result[score_field])
+
+def cosine_similarity(query_embedding, embedding, query_norm=None):
+    """Cosine similarity of two vectors; pass query_norm when scoring many against one query"""
+    query_norm = query_norm or math.sqrt(sum(x * x for x in query_embedding)) or 1.0
+    dot = sum(a * b for a, b in zip(query_embedding, embedding))
+    return dot / (query_norm * (math.sqrt(sum(x * x for x in embedding)) or 1.0))
+
+def get_bedrock_client():
+    """Return the container-wide Bedrock runtime client, creating it on first use"""
+    global _bedrock_client
+    if _bedrock_client is None:
+        region = os.environ.get('DEPLOY_REGION', 'us-west-2')  # 从环境变量获取区域，默认为 us-west-2
+        logger.info(f"Initializing Bedrock client in region: {region}")
+        _bedrock_client = boto3.client(
+            'bedrock-runtime',
+            region_name=region,
+            config=Config(read_timeout=BEDROCK_READ_TIMEOUT, retries={'max_attempts': 2, 'mode': 'standard'})
+        )
+    return _bedrock_client
+
+def get_cohere_reranker():
+    """Return the container-wide Cohere reranker, creating it on first use"""
+    global _cohere_reranker
+    if _cohere_reranker is None:
+        _cohere_reranker = CohereReranker(get_bedrock_client())
+    return _cohere_reranker
+
+def init_clients():
+    """Build the shared clients, recording how long each one took"""
+    try:
+        started = time.perf_counter()
+        get_mongo_client()
+        mongo_done = time.perf_counter()
+        get_bedrock_client()
+        bedrock_done = time.perf_counter()
+        # A local model backend loads its weights here rather than on the first query
+        get_embedding_backend(bedrock_client=get_bedrock_client())
+        startup_profile['mongo_client'] = round(mongo_done - started, 4)
+        startup_profile['bedrock_client'] = round(bedrock_done - mongo_done, 4)
+        startup_profile['embedding_backend'] = round(time.perf_counter() - bedrock_done, 4)
+    except Exception as e:
+        # Leave it to the first request to retry and surface the error
+        logger.error(f"Error initializing clients: {str(e)}")
+
+if SNAPSHOT_INIT:
+    try:
+        from snapshot_restore_py import register_after_restore
+        register_after_restore(init_clients)
+    except ImportError:
+        logger.warning("snapshot_restore_py not available, clients will be built on first request")
+else:
+    init_clients()
+startup_profile['init_total'] = round(time.perf_counter() - _INIT_STARTED, 4)
+
 class VideoSearch:
     def __init__(self):
         """Initialize the VideoSearch class with MongoDB connection and Bedrock client"""
         try:
-            # Get connection information from environment variables
-            username = os.environ.get('DB_USERNAME')
-            password = os.environ.get('DB_PASSWORD')
-            db_endpoint = os.environ.get('DB_ENDPOINT')
-            db_port = os.environ.get('DB_PORT', '27017')
             db_name = os.environ.get('DB_NAME', 'VideoData')
-            mongodb_uri = os.environ.get('MONGODB_URI')
 
-            if not db_endpoint and not mongodb_uri:
-                raise ValueError("Neither DB_ENDPOINT nor MONGODB_URI environment variable is set")
+            # Reuse the clients built in the init phase (or on first use)
+            self.client = get_mongo_client()
 
-            logger.info(f"Connecting to MongoDB...")
-            
-            # Use the complete MONGODB_URI if provided
-            if mongodb_uri:
-                logger.info(f"Using provided MONGODB_URI")
-                connection_uri = mongodb_uri
-            else:
-                # Build MongoDB URI
-                connection_uri = f"mongodb://{username}:{password}@{db_endpoint}:{db_port}/?replicaSet=rs0&readPreference=secondaryPreferred&retryWrites=false&ssl=false"
-                logger.warning(f"Built MongoDB URI from components: mongodb://{username}:****@{db_endpoint}:{db_port}/?replicaSet=rs0&readPreference=secondaryPreferred&retryWrites=false&ssl=false")
-            
-            # Connect to MongoDB/DocumentDB with increased timeouts and SSL disabled
-            self.client = MongoClient(
-                connection_uri, 
-                socketTimeoutMS=60000, 
-                connectTimeoutMS=60000,
-                serverSelectionTimeoutMS=60000,
-                ssl=False
-            )
-            
             # 测试连接
-            self.test_connection()
-            
+            if SEARCH_DIAGNOSTICS:
+                self.test_connection()
+
             self.db = self.client[db_name]
-            self.collection = self.db['videodata']
+            self.collection = self.db[os.environ.get('COLLECTION_NAME', 'videodata')]
+            # Segment text and the text index: a separate content store in the split layout
+            if docdb_pool.is_split_layout():
+                self.content = self.db[docdb_pool.CONTENT_COLLECTION_NAME]
+            else:
+                self.content = self.collection
             logger.info(f"Connected to MongoDB: {db_name}")
 
             # Initialize Bedrock client for embeddings
-            region = os.environ.get('DEPLOY_REGION', 'us-west-2')  # 从环境变量获取区域，默认为 us-west-2
-            logger.info(f"Initializing Bedrock client in region: {region}")
-            self.bedrock_client = boto3.client('bedrock-runtime', region_name=region)
+            self.bedrock_client = get_bedrock_client()
+            # Query embedding backend; only documents it embedded are vector-searched
+            self.embedding_backend = get_embedding_backend(bedrock_client=self.bedrock_client)
+
+            # Corpus generation, read once per request when the cache is first consulted
+            self.corpus_generation = None
+            # Shard whose segment collections this instance reads (None: the project database)
+            self.shard = None
 
             logger.info("VideoSearch initialized successfully")
         except Exception as e:
@@ -114,24 +377,120 @@ class VideoSearch:
             logger.error(f"Error testing connection: {str(e)}")
             return False
 
+    def get_corpus_generation(self):
+        """Return the corpus generation used to key cached responses"""
+        if self.corpus_generation is None:
+            try:
+                self.corpus_generation = docdb_pool.with_retries(lambda: get_corpus_generation(self.db))
+            except Exception as e:
+                # Without a generation we cannot prove freshness, so bypass the cache
+                logger.warning(f"Error reading corpus generation, bypassing cache: {str(e)}")
+                return None
+        return self.corpus_generation
+
     def get_embedding(self, text):
-        """Generate embedding for the input text using Amazon Bedrock Titan model"""
+        """Generate embedding for the input text using the configured embedding backend"""
+        cache_key = (self.embedding_backend.backend_id, text)
+        embedding = embedding_cache.get(cache_key)
+        if embedding is not None:
+            return embedding
         try:
-            response = self.bedrock_client.invoke_model(
-                modelId="amazon.titan-embed-text-v2:0",
-                contentType="application/json",
-                accept="application/json",
-                body=json.dumps({
-                    "inputText": text
-                })
-            )
-            response_body = json.loads(response.get('body').read())
-            return response_body['embedding']
+            embedding = self.embedding_backend.embed(text)
+            embedding_cache.set(cache_key, embedding)
+            return embedding
         except Exception as e:
             logger.error(f"Error generating embedding: {str(e)}")
             raise
 
-    def vector_search(self, query_text, search_mode, top_k=10):
+    def build_filter_condition(self, search_mode, scope=None):
+        """
+        Build the document filter for a search mode, narrowed by an optional scope
+        and excluding segments of videos being replaced or deleted
+
+        Args:
+            search_mode (str): Either "scene" or "transcripts"
+            scope (dict): Validated scope from parse_search_scope (optional)
+
+        Returns:
+            dict: MongoDB filter
+        """
+        if search_mode == "scene":
+            # Search in video_summary and chapter summaries
+            filter_condition = {
+                "source": {
+                    "$regex": ".*summary$"  # Match sources ending with "summary"
+                }
+            }
+            logger.info(f"Searching in summaries")
+        elif search_mode == "transcripts":
+            # Search in transcript chunks
+            filter_condition = {
+                "source": {
+                    "$regex": ".*transcript_chunk.*"  # Match sources containing "transcript_chunk"
+                }
+            }
+            logger.info(f"Searching in transcripts")
+        else:
+            raise ValueError(f"Invalid search mode: {search_mode}")
+
+        visible = visibility_filter.get(self.db, self.get_corpus_generation())
+        return {**filter_condition, **build_scope_filter(scope), **visible}
+
+    def exact_vector_search(self, query_embedding, filter_condition, top_k=10):
+        """
+        Score every document matching the filter against the query embedding
+
+        Used for scoped searches, where the filter selects a small subset through
+        the video_name/timestamp indexes and exact scoring beats post-filtering
+        approximate results taken from the whole library.
+
+        Returns:
+            list: Top results, each carrying its cosine 'vector_score'
+        """
+        query_norm = math.sqrt(sum(x * x for x in query_embedding)) or 1.0
+        projection = {
+            "text": 1,
+            "video_name": 1,
+            "source": 1,
+            "start_timestamp_millis": 1,
+            "end_timestamp_millis": 1,
+            "embedding": 1
+        }
+
+        scored = []
+        docs = docdb_pool.with_retries(lambda: list(self.collection.find(filter_condition, projection)))
+        for doc in docs:
+            embedding = doc.pop('embedding', None)
+            if not embedding or len(embedding) != len(query_embedding):
+                continue
+            doc['vector_score'] = cosine_similarity(query_embedding, embedding, query_norm)
+            scored.append(doc)
+
+        return heapq.nlargest(top_k, scored, key=lambda doc: doc['vector_score'])
+
+    def score_exactly(self, query_embedding, results):
+        """
+        Give approximate vector hits their exact cosine 'vector_score'
+
+        The IVF search returns its neighbours unscored, so before per-shard
+        lists can be merged their stored embeddings are fetched by _id and
+        scored as exact_vector_search does. Hits whose segment is gone by
+        then are dropped.
+        """
+        unscored = [result for result in results if 'vector_score' not in result]
+        if not unscored:
+            return results
+        ids = [result['_id'] for result in unscored]
+        docs = docdb_pool.with_retries(lambda: list(self.collection.find({"_id": {"$in": ids}}, {"embedding": 1})))
+        embeddings = {str(doc['_id']): doc.get('embedding') for doc in docs}
+        query_norm = math.sqrt(sum(x * x for x in query_embedding)) or 1.0
+        for result in unscored:
+            embedding = embeddings.get(str(result['_id']))
+            if embedding and len(embedding) == len(query_embedding):
+                result['vector_score'] = cosine_similarity(query_embedding, embedding, query_norm)
+        return [result for result in results if 'vector_score' in result]
+
+    def vector_search(self, query_text, search_mode, top_k=10, query_embedding=None, scope=None, extra_filter=None):
         """
         Perform vector search based on the search mode
 
@@ -139,47 +498,52 @@ class VideoSearch:
             query_text (str): The search query text
             search_mode (str): Either "scene" or "transcripts"
             top_k (int): Number of results to return
+            query_embedding (list): Precomputed query embedding (optional)
+            scope (dict): Restrict results to videos and/or a time window (optional)
+            extra_filter (dict): Additional MongoDB filter applied to the results (optional)
 
         Returns:
             list: Search results
         """
         try:
             # Generate embedding for the query
-            query_embedding = self.get_embedding(query_text)
+            if query_embedding is None:
+                query_embedding = self.get_embedding(query_text)
             logger.warning(f"Generated embedding for query: '{query_text}'")
 
-            # Build the filter based on search mode
-            filter_condition = {}
-            if search_mode == "scene":
-                # Search in video_summary and chapter summaries
-                filter_condition = {
-                    "source": {
-                        "$regex": ".*summary$"  # Match sources ending with "summary"
-                    }
-                }
-                logger.info(f"Searching in summaries")
-            elif search_mode == "transcripts":
-                # Search in transcript chunks
-                filter_condition = {
-                    "source": {
-                        "$regex": ".*transcript_chunk.*"  # Match sources containing "transcript_chunk"
-                    }
-                }
-                logger.info(f"Searching in transcripts")
-            else:
-                raise ValueError(f"Invalid search mode: {search_mode}")
+            # Build the filter based on search mode and scope
+            filter_condition = self.build_filter_condition(search_mode, scope)
+            # Never compare the query against vectors from a different embedding backend
+            filter_condition = {"$and": [filter_condition, self.embedding_backend.document_filter()]}
+            if extra_filter:
+                filter_condition["$and"].append(extra_filter)
+
+            if SEARCH_DIAGNOSTICS:
+                # Check if there are matching documents
+                matching_count = self.collection.count_documents(filter_condition)
+                logger.info(f"Found {matching_count} documents matching the filter condition")
 
-            # Check if there are matching documents
-            matching_count = self.collection.count_documents(filter_condition)
-            logger.info(f"Found {matching_count} documents matching the filter condition")
+                # Check if there are documents containing the query term
+                text_query = {"text": {"$regex": query_text, "$options": "i"}}
+                combined_query = {**text_query, **filter_condition}
+                text_matching_count = self.collection.count_documents(combined_query)
+                logger.info(f"Found {text_matching_count} documents containing '{query_text}' and matching filter")
 
-            # Check if there are documents containing the query term
-            text_query = {"text": {"$regex": query_text, "$options": "i"}}
-            combined_query = {**text_query, **filter_condition}
-            text_matching_count = self.collection.count_documents(combined_query)
-            logger.info(f"Found {text_matching_count} documents containing '{query_text}' and matching filter")
+            if scope:
+                # Small scopes are scored exactly over the index-selected subset
+                scoped_count = docdb_pool.with_retries(
+                    lambda: self.collection.count_documents(filter_condition, limit=SCOPED_EXACT_MAX_DOCS + 1))
+                if scoped_count <= SCOPED_EXACT_MAX_DOCS:
+                    results = self.exact_vector_search(query_embedding, filter_condition, top_k)
+                    logger.warning(f"Scoped exact vector search over {scoped_count} documents "
+                                   f"completed with {len(results)} results")
+                    return results
 
-            # Build the vector search pipeline
+            # Build the vector search pipeline. Approximate search cannot pre-filter,
+            # so a scoped or extra-filtered search (e.g. excluding the source
+            # video, whose own chunks are the nearest neighbours) fetches more candidates
+            post_filtered = bool(scope or extra_filter)
+            candidate_k = top_k * (SCOPED_VECTOR_K_FACTOR if post_filtered else 3)
             pipeline = [
                 {
                     "$search": {
@@ -187,7 +551,7 @@ class VideoSearch:
                             "vector": query_embedding,
                             "path": "embedding",
                             "similarity": "cosine",
-                            "k": top_k * 3,  # Fetch more results since we'll filter them
+                            "k": candidate_k,  # Fetch more results since we'll filter them
                             "efSearch": 64
                         }
                     }
@@ -211,12 +575,17 @@ class VideoSearch:
                 }
             ]
 
-            # Execute the search
-            results = list(self.collection.aggregate(pipeline))
-            logger.warning(f"Vector search completed with {len(results)} results")
+            # Execute the search; reads are idempotent, so a failover is retried
+            results = docdb_pool.with_retries(lambda: list(self.collection.aggregate(pipeline)))
+            if post_filtered and len(results) < top_k:
+                # The filter rejected most candidates; widen once before giving up
+                candidate_k *= SCOPED_VECTOR_K_FACTOR
+                pipeline[0]["$search"]["vectorSearch"]["k"] = candidate_k
+                results = docdb_pool.with_retries(lambda: list(self.collection.aggregate(pipeline)))
+            logger.warning(f"Vector search completed with {len(results)} results (k={candidate_k})")
             
             # If no results, try to get some sample documents
-            if len(results) == 0:
+            if len(results) == 0 and SEARCH_DIAGNOSTICS:
                 sample_docs = list(self.collection.find(filter_condition).limit(2))
                 for doc in sample_docs:
                     doc_id = str(doc.get('_id', 'unknown'))
@@ -229,39 +598,91 @@ class VideoSearch:
             logger.error(f"Error in vector search: {str(e)}")
             raise
 
-    def text_search(self, query_text, search_mode, top_k=10):
+    def hierarchical_vector_search(self, query_text, top_k=10, query_embedding=None, scope=None, routing=None):
         """
-        Perform text search based on the search mode
+        Coarse-to-fine transcript search: shortlist chapters (or videos) by
+        their summary embeddings, then score only the chunks inside them
+
+        Chunks carry their chapter's video_name and timestamps, so the chunk
+        stage selects its subset through the video/timestamp index and its cost
+        grows with the shortlist rather than with the library.
+
+        Args:
+            query_text (str): The search query text
+            top_k (int): Number of chunks to return
+            query_embedding (list): Precomputed query embedding (optional)
+            scope (dict): Restrict results to videos and/or a time window (optional)
+            routing (dict): Validated routing from parse_routing
+
+        Returns:
+            list: Chunk results, each carrying its cosine 'vector_score'
+        """
+        if query_embedding is None:
+            query_embedding = self.get_embedding(query_text)
+
+        route_by = routing['route_by']
+        if route_by == 'chapter':
+            route_filter = {"source": {"$regex": CHAPTER_SUMMARY_PATTERN.pattern}}
+        else:
+            route_filter = {"source": "video_summary"}
+        routes = self.vector_search(query_text, "scene", routing['route_limit'], query_embedding,
+                                    scope=scope, extra_filter=route_filter)
+
+        if route_by == 'video':
+            video_names = list(dict.fromkeys(route.get('video_name') for route in routes))
+            route_conditions = [{"video_name": {"$in": video_names}}] if video_names else []
+        else:
+            route_conditions = []
+            for route in routes:
+                match = CHAPTER_SUMMARY_PATTERN.match(route.get('source', ''))
+                if match:
+                    route_conditions.append({
+                        "video_name": route.get('video_name'),
+                        "start_timestamp_millis": route.get('start_timestamp_millis'),
+                        "end_timestamp_millis": route.get('end_timestamp_millis'),
+                        "source": {"$regex": f"^chapter_{match.group(1)}_transcript_chunk"}
+                    })
+        if not route_conditions:
+            logger.warning(f"No {route_by} summaries matched, falling back to a flat transcript search")
+            return self.vector_search(query_text, "transcripts", top_k, query_embedding, scope)
+
+        chunk_filter = {"$and": [
+            self.build_filter_condition("transcripts", scope),
+            self.embedding_backend.document_filter(),
+            {"$or": route_conditions}
+        ]}
+        chunk_count = docdb_pool.with_retries(
+            lambda: self.collection.count_documents(chunk_filter, limit=SCOPED_EXACT_MAX_DOCS + 1))
+        if chunk_count > SCOPED_EXACT_MAX_DOCS:
+            # Very long shortlisted videos: approximate search, post-filtered to the shortlist
+            logger.warning(f"Shortlist holds more than {SCOPED_EXACT_MAX_DOCS} chunks, using approximate search")
+            return self.vector_search(query_text, "transcripts", top_k, query_embedding, scope,
+                                      extra_filter={"$or": route_conditions})
+
+        results = self.exact_vector_search(query_embedding, chunk_filter, top_k)
+        logger.warning(f"Hierarchical search routed to {len(routes)} {route_by} summaries, "
+                       f"scored {chunk_count} chunks, {len(results)} results")
+        return results
+
+    def text_search(self, query_text, search_mode, top_k=10, scope=None):
+        """
+        Perform text search based on the search mode, ordered by text score
 
         Args:
             query_text (str): The search query text
             search_mode (str): Either "scene" or "transcripts"
             top_k (int): Number of results to return
+            scope (dict): Restrict results to videos and/or a time window (optional)
 
         Returns:
-            list: Search results
+            list: Search results, best match first, each carrying its 'text_score'
         """
         try:
-            # Build the filter based on search mode
-            filter_condition = {}
-            if search_mode == "scene":
-                # Search in video_summary and chapter summaries
-                filter_condition = {
-                    "source": {
-                        "$regex": ".*summary$"  # Match sources ending with "summary"
-                    }
-                }
-            elif search_mode == "transcripts":
-                # Search in transcript chunks
-                filter_condition = {
-                    "source": {
-                        "$regex": ".*transcript_chunk.*"  # Match sources containing "transcript_chunk"
-                    }
-                }
-            else:
-                raise ValueError(f"Invalid search mode: {search_mode}")
+            # Build the filter based on search mode and scope
+            filter_condition = self.build_filter_condition(search_mode, scope)
 
-            # Use aggregation pipeline for text search to avoid text score issues
+            # Sort by textScore so the lexical leg returns its best matches
+            # rather than an arbitrary top_k subset of everything that matched
             pipeline = [
                 {
                     "$match": {
@@ -275,16 +696,20 @@ class VideoSearch:
                         "video_name": 1,
                         "source": 1,
                         "start_timestamp_millis": 1,
-                        "end_timestamp_millis": 1
+                        "end_timestamp_millis": 1,
+                        "text_score": {"$meta": "textScore"}
                     }
                 },
+                {
+                    "$sort": {"text_score": {"$meta": "textScore"}}
+                },
                 {
                     "$limit": top_k
                 }
             ]
 
             # Execute the search using aggregation
-            results = list(self.collection.aggregate(pipeline))
+            results = docdb_pool.with_retries(lambda: list(self.content.aggregate(pipeline)))
 
             logger.warning(f"Text search completed with {len(results)} results")
             return results
@@ -293,36 +718,264 @@ class VideoSearch:
             raise
 
 
-    def combined_search(self, query_text, search_mode, top_k=10):
+    def for_shard(self, shard):
+        """
+        Return a VideoSearch reading the segment collections of one shard
+
+        It shares this instance's clients, embedding backend and corpus
+        generation; metadata, caches and the visibility filter stay on the
+        project database.
+        """
+        searcher = copy.copy(self)
+        segment_db = docdb_pool.get_shard_database(shard, connect=not SNAPSHOT_INIT)
+        searcher.shard = shard
+        searcher.collection = segment_db[os.environ.get('COLLECTION_NAME', 'videodata')]
+        if docdb_pool.is_split_layout():
+            searcher.content = segment_db[docdb_pool.CONTENT_COLLECTION_NAME]
+        else:
+            searcher.content = searcher.collection
+        return searcher
+
+    def target_shards(self, scope=None):
+        """Shards that can hold matches: those of the scoped videos, or all of them"""
+        video_names = (scope or {}).get('video_names')
+        if video_names:
+            return sorted({docdb_pool.shard_for_video(video_name) for video_name in video_names})
+        return docdb_pool.shard_names()
+
+    def scatter(self, shards, operation):
+        """Start operation(searcher) on every shard in parallel; returns {future: shard}"""
+        return {shard_executor.submit(operation, self.for_shard(shard)): shard for shard in shards}
+
+    def gather(self, futures, timeout=None):
+        """
+        Wait up to timeout seconds for the futures of scatter()
+
+        Returns:
+            tuple: ({shard: result} for the shards that answered, sorted list
+                   of the shards that failed or did not answer in time)
+        """
+        done, _ = wait(futures, timeout=timeout)
+        answered, missing = {}, []
+        for future, shard in futures.items():
+            if future not in done:
+                logger.warning(f"Shard {shard} did not answer within {timeout} s, continuing without it")
+                missing.append(shard)
+                continue
+            try:
+                answered[shard] = future.result()
+            except Exception as e:
+                logger.error(f"Shard {shard} failed, continuing without it: {str(e)}")
+                missing.append(shard)
+        return answered, sorted(missing)
+
+    def scatter_gather(self, shards, operation, deadline):
+        """
+        Run operation(searcher) on shards in parallel, each within SEARCH_LEG_BUDGET_MS
+
+        Returns:
+            tuple: (results of the shards that answered, in shard order, sorted list of missing shards)
+        """
+        def bounded(searcher):
+            with pymongo.timeout(deadline.stage_timeout(SEARCH_LEG_BUDGET_MS)):
+                return operation(searcher)
+
+        answers, missing = self.gather(self.scatter(shards, bounded), deadline.stage_timeout(SEARCH_LEG_BUDGET_MS))
+        return [answers[shard] for shard in shards if shard in answers], missing
+
+    def scatter_gather_legs(self, query_text, search_mode, top_k, deadline, scope, routing, embedding_future,
+                            embedding_started, cancelled=None):
+        """
+        Run the text and vector legs on every target shard and merge each leg's global top_k
+
+        The text legs start while the query embedding is in flight; the vector
+        legs start once it arrives. Vector hits are scored exactly and hydrated
+        on their own shard, so the merge compares cosine scores. Once cancelled
+        is set, no shard query is started.
+
+        Returns:
+            tuple: (vector results or None, text results or None, shards missing from either leg)
+        """
+        shards = self.target_shards(scope)
+        shard_k = per_shard_k(top_k, len(shards))
+        query_embedding = None
+
+        def text_leg(searcher):
+            if cancelled is not None and cancelled.is_set():
+                raise SearchCancelled()
+            with pymongo.timeout(deadline.stage_timeout(SEARCH_LEG_BUDGET_MS)):
+                return searcher.text_search(query_text, search_mode, shard_k, scope)
+
+        def vector_leg(searcher):
+            with pymongo.timeout(deadline.stage_timeout(SEARCH_LEG_BUDGET_MS)):
+                if routing:
+                    results = searcher.hierarchical_vector_search(query_text, shard_k, query_embedding, scope, routing)
+                else:
+                    results = searcher.vector_search(query_text, search_mode, shard_k, query_embedding, scope)
+                return searcher.hydrate_texts(searcher.score_exactly(query_embedding, results))
+
+        legs_started = time.monotonic()
+        text_futures = self.scatter(shards, text_leg)
+        vector_futures = {}
+        try:
+            query_embedding = embedding_future.result(timeout=deadline.stage_timeout(EMBEDDING_BUDGET_MS))
+            deadline.record('embedding', embedding_started)
+            vector_futures = self.scatter(shards, vector_leg)
+        except SearchCancelled:
+            pass
+        except FutureTimeoutError:
+            logger.error("Query embedding did not arrive within its budget, continuing without the vector leg")
+        except Exception as e:
+            logger.error(f"Query embedding failed, continuing without the vector leg: {str(e)}")
+
+        text_answers, text_missing = self.gather(text_futures, deadline.stage_timeout(SEARCH_LEG_BUDGET_MS))
+        vector_answers, vector_missing = self.gather(vector_futures, deadline.stage_timeout(SEARCH_LEG_BUDGET_MS))
+        deadline.record('shards', legs_started)
+
+        # A leg no shard answered has failed as a whole
+        vector_results = text_results = None
+        if vector_answers:
+            vector_results = merge_shard_results([vector_answers[shard] for shard in shards if shard in vector_answers],
+                                                 top_k, 'vector_score')
+        if text_answers:
+            text_results = merge_shard_results([text_answers[shard] for shard in shards if shard in text_answers],
+                                               top_k, 'text_score')
+        missing = sorted(set(text_missing) | set(vector_missing))
+        logger.info(f"Searched {len(shards)} shards with k={shard_k}, missing: {missing or 'none'}")
+        return vector_results, text_results, missing
+
+    def search_legs(self, query_text, search_mode, top_k, deadline, scope, routing, embedding_future,
+                    embedding_started, cancelled=None):
+        """
+        Run the text leg, then the vector leg once the query embedding arrives
+
+        A leg not yet started when cancelled is set is skipped.
+
+        Returns:
+            tuple: (vector results or None, text results or None); a failed leg is None
+        """
+        text_results = None
+        try:
+            if cancelled is not None and cancelled.is_set():
+                raise SearchCancelled()
+            with pymongo.timeout(deadline.stage_timeout(SEARCH_LEG_BUDGET_MS)), deadline.timed('text'):
+                text_results = self.text_search(query_text, search_mode, top_k, scope)
+        except SearchCancelled:
+            pass
+        except Exception as e:
+            logger.error(f"Text leg failed, continuing without it: {str(e)}")
+
+        vector_results = None
+        try:
+            query_embedding = embedding_future.result(timeout=deadline.stage_timeout(EMBEDDING_BUDGET_MS))
+            # Until the embedding was available to the request, overlapping the text leg
+            deadline.record('embedding', embedding_started)
+            with pymongo.timeout(deadline.stage_timeout(SEARCH_LEG_BUDGET_MS)), deadline.timed('vector'):
+                if routing:
+                    vector_results = self.hierarchical_vector_search(query_text, top_k, query_embedding,
+                                                                     scope, routing)
+                else:
+                    vector_results = self.vector_search(query_text, search_mode, top_k, query_embedding, scope)
+        except SearchCancelled:
+            pass
+        except FutureTimeoutError:
+            logger.error("Query embedding did not arrive within its budget, continuing without the vector leg")
+        except Exception as e:
+            logger.error(f"Vector leg failed, continuing without it: {str(e)}")
+        return vector_results, text_results
+
+    def combined_search(self, query_text, search_mode, top_k=10, deadline=None, scope=None, routing=None,
+                        embedding_future=None, embedding_started=None, cancelled=None):
         """
         Perform both vector and text search and combine the results
 
+        The query embedding is generated while the text leg runs. If it does not
+        arrive within its budget, or the vector leg fails, the lexical results
+        are returned on their own; if the text leg fails the vector results are.
+        With SEARCH_SHARDS set, both legs run on every shard that can hold
+        matches and are merged per leg (see scatter_gather_legs).
+
         Args:
             query_text (str): The search query text
             search_mode (str): Either "scene" or "transcripts"
             top_k (int): Number of results to return for each search method
+            deadline (Deadline): Request deadline (optional, unbounded if omitted)
+            scope (dict): Restrict results to videos and/or a time window (optional)
+            routing (dict): Hierarchical routing from parse_routing; transcripts mode only (optional)
+            embedding_future (Future): Query embedding already in flight, with the
+                time.monotonic() reading it started at as embedding_started (optional)
+            cancelled (threading.Event): Set when the answer is no longer needed;
+                legs not started by then are skipped (optional)
 
         Returns:
-            dict: Combined search results
+            dict: Combined search results and the legs that contributed
+                  ("legs", e.g. ["vector", "text"], or ["routed_vector", "text"]
+                  for a hierarchical search); "missing_shards" when shards
+                  failed or timed out
         """
+        deadline = deadline or Deadline()
+        if search_mode != "transcripts":
+            routing = None
+
+        generation = self.get_corpus_generation()
+        cache_key = None
+        if generation is not None:
+            cache_key = make_cache_key(generation, 'combined', self.embedding_backend.backend_id, query_text,
+                                       search_mode, top_k, scope, routing)
+            with deadline.timed('cache'):
+                cached = response_cache.get(self.db, cache_key)
+            if cached is not None:
+                return cached
+
         try:
-            # Perform both search types
-            vector_results = self.vector_search(query_text, search_mode, top_k)
-            text_results = self.text_search(query_text, search_mode, top_k)
+            # Start the embedding call, then run the text leg while it is in flight
+            if embedding_future is None:
+                embedding_started = time.monotonic()
+                embedding_future = stage_executor.submit(self.get_embedding, query_text)
+
+            missing_shards = []
+            if docdb_pool.is_sharded():
+                vector_results, text_results, missing_shards = self.scatter_gather_legs(
+                    query_text, search_mode, top_k, deadline, scope, routing, embedding_future, embedding_started,
+                    cancelled)
+            else:
+                vector_results, text_results = self.search_legs(
+                    query_text, search_mode, top_k, deadline, scope, routing, embedding_future, embedding_started,
+                    cancelled)
+
+            if cancelled is not None and cancelled.is_set():
+                return {"results": [], "legs": []}
+            if vector_results is None and text_results is None:
+                raise RuntimeError("Both the vector and the text search legs failed")
+
+            vector_leg = 'routed_vector' if routing else 'vector'
+            legs = [leg for leg, leg_results in ((vector_leg, vector_results), ('text', text_results))
+                    if leg_results is not None]
 
             # Process results to make them JSON serializable (convert ObjectId to string)
             processed_vector_results = []
-            for result in vector_results:
+            for result in vector_results or []:
                 result['_id'] = str(result['_id'])
                 result['search_type'] = 'vector'  # Add search type for vector results
                 processed_vector_results.append(result)
 
+            # Lean vector hits carry no text in the split layout
+            self.hydrate_texts(processed_vector_results)
+
             processed_text_results = []
-            for result in text_results:
+            for result in text_results or []:
                 result['_id'] = str(result['_id'])
                 result['search_type'] = 'text'  # Add search type for text results
                 processed_text_results.append(result)
 
+            # Reciprocal rank fusion over both legs, used when rerank is skipped
+            fusion_scores = {}
+            leg_ranks = {'vector_rank': {}, 'text_rank': {}}
+            for rank_field, ranked in (('vector_rank', processed_vector_results), ('text_rank', processed_text_results)):
+                for rank, result in enumerate(ranked):
+                    fusion_scores[result['_id']] = fusion_scores.get(result['_id'], 0.0) + 1.0 / (RRF_K + rank + 1)
+                    leg_ranks[rank_field][result['_id']] = rank
+
             # Combine all results into one list
             all_results = processed_vector_results + processed_text_results
 
@@ -333,16 +986,398 @@ class VideoSearch:
                 result_id = result['_id']
                 if result_id not in seen_ids:
                     seen_ids.add(result_id)
+                    result['fusion_score'] = fusion_scores[result_id]
+                    # Per-leg ranks feed the local reranker
+                    for rank_field, ranks in leg_ranks.items():
+                        if result_id in ranks:
+                            result[rank_field] = ranks[result_id]
                     unique_results.append(result)
             unique_results.reverse()  # Reverse the list back to original order
 
+            combined_results = {"results": unique_results, "legs": legs}
+            if missing_shards:
+                combined_results["missing_shards"] = missing_shards
+            # Only complete results are cached; a degraded answer must not outlive the slowdown
+            if cache_key and len(legs) == 2 and not missing_shards:
+                response_cache.set(self.db, cache_key, combined_results)
+
             # Return unique results directly
-            return {"results": unique_results}
+            return combined_results
         except Exception as e:
             logger.error(f"Error in combined search: {str(e)}")
             raise
 
-    def rerank_results(self, query, results):
+    def similar_segments(self, segment_id, search_mode=None, top_k=10, exclude_same_video=False, scope=None,
+                         deadline=None):
+        """
+        Find segments similar to a stored one, reusing its stored embedding
+
+        No embedding model is called and nothing is reranked: the source
+        segment's vector goes straight into the vector leg.
+
+        Args:
+            segment_id (str): _id of the source segment in videodata
+            search_mode (str): "scene" or "transcripts"; defaults to the source segment's kind
+            top_k (int): Number of results to return
+            exclude_same_video (bool): Also drop segments from the source segment's video
+            scope (dict): Restrict results to videos and/or a time window (optional)
+            deadline (Deadline): Request deadline bounding each shard (optional)
+
+        Returns:
+            dict: "results" in similarity order, "search_path" and "source_segment"
+                  ("missing_shards" too when shards failed or timed out),
+                  or None if the segment does not exist or has no embedding
+        """
+        deadline = deadline or Deadline()
+        projection = {"embedding": 1, "embedding_backend": 1, "video_name": 1, "source": 1,
+                      "start_timestamp_millis": 1, "end_timestamp_millis": 1}
+        if docdb_pool.is_sharded():
+            # The _id does not say which shard holds the segment
+            found, _ = self.scatter_gather(docdb_pool.shard_names(),
+                                           lambda searcher: docdb_pool.with_retries(
+                                               lambda: searcher.collection.find_one({"_id": segment_id}, projection)),
+                                           deadline)
+            source = next((doc for doc in found if doc), None)
+        else:
+            source = docdb_pool.with_retries(lambda: self.collection.find_one({"_id": segment_id}, projection))
+        if not source or not source.get('embedding'):
+            return None
+        # A vector from another backend lives in a different embedding space
+        source_backend = source.pop('embedding_backend', None) or self.embedding_backend.backend_id
+        if source_backend != self.embedding_backend.backend_id:
+            logger.warning(f"Segment {segment_id} was embedded by {source_backend}, "
+                           f"not {self.embedding_backend.backend_id}")
+            return None
+
+        embedding = source.pop('embedding')
+        source['_id'] = str(source['_id'])
+        if search_mode is None:
+            search_mode = "scene" if source.get('source', '').endswith('summary') else "transcripts"
+
+        generation = self.get_corpus_generation()
+        cache_key = None
+        if generation is not None:
+            cache_key = make_cache_key(generation, 'similar', self.embedding_backend.backend_id, segment_id,
+                                       search_mode, top_k, exclude_same_video, scope)
+            cached = response_cache.get(self.db, cache_key)
+            if cached is not None:
+                return cached
+
+        exclusion = {"_id": {"$ne": source['_id']}}
+        if exclude_same_video:
+            exclusion["video_name"] = {"$ne": source.get('video_name')}
+
+        def similar_leg(searcher, k):
+            return searcher.hydrate_texts(searcher.vector_search(f"similar_to:{segment_id}", search_mode, k,
+                                                                 query_embedding=embedding, scope=scope,
+                                                                 extra_filter=exclusion))
+
+        missing_shards = []
+        if docdb_pool.is_sharded():
+            shards = self.target_shards(scope)
+            k = per_shard_k(top_k, len(shards))
+            # Shard lists merge on exact scores, which the IVF hits lack
+            answers, missing_shards = self.scatter_gather(
+                shards, lambda searcher: searcher.score_exactly(embedding, similar_leg(searcher, k)), deadline)
+            results = merge_shard_results(answers, top_k, 'vector_score')
+        else:
+            results = similar_leg(self, top_k)
+        for result in results:
+            result['_id'] = str(result['_id'])
+            result['search_type'] = 'vector'
+
+        response = {"results": results, "search_path": "stored_vector", "source_segment": source}
+        if missing_shards:
+            response["missing_shards"] = missing_shards
+        elif cache_key:
+            response_cache.set(self.db, cache_key, response)
+        return response
+
+    def hydrate_texts(self, results):
+        """
+        Fill in 'text' on results that lack it (vector hits in the split layout)
+
+        Hot segments come from the in-process cache; the rest are fetched from
+        the content store in one batched _id lookup.
+        """
+        missing = []
+        for result in results:
+            if 'text' in result:
+                continue
+            text = content_cache.get(str(result['_id']))
+            if text is None:
+                missing.append(result)
+            else:
+                result['text'] = text
+        if not missing:
+            return results
+
+        missing_ids = [result['_id'] for result in missing]
+        docs = docdb_pool.with_retries(lambda: list(self.content.find({"_id": {"$in": missing_ids}}, {"text": 1})))
+        texts = {str(doc['_id']): doc.get('text', '') for doc in docs}
+        for result in missing:
+            text = texts.get(str(result['_id']))
+            if text is None:
+                logger.warning(f"No content for segment {result['_id']}")
+                text = ""
+            else:
+                content_cache.set(str(result['_id']), text)
+            result['text'] = text
+        return results
+
+    def get_texts(self, segment_ids):
+        """
+        Fetch the full text of segments by _id, for clients using snippet responses
+
+        Segments of videos being replaced or deleted are left out, as in search.
+
+        Returns:
+            list: Documents with "_id", "text" and their segment metadata, in request order
+        """
+        visible = visibility_filter.get(self.db, self.get_corpus_generation())
+
+        def fetch(searcher):
+            return docdb_pool.with_retries(lambda: list(searcher.content.find(
+                {"_id": {"$in": segment_ids}, **visible},
+                {"text": 1, "video_name": 1, "source": 1, "start_timestamp_millis": 1, "end_timestamp_millis": 1}
+            )))
+
+        if docdb_pool.is_sharded():
+            # Segment ids do not say which shard holds them; ids on a missing shard are left out
+            answers, _ = self.scatter_gather(docdb_pool.shard_names(), fetch, Deadline())
+            docs = [doc for shard_docs in answers for doc in shard_docs]
+        else:
+            docs = fetch(self)
+        by_id = {str(doc['_id']): {**doc, '_id': str(doc['_id'])} for doc in docs}
+        return [by_id[segment_id] for segment_id in segment_ids if segment_id in by_id]
+
+    def search_and_rerank(self, query_text, search_mode, top_k=10, deadline=None, scope=None, grouping=None,
+                          reranker=None, routing=None):
+        """
+        Run the combined search, rerank it and keep the relevant unique results
+
+        With the "auto" reranker, Cohere is tried first and the local scorer
+        takes over when Cohere is throttled, failing, slower than its budget, or
+        when too little of the deadline is left to call it. After a Cohere
+        failure, "auto" goes straight to the local scorer for a cooldown period.
+        With "cohere" there is no local fallback: the fused results are
+        returned in fusion order instead.
+        With grouping, hits are collapsed per video (or chapter) before rerank,
+        so only the best segments of the best groups are sent to the reranker.
+
+        Args:
+            query_text (str): The search query text
+            search_mode (str): Either "scene" or "transcripts"
+            top_k (int): Number of results to return for each search method
+            deadline (Deadline): Request deadline (optional, unbounded if omitted)
+            scope (dict): Restrict results to videos and/or a time window (optional)
+            grouping (dict): Validated grouping from parse_grouping (optional)
+            reranker (str): "auto", "cohere" or "local" (optional, defaults to RERANKER)
+            routing (dict): Hierarchical routing from parse_routing (optional)
+
+        Returns:
+            dict: "results" sorted by relevance and the "search_path" taken,
+                  e.g. "vector+text+rerank", "vector+text+local_rerank",
+                  "vector+text" or "text"; with grouping, also "groups"
+                  summarizing each kept group; when answered from the
+                  semantic cache, also "semantic_cache" with the similarity
+                  to the cached query; "missing_shards" when the results
+                  lack shards that failed or timed out
+        """
+        deadline = deadline or Deadline()
+        reranker = reranker or DEFAULT_RERANKER
+
+        generation = self.get_corpus_generation()
+        cache_key = None
+        if generation is not None:
+            cache_key = make_cache_key(generation, 'reranked', self.embedding_backend.backend_id, query_text,
+                                       search_mode, top_k, scope, grouping, reranker, routing)
+            with deadline.timed('cache'):
+                cached = response_cache.get(self.db, cache_key)
+            if cached is not None:
+                return cached
+
+        # Differently worded queries with nearly the same embedding share an answer. The
+        # text leg starts with the embedding, so a miss does not wait for Bedrock and the
+        # semantic lookup before it; the vector leg waits for the lookup to miss, and a
+        # hit cancels whatever has not started yet.
+        semantic_key = None
+        query_embedding = None
+        if SEMANTIC_CACHE_ENABLED and generation is not None:
+            semantic_key = make_cache_key(generation, 'semantic', self.embedding_backend.backend_id, search_mode,
+                                          top_k, scope, grouping, reranker, routing)
+            embedding_started = time.monotonic()
+            embedding_future = stage_executor.submit(self.get_embedding, query_text)
+            # Resolves to the embedding once the semantic cache has missed
+            vector_gate = Future()
+            cancelled = threading.Event()
+            combined_future = stage_executor.submit(self.combined_search, query_text, search_mode, top_k, deadline,
+                                                    scope, routing, vector_gate, embedding_started, cancelled)
+            try:
+                query_embedding = embedding_future.result(timeout=deadline.stage_timeout(EMBEDDING_BUDGET_MS))
+            except FutureTimeoutError as e:
+                logger.error("Query embedding did not arrive within its budget, skipping the semantic cache")
+                vector_gate.set_exception(e)
+            except Exception as e:
+                logger.error(f"Error generating embedding, skipping the semantic cache: {str(e)}")
+                vector_gate.set_exception(e)
+            if query_embedding is not None:
+                with deadline.timed('semantic_cache'):
+                    cached, similarity = semantic_cache.get(semantic_key, query_embedding)
+                if cached is not None:
+                    cancelled.set()
+                    vector_gate.set_exception(SearchCancelled())
+                    cached["semantic_cache"] = {"similarity": round(similarity, 4)}
+                    return cached
+                vector_gate.set_result(query_embedding)
+            combined_results = combined_future.result()
+        else:
+            combined_results = self.combined_search(query_text, search_mode, top_k, deadline, scope, routing)
+        legs = combined_results["legs"]
+        missing_shards = combined_results.get("missing_shards")
+
+        if not combined_results["results"]:
+            logger.warning("No search results found")
+            response = {"results": [], "search_path": "+".join(legs)}
+            if missing_shards:
+                response["missing_shards"] = missing_shards
+            return response
+
+        candidates = combined_results["results"]
+        if grouping:
+            candidates, _ = group_results(candidates, grouping, 'fusion_score')
+            logger.info(f"Grouped {len(combined_results['results'])} hits into {len(candidates)} candidates")
+
+        reranked_results = None
+        rerank_stage = None
+        cohere_reranker = get_cohere_reranker()
+        use_cohere = reranker == 'cohere' or (reranker == 'auto' and cohere_reranker.is_healthy())
+        rerank_started = time.monotonic()
+        if use_cohere and deadline.has_at_least(RERANK_MIN_BUDGET_MS):
+            rerank_future = stage_executor.submit(self.rerank_results, query_text, candidates, cohere_reranker)
+            try:
+                # Rerank the combined results
+                reranked_results = rerank_future.result(timeout=deadline.stage_timeout(RERANK_BUDGET_MS))
+                rerank_stage = 'rerank'
+            except FutureTimeoutError:
+                cohere_reranker.mark_unhealthy("did not finish within its budget")
+            except Exception as e:
+                cohere_reranker.mark_unhealthy(f"failed ({str(e)})")
+        elif use_cohere:
+            logger.warning(f"Only {deadline.remaining_ms()} ms left, skipping Cohere rerank")
+
+        if reranked_results is None and reranker != 'cohere':
+            # The local scorer runs in-process in a few milliseconds
+            reranked_results = self.rerank_results(query_text, candidates, local_reranker)
+            rerank_stage = 'local_rerank'
+        deadline.record('rerank', rerank_started)
+
+        if reranked_results is None:
+            fused_results = sorted(candidates, key=lambda x: x['fusion_score'], reverse=True)
+            response = {"results": fused_results, "search_path": "+".join(legs)}
+            if grouping:
+                response["results"], response["groups"] = group_results(fused_results, grouping, 'fusion_score')
+            if missing_shards:
+                response["missing_shards"] = missing_shards
+            return response
+
+        # Sort results by relevance score
+        sorted_results = sorted(reranked_results, key=lambda x: x['relevance_score'], reverse=True)
+
+        # Deduplicate results based on _id while maintaining the highest relevance score
+        seen_ids = set()
+        unique_results = []
+        for result in sorted_results:
+            if result['_id'] not in seen_ids:
+                seen_ids.add(result['_id'])
+                unique_results.append(result)
+
+        # Filter out results with similarity below the threshold
+        local = rerank_stage == 'local_rerank'
+        threshold = LOCAL_MIN_RELEVANCE_SCORE if local else MIN_RELEVANCE_SCORE
+        final_results = [result for result in unique_results if result['relevance_score'] >= threshold]
+        if local and not grouping:
+            final_results = final_results[:top_k]
+
+        response = {"results": final_results, "search_path": "+".join(legs + [rerank_stage])}
+        if grouping:
+            # Regroup on the reranked scores so groups are ordered by relevance
+            response["results"], response["groups"] = group_results(final_results, grouping, 'relevance_score')
+        if missing_shards:
+            response["missing_shards"] = missing_shards
+        # A local fallback for a Cohere request is a degraded answer and is not cached
+        requested_stage = 'local_rerank' if reranker == 'local' else 'rerank'
+        if cache_key and len(legs) == 2 and rerank_stage == requested_stage and not missing_shards:
+            response_cache.set(self.db, cache_key, response)
+            if semantic_key and query_embedding is not None:
+                semantic_cache.set(semantic_key, query_text, query_embedding, response)
+        return response
+
+    def batch_search(self, requests, deadline=None):
+        """
+        Run many searches against this instance's shared connection pool
+
+        Embeddings are computed once per distinct query text and identical
+        (query, mode, top_k, scope) requests are searched and reranked only once.
+
+        Args:
+            requests (list): Validated dicts with "query", "mode", "top_k", "scope", "grouping",
+                "reranker" and "routing"
+            deadline (Deadline): Deadline shared by the whole batch (optional)
+
+        Returns:
+            list: One dict per request, holding "frontend_results" and
+                  "search_path", or "error"
+        """
+        deadline = deadline or Deadline()
+
+        def request_key(request):
+            return (request['query'], request['mode'], request['top_k'],
+                    json.dumps(request.get('scope'), sort_keys=True),
+                    json.dumps(request.get('grouping'), sort_keys=True), request.get('reranker'),
+                    json.dumps(request.get('routing'), sort_keys=True))
+
+        unique_requests = {}
+        for request in requests:
+            unique_requests.setdefault(request_key(request), request)
+        unique_queries = list(dict.fromkeys(request['query'] for request in unique_requests.values()))
+        logger.warning(f"Batch of {len(requests)} queries: {len(unique_requests)} unique searches, "
+                       f"{len(unique_queries)} unique embeddings")
+
+        with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+            # Warm the embedding cache so concurrent searches share one call per text
+            embedding_futures = {query: executor.submit(self.get_embedding, query) for query in unique_queries}
+            for query, future in embedding_futures.items():
+                try:
+                    future.result(timeout=deadline.stage_timeout(EMBEDDING_BUDGET_MS))
+                except FutureTimeoutError:
+                    logger.error(f"Embedding for batch query '{query}' did not arrive within its budget")
+                except Exception as e:
+                    logger.error(f"Error generating embedding for batch query '{query}': {str(e)}")
+
+            search_futures = {
+                key: executor.submit(self.search_and_rerank, request['query'], request['mode'],
+                                     request['top_k'], deadline, request.get('scope'),
+                                     request.get('grouping'), request.get('reranker'),
+                                     request.get('routing'))
+                for key, request in unique_requests.items()
+            }
+
+        outcomes = {}
+        for key, future in search_futures.items():
+            try:
+                response = future.result()
+                outcomes[key] = {"frontend_results": response["results"], "search_path": response["search_path"]}
+                for field in ("groups", "semantic_cache", "missing_shards"):
+                    if field in response:
+                        outcomes[key][field] = response[field]
+            except Exception as e:
+                outcomes[key] = {"error": str(e)}
+
+        return [{**request, **outcomes[request_key(request)]} for request in requests]
+
+    def rerank_results(self, query, results, reranker):
+        """Score results with a reranker backend (CohereReranker or LocalReranker)"""
         # 检查结果是否为空
         if not results or len(results) == 0:
             logger.warning("No results to rerank, returning empty list")
@@ -366,42 +1401,344 @@ class VideoSearch:
                 "end_timestamp_millis": result["end_timestamp_millis"],
                 "search_type": result["search_type"]  # Preserve search type in metadata
             }
+            # Carry the lexical score through so it can feed fusion downstream
+            if result.get("text_score") is not None:
+                metadata_map[result_key]["text_score"] = result["text_score"]
 
-        # Call Cohere rerank
-        response = self.bedrock_client.invoke_model(
-            modelId="cohere.rerank-v3-5:0",
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps({
-                "api_version": 2,
-                "query": query,
-                "documents": documents,
-                "top_n": len(documents)
-            })
-        )
-
-        # Process rerank results
-        response_body = json.loads(response.get('body').read())
+        # Score every document, then combine the scores with the stored metadata
+        scores = reranker.score(query, documents, results)
         reranked_results = []
 
-        for idx, item in enumerate(response_body['results']):
-            # Get the original text and metadata using the index
-            original_index = item['index']
-            text = documents[original_index]
-            original_result = results[original_index]
+        for text, original_result, score in zip(documents, results, scores):
             metadata = metadata_map[str(original_result['_id'])]
 
             # Combine everything into a result
             result = {
                 **metadata,
                 'text': text,
-                'relevance_score': item['relevance_score'],
+                'relevance_score': score,
                 'search_type': metadata['search_type']  # Include search type in final result
             }
             reranked_results.append(result)
 
         return reranked_results
 
+def validate_top_k(top_k):
+    """Return an error message unless top_k is an integer from 1 to MAX_TOP_K"""
+    # bool is an int subclass; true/false are not result counts
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= MAX_TOP_K:
+        return f'top_k must be an integer from 1 to {MAX_TOP_K}'
+    return None
+
+def validate_search_request(query, mode, top_k=10):
+    """Return an error message for an invalid query/mode/top_k, or None if it is valid"""
+    if not query:
+        return 'Missing query parameter'
+    if not mode or mode not in ['scene', 'transcripts']:
+        return 'Invalid or missing mode parameter. Must be "scene" or "transcripts"'
+    return validate_top_k(top_k)
+
+def parse_search_scope(params, defaults=None):
+    """
+    Read the optional scope fields of a request
+
+    Accepts "video_name" (str) or "video_names" (list of str) and a time window
+    given by "start_millis" and/or "end_millis". Fields missing from params fall
+    back to defaults (used for batch-level scope).
+
+    Returns:
+        tuple: (scope dict or None, error message or None)
+    """
+    defaults = defaults or {}
+
+    video_names = params.get('video_names', defaults.get('video_names'))
+    video_name = params.get('video_name')
+    if video_name is not None:
+        video_names = [video_name]
+    if video_names is not None:
+        if isinstance(video_names, str):
+            video_names = [video_names]
+        if not isinstance(video_names, list) or not all(isinstance(name, str) and name for name in video_names):
+            return None, 'video_names must be a list of non-empty strings'
+
+    start_millis = params.get('start_millis', defaults.get('start_millis'))
+    end_millis = params.get('end_millis', defaults.get('end_millis'))
+    for name, value in (('start_millis', start_millis), ('end_millis', end_millis)):
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+            return None, f'{name} must be a non-negative integer'
+    if start_millis is not None and end_millis is not None and start_millis > end_millis:
+        return None, 'start_millis must not be greater than end_millis'
+
+    scope = {}
+    if video_names:
+        scope['video_names'] = sorted(set(video_names))
+    if start_millis is not None:
+        scope['start_millis'] = start_millis
+    if end_millis is not None:
+        scope['end_millis'] = end_millis
+    return scope or None, None
+
+def parse_grouping(params, defaults=None):
+    """
+    Read the optional grouping fields of a request
+
+    Accepts "group_by" ("video" or "chapter"), "group_limit" and
+    "segments_per_group". Fields missing from params fall back to defaults
+    (used for batch-level grouping).
+
+    Returns:
+        tuple: (grouping dict or None, error message or None)
+    """
+    defaults = defaults or {}
+    group_by = params.get('group_by', defaults.get('group_by'))
+    if group_by is None:
+        return None, None
+    if group_by not in ['video', 'chapter']:
+        return None, 'group_by must be "video" or "chapter"'
+
+    grouping = {'group_by': group_by}
+    for name, default in (('group_limit', DEFAULT_GROUP_LIMIT), ('segments_per_group', DEFAULT_SEGMENTS_PER_GROUP)):
+        value = params.get(name, defaults.get(name, default))
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            return None, f'{name} must be a positive integer'
+        grouping[name] = value
+    return grouping, None
+
+def parse_routing(params, defaults=None):
+    """
+    Read the optional hierarchical routing fields of a request
+
+    Accepts "route_by" ("chapter" or "video") and "route_limit", the number of
+    chapters or videos shortlisted by summary similarity before their
+    transcript chunks are searched. Fields missing from params fall back to
+    defaults (used for batch-level routing).
+
+    Returns:
+        tuple: (routing dict or None, error message or None)
+    """
+    defaults = defaults or {}
+    route_by = params.get('route_by', defaults.get('route_by'))
+    if route_by is None:
+        return None, None
+    if route_by not in ['chapter', 'video']:
+        return None, 'route_by must be "chapter" or "video"'
+
+    default_limit = DEFAULT_ROUTE_CHAPTERS if route_by == 'chapter' else DEFAULT_ROUTE_VIDEOS
+    route_limit = params.get('route_limit', defaults.get('route_limit', default_limit))
+    if isinstance(route_limit, bool) or not isinstance(route_limit, int) or not 1 <= route_limit <= MAX_ROUTE_LIMIT:
+        return None, f'route_limit must be an integer between 1 and {MAX_ROUTE_LIMIT}'
+    return {'route_by': route_by, 'route_limit': route_limit}, None
+
+def parse_reranker(params, defaults=None):
+    """
+    Read the optional "reranker" field ("auto", "cohere" or "local")
+
+    Returns:
+        tuple: (reranker name or None for the RERANKER default, error message or None)
+    """
+    reranker = params.get('reranker', (defaults or {}).get('reranker'))
+    if reranker is None:
+        return None, None
+    if reranker not in RERANKER_CHOICES:
+        return None, f'reranker must be one of {", ".join(RERANKER_CHOICES)}'
+    return reranker, None
+
+def handle_similar_search(body, cors_headers, deadline):
+    """Handle a "more like this" request body carrying a "similar_to" segment _id"""
+    segment_id = body.get('similar_to')
+    mode = body.get('mode')
+    top_k = body.get('top_k', 10)
+    exclude_same_video = bool(body.get('exclude_same_video', False))
+    scope, error = parse_search_scope(body)
+    snippet_chars, snippet_error = parse_response_mode(body)
+    error = error or snippet_error
+
+    if not isinstance(segment_id, str):
+        error = 'similar_to must be a segment _id string'
+    elif mode is not None and mode not in ['scene', 'transcripts']:
+        error = 'Invalid mode parameter. Must be "scene" or "transcripts"'
+    else:
+        error = error or validate_top_k(top_k)
+    if error:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': error})
+        }
+
+    logger.warning(f"Parsed similar_to: '{segment_id}', mode: {mode}, top_k: {top_k}, "
+                   f"exclude_same_video: {exclude_same_video}, scope: {scope}")
+
+    search = VideoSearch()
+    with pymongo.timeout(deadline.stage_timeout()):
+        response = search.similar_segments(segment_id, mode, top_k, exclude_same_video, scope, deadline)
+
+    if response is None:
+        return {
+            'statusCode': 404,
+            'headers': cors_headers,
+            'body': json.dumps({'error': f'Segment {segment_id} not found or has no embedding'})
+        }
+
+    if snippet_chars:
+        slim_results(response["results"], None, snippet_chars)
+
+    response_body = {
+        "frontend_results": response["results"],
+        "search_path": response["search_path"],
+        "source_segment": response["source_segment"]
+    }
+    if "missing_shards" in response:
+        response_body["missing_shards"] = response["missing_shards"]
+    return {
+        'statusCode': 200,
+        'headers': cors_headers,
+        'body': json.dumps(response_body)
+    }
+
+def parse_response_mode(params, defaults=None):
+    """
+    Read "response_mode" ("full" or "snippet") and "snippet_chars"
+
+    Returns:
+        tuple: (snippet window size, or None for full text; error message or None)
+    """
+    defaults = defaults or {}
+    response_mode = params.get('response_mode', defaults.get('response_mode', 'full'))
+    if response_mode not in ['full', 'snippet']:
+        return None, 'response_mode must be "full" or "snippet"'
+    if response_mode == 'full':
+        return None, None
+    snippet_chars = params.get('snippet_chars', defaults.get('snippet_chars', SNIPPET_CHARS))
+    if isinstance(snippet_chars, bool) or not isinstance(snippet_chars, int) or snippet_chars < 20:
+        return None, 'snippet_chars must be an integer of at least 20'
+    return snippet_chars, None
+
+def handle_fetch_text(body, cors_headers):
+    """Handle a request body carrying "fetch_text", a list of segment _ids"""
+    segment_ids = body.get('fetch_text')
+    if not isinstance(segment_ids, list) or not all(isinstance(i, str) for i in segment_ids):
+        error = 'fetch_text must be a list of segment _id strings'
+    elif len(segment_ids) > MAX_FETCH_TEXT:
+        error = f'Too many ids in fetch_text (max {MAX_FETCH_TEXT})'
+    else:
+        error = None
+    if error:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': error})
+        }
+
+    search = VideoSearch()
+    return {
+        'statusCode': 200,
+        'headers': cors_headers,
+        'body': json.dumps({
+            "documents": search.get_texts(segment_ids)
+        })
+    }
+
+def handle_suggest(body, cors_headers):
+    """Handle a typeahead request body carrying a "suggest" prefix; never calls Bedrock"""
+    prefix = body.get('suggest')
+    limit = body.get('limit', 8)
+    if not isinstance(prefix, str) or isinstance(limit, bool) or not isinstance(limit, int):
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'suggest must be a string and limit an integer'})
+        }
+
+    db = get_mongo_client()[os.environ.get('DB_NAME', 'VideoData')]
+    index = suggest_index.get(db, lambda: get_corpus_generation(db))
+
+    return {
+        'statusCode': 200,
+        'headers': cors_headers,
+        'body': json.dumps({
+            "suggestions": index.suggest(prefix, limit)
+        })
+    }
+
+def handle_batch_search(body, cors_headers, deadline):
+    """Handle a batch request body carrying a "queries" list"""
+    queries = body.get('queries')
+    if not isinstance(queries, list) or not queries:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'queries must be a non-empty list'})
+        }
+    if len(queries) > MAX_BATCH_QUERIES:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': f'Too many queries in batch (max {MAX_BATCH_QUERIES})'})
+        }
+
+    # Top-level mode, top_k and scope act as defaults for every entry in the batch
+    default_mode = body.get('mode')
+    default_top_k = body.get('top_k', 10)
+    default_scope, error = parse_search_scope(body)
+    default_grouping, grouping_error = parse_grouping(body)
+    default_reranker, reranker_error = parse_reranker(body)
+    default_routing, routing_error = parse_routing(body)
+    snippet_chars, snippet_error = parse_response_mode(body)
+    error = error or grouping_error or reranker_error or routing_error or snippet_error
+    if not error and 'top_k' in body:
+        error = validate_top_k(default_top_k)
+    if error:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': error})
+        }
+
+    batch_results = [None] * len(queries)
+    valid_requests = []
+    valid_positions = []
+    for position, item in enumerate(queries):
+        if isinstance(item, str):
+            item = {'query': item}
+        elif not isinstance(item, dict):
+            item = {}
+        request = {
+            'query': item.get('query'),
+            'mode': item.get('mode', default_mode),
+            'top_k': item.get('top_k', default_top_k)
+        }
+        request['scope'], scope_error = parse_search_scope(item, default_scope)
+        request['grouping'], grouping_error = parse_grouping(item, default_grouping)
+        request['reranker'], reranker_error = parse_reranker(item, {'reranker': default_reranker})
+        request['routing'], routing_error = parse_routing(item, default_routing)
+        error = (validate_search_request(request['query'], request['mode'], request['top_k']) or scope_error or grouping_error or
+                 reranker_error or routing_error)
+        if error:
+            batch_results[position] = {**request, 'error': error}
+        else:
+            valid_requests.append(request)
+            valid_positions.append(position)
+
+    logger.warning(f"Parsed batch of {len(queries)} queries ({len(valid_requests)} valid)")
+
+    if valid_requests:
+        search = VideoSearch()
+        for position, result in zip(valid_positions, search.batch_search(valid_requests, deadline)):
+            if snippet_chars and 'frontend_results' in result:
+                # Identical batch entries share result lists, so slim a copy
+                result['frontend_results'] = slim_results([dict(r) for r in result['frontend_results']],
+                                                          result['query'], snippet_chars)
+            batch_results[position] = result
+
+    return {
+        'statusCode': 200,
+        'headers': cors_headers,
+        'body': json.dumps({
+            "batch_results": batch_results
+        })
+    }
+
 def lambda_handler(event, context):
     """
     AWS Lambda handler function
@@ -410,7 +1747,59 @@ def lambda_handler(event, context):
     {
         "query": "search query text",
         "mode": "scene" or "transcripts",
-        "top_k": 10 (optional)
+        "top_k": 10 (optional),
+        "budget_ms": 5000 (optional latency budget, capped by the Lambda and API Gateway limits),
+        "video_names": ["video1.mp4", ...] (optional, or "video_name": "video1.mp4"),
+        "start_millis": 0 (optional, keep segments overlapping the time window),
+        "end_millis": 60000 (optional),
+        "group_by": "video" or "chapter" (optional, collapse hits per group before rerank),
+        "group_limit": 10 (optional), "segments_per_group": 2 (optional),
+        "response_mode": "full" or "snippet" (optional, snippet returns a query-centred
+            window with highlight offsets instead of the full text),
+        "snippet_chars": 200 (optional),
+        "reranker": "auto", "cohere" or "local" (optional; auto falls back to the
+            in-process local scorer when Cohere is slow, throttled or failing),
+        "route_by": "chapter" or "video" (optional, transcripts mode: shortlist by
+            summary similarity first, then search only the chunks inside),
+        "route_limit": 20 (optional, chapters or videos to shortlist)
+    }
+
+    Full text for snippet responses is fetched by _id:
+    {
+        "fetch_text": ["<segment _id>", ...]
+    }
+
+    The response's "search_path" names the stages that produced the results,
+    e.g. "vector+text+rerank", "vector+text+local_rerank" when the local
+    reranker scored them, or "text" when the search degraded to lexical only.
+    Requests over the client's rate limit get a 429, and requests shed while
+    search is overloaded a 503, both with a Retry-After header.
+    With SEMANTIC_CACHE=true, a response reused from a near-duplicate query
+    also carries "semantic_cache": {"similarity": ...}. With SEARCH_SHARDS set,
+    a response missing shards that failed or timed out lists them in
+    "missing_shards".
+
+    "More like this" event format (no embedding model call, no rerank):
+    {
+        "similar_to": "<segment _id>",
+        "mode": "scene" or "transcripts" (optional, defaults to the segment's kind),
+        "top_k": 10 (optional),
+        "exclude_same_video": false (optional),
+        plus the optional scope fields above
+    }
+
+    Typeahead event format (answered from an in-memory index):
+    {
+        "suggest": "query prefix",
+        "limit": 8 (optional)
+    }
+
+    Batch event format (per-query mode/top_k/scope/grouping/reranker/routing override the top-level defaults):
+    {
+        "queries": ["query text", {"query": "...", "mode": "scene", "top_k": 5}, ...],
+        "mode": "scene" or "transcripts" (optional default),
+        "top_k": 10 (optional default),
+        "budget_ms": 5000 (optional, shared by the whole batch)
     }
     """
     # 定义标准 CORS 头
@@ -421,6 +1810,12 @@ def lambda_handler(event, context):
         'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Requested-With,Accept'
     }
     
+    ticket = None
+    global _cold_start
+    if _cold_start:
+        _cold_start = False
+        logger.warning(f"Cold start, startup profile (seconds): {json.dumps(startup_profile)}")
+
     try:
         logger.warning(f"Lambda function started with event type: {type(event)}")
         
@@ -440,67 +1835,86 @@ def lambda_handler(event, context):
             else:
                 body = event['body']
 
-        query = body.get('query')
-        mode = body.get('mode')
-        top_k = body.get('top_k', 10)
+        if 'suggest' in body:
+            return handle_suggest(body, cors_headers)
 
-        logger.warning(f"Parsed query: '{query}', mode: {mode}, top_k: {top_k}")
-        
-        if not query:
+        # Every request carries a deadline; stages degrade instead of overrunning it
+        budget_ms, budget_error = parse_budget_ms(body.get('budget_ms'))
+        if budget_error:
             return {
                 'statusCode': 400,
                 'headers': cors_headers,
-                'body': json.dumps({'error': 'Missing query parameter'})
+                'body': json.dumps({'error': budget_error})
             }
+        deadline = Deadline.for_request(context, budget_ms)
 
-        if not mode or mode not in ['scene', 'transcripts']:
-            return {
-                'statusCode': 400,
-                'headers': cors_headers,
-                'body': json.dumps({'error': 'Invalid or missing mode parameter. Must be "scene" or "transcripts"'})
-            }
+        # Shed excess load before it reaches DocumentDB or Bedrock
+        ticket, rejection = admission.admit(event, body, cors_headers)
+        if rejection is not None:
+            kind = 'batch' if 'queries' in body else 'similar' if body.get('similar_to') else 'search'
+            if 'fetch_text' not in body:
+                query_logger.record(kind, body, rejection, deadline)
+            return rejection
 
-        # Initialize the search class
-        search = VideoSearch()
+        if 'fetch_text' in body:
+            return handle_fetch_text(body, cors_headers)
 
-        # Perform the combined search
-        combined_results = search.combined_search(query, mode, top_k)
+        if 'queries' in body:
+            response = handle_batch_search(body, cors_headers, deadline)
+            query_logger.record('batch', body, response, deadline)
+            return response
 
-        # 检查是否有搜索结果
-        if not combined_results["results"] or len(combined_results["results"]) == 0:
-            logger.warning("No search results found")
-            return {
-                'statusCode': 200,
+        query = body.get('query')
+        mode = body.get('mode')
+        top_k = body.get('top_k', 10)
+
+        scope, scope_error = parse_search_scope(body)
+        grouping, grouping_error = parse_grouping(body)
+        snippet_chars, snippet_error = parse_response_mode(body)
+        reranker, reranker_error = parse_reranker(body)
+        routing, routing_error = parse_routing(body)
+
+        if body.get('similar_to'):
+            response = handle_similar_search(body, cors_headers, deadline)
+            query_logger.record('similar', body, response, deadline)
+            return response
+
+        logger.warning(f"Parsed query: '{query}', mode: {mode}, top_k: {top_k}, scope: {scope}")
+        
+        error = (validate_search_request(query, mode, top_k) or scope_error or grouping_error or snippet_error or
+                 reranker_error or routing_error)
+        if error:
+            response = {
+                'statusCode': 400,
                 'headers': cors_headers,
-                'body': json.dumps({
-                    "frontend_results": []
-                })
+                'body': json.dumps({'error': error})
             }
+            query_logger.record('search', body, response, deadline)
+            return response
 
-        # Rerank the combined results
-        reranked_results = search.rerank_results(query, combined_results["results"])
-
-        # Sort results by relevance score
-        sorted_results = sorted(reranked_results, key=lambda x: x['relevance_score'], reverse=True)
+        # Initialize the search class
+        search = VideoSearch()
 
-        # Deduplicate results based on _id while maintaining the highest relevance score
-        seen_ids = set()
-        unique_results = []
-        for result in sorted_results:
-            if result['_id'] not in seen_ids:
-                seen_ids.add(result['_id'])
-                unique_results.append(result)
+        # Perform the combined search, rerank and filter the results
+        response = search.search_and_rerank(query, mode, top_k, deadline, scope, grouping, reranker, routing)
+        if snippet_chars:
+            slim_results(response["results"], query, snippet_chars)
 
-        # Filter out results with similarity below 0.05
-        final_results = [result for result in unique_results if result['relevance_score'] >= 0.05]
+        response_body = {
+            "frontend_results": response["results"],
+            "search_path": response["search_path"]
+        }
+        for field in ("groups", "semantic_cache", "missing_shards"):
+            if field in response:
+                response_body[field] = response[field]
 
-        return {
+        response = {
             'statusCode': 200,
             'headers': cors_headers,
-            'body': json.dumps({
-                "frontend_results": final_results
-            })
+            'body': json.dumps(response_body)
         }
+        query_logger.record('search', body, response, deadline)
+        return response
     except Exception as e:
         import traceback
         error_traceback = traceback.format_exc()
@@ -519,3 +1933,39 @@ def lambda_handler(event, context):
                 'traceback': error_traceback
             })
         }
+    finally:
+        admission.release(ticket)
+        logger.info(f"DocumentDB stats: {json.dumps(docdb_pool.get_stats())}")
+
+def warm_up():
+    """
+    Pre-open pooled connections and cache the hot queries' embeddings (and,
+    with WARMUP_SEARCH, their fused candidates) before the first request
+    """
+    if not warmup.enabled():
+        return
+    started = time.perf_counter()
+    try:
+        queries = warmup.load_hot_queries()
+        search = VideoSearch()
+        stats = warmup.run(
+            queries,
+            embed=search.get_embedding,
+            connect=lambda: search.client.admin.command('ping'),
+            search=(lambda query, mode, top_k: search.combined_search(query, mode, top_k)) if warmup.WARMUP_SEARCH
+            else None
+        )
+        logger.warning(f"Warm-up: {json.dumps(stats)}")
+    except Exception as e:
+        logger.error(f"Error warming up: {str(e)}")
+    startup_profile['warmup'] = round(time.perf_counter() - started, 4)
+
+# Runs once everything above is defined; under SnapStart after restore, like init_clients
+if SNAPSHOT_INIT:
+    try:
+        from snapshot_restore_py import register_after_restore
+        register_after_restore(warm_up)
+    except ImportError:
+        pass
+else:
+    warm_up()
@@ -0,0 +1,96 @@
+import copy
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from operator import mul
+
+# Near-duplicate query cache: reuse a reranked response when a new query's
+# embedding is within SEMANTIC_CACHE_THRESHOLD cosine similarity of a cached one
+SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE', 'false').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+# Entries kept per partition (same generation, backend, mode and request options);
+# a lookup compares the query against every entry of its partition
+SEMANTIC_CACHE_PARTITION_SIZE = int(os.environ.get('SEMANTIC_CACHE_PARTITION_SIZE', '256'))
+SEMANTIC_CACHE_MAX_PARTITIONS = int(os.environ.get('SEMANTIC_CACHE_MAX_PARTITIONS', '64'))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get('SEMANTIC_CACHE_TTL_SECONDS', '3600'))
+
+
+def _normalize(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class SemanticCache:
+    """
+    Thread-safe in-process cache of responses indexed by query embedding
+
+    Partitions hold the queries that may share an answer: the partition key
+    covers everything but the query text (corpus generation, backend, mode,
+    top_k, scope, grouping, reranker, routing). Within a partition a lookup
+    is a linear scan of unit vectors, so partitions are kept small.
+    """
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, partition_size=SEMANTIC_CACHE_PARTITION_SIZE,
+                 max_partitions=SEMANTIC_CACHE_MAX_PARTITIONS, ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS):
+        self.threshold = threshold
+        self.partition_size = partition_size
+        self.max_partitions = max_partitions
+        self.ttl_seconds = ttl_seconds
+        # partition key -> OrderedDict(query text -> (expires_at, unit vector, response))
+        self.partitions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, partition_key, embedding):
+        """
+        Return (response, similarity) for the closest cached query at or above
+        the threshold, or (None, None)
+        """
+        query = _normalize(embedding)
+        now = time.time()
+        with self.lock:
+            partition = self.partitions.get(partition_key)
+            if not partition:
+                return None, None
+            entries = list(partition.items())
+
+        best_text, best_similarity, best_response = None, self.threshold, None
+        expired = []
+        for text, (expires_at, vector, response) in entries:
+            if expires_at < now:
+                expired.append(text)
+                continue
+            if len(vector) != len(query):
+                continue
+            similarity = sum(map(mul, query, vector))
+            if similarity >= best_similarity:
+                best_text, best_similarity, best_response = text, similarity, response
+
+        with self.lock:
+            partition = self.partitions.get(partition_key)
+            if partition is not None:
+                for text in expired:
+                    partition.pop(text, None)
+                if best_text in partition:
+                    partition.move_to_end(best_text)
+        if best_response is None:
+            return None, None
+        return copy.deepcopy(best_response), best_similarity
+
+    def set(self, partition_key, query_text, embedding, response):
+        if self.partition_size <= 0:
+            return
+        entry = (time.time() + self.ttl_seconds, _normalize(embedding), copy.deepcopy(response))
+        with self.lock:
+            partition = self.partitions.get(partition_key)
+            if partition is None:
+                partition = self.partitions[partition_key] = OrderedDict()
+            self.partitions.move_to_end(partition_key)
+            partition[query_text] = entry
+            partition.move_to_end(query_text)
+            while len(partition) > self.partition_size:
+                partition.popitem(last=False)
+            # Partitions of older corpus generations age out first
+            while len(self.partitions) > self.max_partitions:
+                self.partitions.popitem(last=False)
@@ -0,0 +1,67 @@
+import os
+import re
+
+# Characters of context returned around the best-matching part of a segment
+SNIPPET_CHARS = int(os.environ.get('SNIPPET_CHARS', '200'))
+
+
+def query_terms(query):
+    """Lowercased query words worth highlighting"""
+    if not query:
+        return []
+    return sorted({term for term in re.findall(r"\w+", query.lower()) if len(term) >= 2}, key=len, reverse=True)
+
+
+def make_snippet(text, query, window=SNIPPET_CHARS):
+    """
+    Cut a window of text centred on the densest cluster of query-term matches
+
+    Returns:
+        dict: "snippet" text, "highlights" as [start, end] offsets into the
+              snippet, "text_length" of the full text, and whether the snippet
+              was truncated at the "start"/"end"
+    """
+    text = text or ""
+    terms = query_terms(query)
+    matches = []
+    if terms:
+        pattern = re.compile(r"\b(" + "|".join(re.escape(term) for term in terms) + r")", re.IGNORECASE)
+        matches = [(m.start(), m.end()) for m in pattern.finditer(text)]
+
+    if len(text) <= window:
+        start, end = 0, len(text)
+    else:
+        # Anchor the window on the match that has the most other matches after it
+        best_start, best_count = 0, 0
+        for i, (anchor, _) in enumerate(matches):
+            count = sum(1 for s, e in matches[i:] if e <= anchor + window)
+            if count > best_count:
+                best_start, best_count = anchor, count
+        # Leave some lead-in before the first match
+        start = max(0, min(best_start - window // 4, len(text) - window))
+        end = start + window
+        # Snap to word boundaries so the snippet does not cut words in half
+        if start > 0:
+            space = text.find(' ', start)
+            if 0 <= space < start + window // 4:
+                start = space + 1
+        if end < len(text):
+            space = text.rfind(' ', start, end)
+            if space > start + window // 2:
+                end = space
+
+    highlights = [[s - start, e - start] for s, e in matches if s >= start and e <= end]
+    return {
+        "snippet": text[start:end],
+        "highlights": highlights,
+        "text_length": len(text),
+        "truncated_start": start > 0,
+        "truncated_end": end < len(text)
+    }
+
+
+def slim_results(results, query, window=SNIPPET_CHARS):
+    """Replace each result's full text with a snippet window, in place"""
+    for result in results:
+        result.update(make_snippet(result.pop('text', ''), query, window))
+    return results
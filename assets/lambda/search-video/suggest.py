@@ -0,0 +1,113 @@
+import bisect
+import heapq
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_COLLECTION_NAME = os.environ.get('SUGGEST_COLLECTION_NAME', 'suggest_terms')
+# How often a warm container checks the corpus generation for a newer index
+SUGGEST_REFRESH_SECONDS = int(os.environ.get('SUGGEST_REFRESH_SECONDS', '60'))
+# Upper bound on entries loaded into memory, highest weights first
+SUGGEST_MAX_ENTRIES = int(os.environ.get('SUGGEST_MAX_ENTRIES', '200000'))
+MAX_SUGGESTIONS = 20
+
+# Prefixes up to this length have their best completions precomputed, since
+# they match the largest ranges of the sorted term list
+PRECOMPUTED_PREFIX_LENGTH = 2
+
+
+class SuggestIndex:
+    """
+    Compact prefix index over suggestion entries
+
+    Entries are kept in one sorted list, so the completions of a prefix form a
+    contiguous range found with two binary searches. Short prefixes, whose
+    ranges are large, get their top completions precomputed at build time.
+    """
+
+    def __init__(self, entries=()):
+        # entries: iterable of (text, kind, weight)
+        merged = {}
+        for text, kind, weight in entries:
+            key = text.lower()
+            if key in merged:
+                # The same text as a video name and a term keeps both weights
+                _, old_kind, old_weight = merged[key]
+                kind = 'video' if 'video' in (kind, old_kind) else kind
+                weight += old_weight
+            merged[key] = (text, kind, weight)
+
+        ordered = sorted(merged.items())
+        self.keys = [key for key, _ in ordered]
+        self.entries = [entry for _, entry in ordered]
+
+        self.precomputed = {}
+        buckets = {}
+        for position, key in enumerate(self.keys):
+            for length in range(1, PRECOMPUTED_PREFIX_LENGTH + 1):
+                if len(key) >= length:
+                    buckets.setdefault(key[:length], []).append(position)
+        for prefix, positions in buckets.items():
+            self.precomputed[prefix] = heapq.nlargest(MAX_SUGGESTIONS, positions, key=lambda p: self.entries[p][2])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def suggest(self, prefix, limit=8):
+        """Return up to limit completions of prefix, highest weight first"""
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix or not self.keys:
+            return []
+        limit = max(1, min(limit, MAX_SUGGESTIONS))
+
+        if prefix in self.precomputed:
+            positions = self.precomputed[prefix][:limit]
+        else:
+            start = bisect.bisect_left(self.keys, prefix)
+            end = bisect.bisect_left(self.keys, prefix + '\uffff', lo=start)
+            positions = heapq.nlargest(limit, range(start, end), key=lambda p: self.entries[p][2])
+
+        return [
+            {"text": self.entries[p][0], "kind": self.entries[p][1], "weight": self.entries[p][2]}
+            for p in positions
+        ]
+
+
+class SuggestIndexHolder:
+    """Keeps one SuggestIndex per container, rebuilt when the corpus generation moves"""
+
+    def __init__(self):
+        self.index = None
+        self.generation = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, db, get_generation):
+        """
+        Return the current index, reloading it from SUGGEST_COLLECTION_NAME when
+        a newer corpus generation is seen (checked at most every SUGGEST_REFRESH_SECONDS)
+        """
+        now = time.time()
+        if self.index is not None and now - self.checked_at < SUGGEST_REFRESH_SECONDS:
+            return self.index
+
+        with self.lock:
+            if self.index is not None and now - self.checked_at < SUGGEST_REFRESH_SECONDS:
+                return self.index
+            generation = get_generation()
+            if self.index is None or generation != self.generation:
+                started = time.perf_counter()
+                cursor = db[SUGGEST_COLLECTION_NAME].find(
+                    {}, {"text": 1, "kind": 1, "weight": 1}
+                ).sort("weight", -1).limit(SUGGEST_MAX_ENTRIES)
+                self.index = SuggestIndex(
+                    (doc["text"], doc.get("kind", "term"), doc.get("weight", 1)) for doc in cursor
+                )
+                self.generation = generation
+                logger.warning(f"Loaded suggest index with {len(self.index)} entries "
+                               f"in {time.perf_counter() - started:.3f}s (generation {generation})")
+            self.checked_at = now
+            return self.index
@@ -0,0 +1,56 @@
+"""
+Hides the segments of videos that are being replaced or deleted
+
+Ingest tags every segment with an ingest_id and keeps one video_catalog
+document per video (see extract-video-data/video_lifecycle.py). While a
+video is "replacing", only segments of its active ingest are searchable (an
+active_ingest of None keeps untagged, pre-catalog segments visible and hides
+the staged ones); while it is "deleting", none are. Only videos in transition
+are loaded, once per corpus generation, so the filter is usually empty.
+"""
+import logging
+import os
+import threading
+
+import docdb_pool
+
+logger = logging.getLogger(__name__)
+
+VIDEO_CATALOG_COLLECTION_NAME = os.environ.get('VIDEO_CATALOG_COLLECTION_NAME', 'video_catalog')
+
+
+def build_visibility_filter(entries):
+    """MongoDB filter excluding the hidden segments of the given catalog entries"""
+    hidden = []
+    for entry in entries:
+        if entry.get('state') == 'deleting':
+            hidden.append({'video_name': entry['_id']})
+        elif entry.get('state') == 'replacing':
+            hidden.append({'video_name': entry['_id'], 'ingest_id': {'$ne': entry.get('active_ingest')}})
+    return {'$nor': hidden} if hidden else {}
+
+
+class VisibilityFilter:
+    """Per-container cache of the visibility filter, keyed by corpus generation"""
+
+    def __init__(self):
+        self.cached = (None, {})
+        self.lock = threading.Lock()
+
+    def get(self, db, generation):
+        with self.lock:
+            cached_generation, visibility_filter = self.cached
+        if generation is not None and generation == cached_generation:
+            return visibility_filter
+        try:
+            entries = docdb_pool.with_retries(lambda: list(db[VIDEO_CATALOG_COLLECTION_NAME].find(
+                {'state': {'$in': ['replacing', 'deleting']}}, {'state': 1, 'active_ingest': 1})))
+            visibility_filter = build_visibility_filter(entries)
+        except Exception as e:
+            # Showing a video mid-replace beats failing the search
+            logger.warning(f"Error loading videos in transition, not filtering: {str(e)}")
+            return {}
+        if generation is not None:
+            with self.lock:
+                self.cached = (generation, visibility_filter)
+        return visibility_filter
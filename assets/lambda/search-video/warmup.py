@@ -0,0 +1,192 @@
+"""
+Warm-up of a new search container with the most popular queries
+
+New containers (cold starts, and the dozens a burst scales out at once)
+would otherwise compute every popular query's embedding again on their first
+requests. During initialization the warm-up loads a list of hot queries,
+from a curated file (WARMUP_QUERIES_SOURCE) and/or the most frequent queries
+in the recent query log (WARMUP_FROM_QUERY_LOG), then fills the in-process
+caches within WARMUP_BUDGET_MS.
+
+A curated source is "s3://bucket/key" or a local path holding either a JSON
+list (of query strings or {"query", "mode", "top_k"} objects) or one query
+per line.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+from query_log import QUERY_LOG_DESTINATION
+
+logger = logging.getLogger(__name__)
+
+WARMUP_QUERIES_SOURCE = os.environ.get('WARMUP_QUERIES_SOURCE', '')
+WARMUP_FROM_QUERY_LOG = os.environ.get('WARMUP_FROM_QUERY_LOG', 'false').lower() == 'true'
+WARMUP_TOP_N = int(os.environ.get('WARMUP_TOP_N', '50'))
+# Newest query log objects read when ranking queries
+WARMUP_LOG_OBJECTS = int(os.environ.get('WARMUP_LOG_OBJECTS', '20'))
+# The Lambda init phase is limited to 10 s; the warm-up stops taking new work after this
+WARMUP_BUDGET_MS = int(os.environ.get('WARMUP_BUDGET_MS', '3000'))
+# Also run the combined search for each query, caching its fused candidates
+WARMUP_SEARCH = os.environ.get('WARMUP_SEARCH', 'false').lower() == 'true'
+# Connections opened to DocumentDB up front, in parallel
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', '4'))
+WARMUP_MAX_WORKERS = int(os.environ.get('WARMUP_MAX_WORKERS', '8'))
+
+
+def enabled():
+    return bool(WARMUP_QUERIES_SOURCE or WARMUP_FROM_QUERY_LOG or WARMUP_CONNECTIONS)
+
+
+def _s3_client():
+    import boto3
+    return boto3.client('s3')
+
+
+def _read_source(source):
+    if source.startswith('s3://'):
+        bucket, _, key = source[len('s3://'):].partition('/')
+        return _s3_client().get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+    with open(source) as f:
+        return f.read()
+
+
+def _normalize(item, mode='scene', top_k=10):
+    if isinstance(item, str):
+        item = {'query': item}
+    if not isinstance(item, dict) or not isinstance(item.get('query'), str) or not item['query'].strip():
+        return None
+    return {'query': item['query'], 'mode': item.get('mode') or mode, 'top_k': item.get('top_k') or top_k}
+
+
+def load_curated_queries(source):
+    """Queries from a JSON list or a one-query-per-line file"""
+    content = _read_source(source)
+    try:
+        items = json.loads(content)
+    except ValueError:
+        items = [line.strip() for line in content.splitlines()]
+    if not isinstance(items, list):
+        raise ValueError(f"{source} must hold a JSON list or one query per line")
+    return [query for query in (_normalize(item) for item in items) if query]
+
+
+def _recent_log_payloads(destination, max_objects):
+    """Contents of the newest query log objects, from today's and yesterday's partitions"""
+    today = datetime.now(timezone.utc)
+    partitions = [f"dt={day:%Y-%m-%d}/" for day in (today, today - timedelta(days=1))]
+    if destination.startswith('s3://'):
+        bucket, _, prefix = destination[len('s3://'):].partition('/')
+        prefix = f"{prefix.rstrip('/')}/" if prefix else ''
+        s3 = _s3_client()
+        keys = []
+        for partition in partitions:
+            response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix + partition)
+            keys.extend(item['Key'] for item in response.get('Contents', []))
+        # Object names start with the write time, so the newest sort last
+        for key in sorted(keys)[-max_objects:]:
+            yield s3.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+    else:
+        paths = []
+        for partition in partitions:
+            directory = os.path.join(destination, partition)
+            if os.path.isdir(directory):
+                paths.extend(os.path.join(directory, name) for name in os.listdir(directory))
+        for path in sorted(paths, key=os.path.basename)[-max_objects:]:
+            with open(path) as f:
+                yield f.read()
+
+
+def load_logged_queries(destination, limit, max_objects=WARMUP_LOG_OBJECTS):
+    """The most frequent single searches in the recent query log (records need the query text)"""
+    counts = Counter()
+    for payload in _recent_log_payloads(destination, max_objects):
+        for line in payload.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            request = record.get('request') or {}
+            # Scoped, grouped and routed searches are cached under their own keys; warm plain ones only
+            if (record.get('kind') != 'search' or record.get('status') != 200 or
+                    not isinstance(request.get('query'), str)):
+                continue
+            if any(field in request for field in ('video_names', 'video_name', 'start_millis', 'end_millis',
+                                                  'route_by')):
+                continue
+            counts[(request['query'], request.get('mode') or 'scene', request.get('top_k') or 10)] += 1
+    return [{'query': query, 'mode': mode, 'top_k': top_k}
+            for (query, mode, top_k), _ in counts.most_common(limit)]
+
+
+def load_hot_queries():
+    """Curated queries first, then the most frequent logged ones, up to WARMUP_TOP_N distinct"""
+    queries = []
+    if WARMUP_QUERIES_SOURCE:
+        try:
+            queries.extend(load_curated_queries(WARMUP_QUERIES_SOURCE))
+        except Exception as e:
+            logger.warning(f"Error loading warm-up queries from {WARMUP_QUERIES_SOURCE}: {str(e)}")
+    if WARMUP_FROM_QUERY_LOG and QUERY_LOG_DESTINATION:
+        try:
+            queries.extend(load_logged_queries(QUERY_LOG_DESTINATION, WARMUP_TOP_N))
+        except Exception as e:
+            logger.warning(f"Error loading warm-up queries from the query log: {str(e)}")
+    distinct = {}
+    for query in queries:
+        distinct.setdefault((query['query'], query['mode'], query['top_k']), query)
+    return list(distinct.values())[:WARMUP_TOP_N]
+
+
+def run(queries, embed, connect=None, search=None, budget_ms=WARMUP_BUDGET_MS):
+    """
+    Open connections and compute embeddings (and optionally search results)
+    for the hot queries, in parallel, stopping at the budget
+
+    Args:
+        queries (list): {"query", "mode", "top_k"} dicts
+        embed (callable): embed(text), caching its result
+        connect (callable): Round trip that checks out one pooled connection (optional)
+        search (callable): search(query, mode, top_k), caching its result (optional)
+        budget_ms (int): Time allowed for the whole warm-up
+
+    Returns:
+        dict: Counts of what was warmed
+    """
+    deadline = time.monotonic() + budget_ms / 1000.0
+    stats = {'queries': len(queries), 'embedded': 0, 'searched': 0, 'connections': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def count(name):
+        with lock:
+            stats[name] += 1
+
+    def warm(query):
+        if time.monotonic() >= deadline:
+            return
+        embed(query['query'])
+        count('embedded')
+        if search is not None and time.monotonic() < deadline:
+            search(query['query'], query['mode'], query['top_k'])
+            count('searched')
+
+    def open_connection():
+        connect()
+        count('connections')
+
+    executor = ThreadPoolExecutor(max_workers=WARMUP_MAX_WORKERS)
+    futures = []
+    if connect is not None:
+        futures.extend(executor.submit(open_connection) for _ in range(WARMUP_CONNECTIONS))
+    futures.extend(executor.submit(warm, query) for query in queries)
+    done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    stats['failed'] = sum(1 for future in done if future.exception() is not None)
+    stats['unfinished'] = len(not_done)
+    # Work still in flight finishes in the background; nothing waits for it
+    executor.shutdown(wait=False, cancel_futures=True)
+    return stats
@@ -0,0 +1,216 @@
+"""
+Offline throughput benchmark for the extract-video-data ingest path
+
+Runs VideoDataProcessor.process_video_data over synthetic BDA result.json
+files (see synthetic_bda.py) with S3 and Bedrock replaced by in-process
+stand-ins, and reports videos per minute, embeddings per second, peak RSS
+and where the time went (parse, chunk, embed, flatten, write).
+
+The Bedrock stand-in sleeps for a configurable latency per embedding call
+and throttles a configurable share of calls, retried with the same capped
+exponential backoff as botocore's standard retry mode. Writes go to an
+in-memory collection stand-in, or to a real MongoDB given --mongodb-uri
+(e.g. a local `docker run -p 27017:27017 mongo:5`).
+
+Needs the Lambda dependencies (boto3, pymongo) installed:
+
+    python benchmarks/ingest_benchmark.py --videos 20 --chapters 40 --latency-ms 60 --throttle-rate 0.02
+    python benchmarks/ingest_benchmark.py --videos 20 --json > before.json
+    python benchmarks/ingest_benchmark.py --videos 5 --qos --write-rate 100 --write-latency-ms 20
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from standins import MemoryClient, MemoryDatabase, StubBedrock, StubS3
+from synthetic_bda import generate_result, result_key
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_PATHS = [os.path.join(ROOT, 'assets', 'lambda', 'extract-video-data'),
+                os.path.join(ROOT, 'assets', 'lambda-layer', 'python')]
+BUCKET = 'benchmark-bucket'
+STAGES = ('parse', 'chunk', 'embed', 'flatten', 'write')
+
+
+class StageTimer:
+    """Accumulates wall time per stage across worker threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.calls = dict.fromkeys(STAGES, 0)
+
+    def wrap(self, stage, method):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    self.seconds[stage] += elapsed
+                    self.calls[stage] += 1
+        return timed
+
+
+def load_ingest_module(args):
+    """Import lambda_function with the stand-ins in place of S3, Bedrock and (optionally) DocumentDB"""
+    sys.path[:0] = LAMBDA_PATHS
+    os.environ.setdefault('DEPLOY_REGION', 'us-west-2')
+    os.environ['INGEST_SHARDING'] = 'false'
+    os.environ['INGEST_QOS'] = 'true' if args.qos else 'false'
+    if args.write_rate:
+        os.environ['INGEST_WRITE_DOCS_PER_SECOND'] = str(args.write_rate)
+    if args.mongodb_uri:
+        os.environ['MONGODB_URI'] = args.mongodb_uri
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import docdb_pool
+        import embedding_backends
+        import lambda_function
+
+    bedrock = StubBedrock(args.latency_ms, args.jitter_ms, args.throttle_rate, args.max_attempts, args.seed)
+    s3 = StubS3()
+    lambda_function._bedrock_client = bedrock
+    lambda_function._s3_client = s3
+    # Rebuild the backend around the stub client
+    embedding_backends._backends.clear()
+
+    database = None
+    if not args.mongodb_uri:
+        database = MemoryDatabase(args.write_latency_ms)
+        docdb_pool.get_database = lambda role='search', db_name=None, connect=True: database
+        # Shard databases (SEARCH_SHARDS) are reached through get_client
+        client = MemoryClient(database)
+        docdb_pool.get_client = lambda role='search', connect=True, shard=None: client
+    return lambda_function, bedrock, s3, database
+
+
+def new_processor(lambda_function, timer):
+    processor = lambda_function.VideoDataProcessor()
+    processor.get_json_from_s3 = timer.wrap('parse', processor.get_json_from_s3)
+    processor.split_transcript_into_chunks = timer.wrap('chunk', processor.split_transcript_into_chunks)
+    processor.get_embeddings = timer.wrap('embed', processor.get_embeddings)
+    processor.flatten_video_data = timer.wrap('flatten', processor.flatten_video_data)
+    processor.store_in_documentdb = timer.wrap('write', processor.store_in_documentdb)
+    return processor
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run(args):
+    lambda_function, bedrock, s3, database = load_ingest_module(args)
+
+    keys = []
+    for number in range(args.videos):
+        video_name = f"synthetic_{number:04d}.mp4"
+        result = generate_result(args.chapters, args.transcript_words, args.summary_words,
+                                 args.chapter_summary_words, seed=args.seed + number)
+        key = result_key(video_name)
+        s3.objects[(BUCKET, key)] = json.dumps(result).encode('utf-8')
+        keys.append(key)
+
+    timer = StageTimer()
+    local = threading.local()
+    failures = []
+
+    def ingest(key):
+        if not hasattr(local, 'processor'):
+            local.processor = new_processor(lambda_function, timer)
+        event = {'detail': {'bucket': {'name': BUCKET}, 'object': {'key': key}}}
+        response = local.processor.process_video_data(event)
+        if response['statusCode'] != 200:
+            failures.append({'key': key, 'response': response['body']})
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    with output, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(ingest, keys))
+    elapsed = time.perf_counter() - started
+
+    embeddings = timer.calls['embed']
+    return {
+        'config': {key: value for key, value in vars(args).items() if key not in ('json', 'verbose')},
+        'videos': args.videos,
+        'failed_videos': len(failures),
+        'failures': failures[:5],
+        'elapsed_seconds': round(elapsed, 3),
+        'videos_per_minute': round(args.videos / elapsed * 60, 2) if elapsed else None,
+        'embeddings': embeddings,
+        'embeddings_per_second': round(embeddings / elapsed, 2) if elapsed else None,
+        'bedrock': {'calls': bedrock.calls, 'throttled': bedrock.throttled,
+                    'backoff_seconds': round(bedrock.backoff_seconds, 3)},
+        'writes': {'calls': database.writes, 'documents': database.documents} if database else None,
+        'write_pacer': ({'final_rate': round(lambda_function.write_pacer.rate, 1),
+                         'latency_ms': round(lambda_function.write_pacer.latency_ms or 0.0, 1)}
+                        if args.qos else None),
+        'peak_rss_mb': peak_rss_mb(),
+        # Summed across worker threads, so with --concurrency > 1 they add up to more than elapsed
+        'stage_seconds': {stage: round(seconds, 3) for stage, seconds in timer.seconds.items()},
+        'stage_calls': timer.calls,
+    }
+
+
+def print_report(report):
+    print(f"videos:              {report['videos']} ({report['failed_videos']} failed)")
+    print(f"elapsed:             {report['elapsed_seconds']} s")
+    print(f"videos/min:          {report['videos_per_minute']}")
+    print(f"embeddings/s:        {report['embeddings_per_second']} ({report['embeddings']} embeddings)")
+    print(f"bedrock:             {report['bedrock']['calls']} calls, {report['bedrock']['throttled']} throttled, "
+          f"{report['bedrock']['backoff_seconds']} s backoff")
+    if report['writes']:
+        print(f"writes:              {report['writes']['calls']} calls, {report['writes']['documents']} documents")
+    if report['write_pacer']:
+        print(f"write pacing:        {report['write_pacer']['final_rate']} docs/s final rate, "
+              f"{report['write_pacer']['latency_ms']} ms smoothed write latency")
+    print(f"peak RSS:            {report['peak_rss_mb']} MB")
+    total = sum(report['stage_seconds'].values()) or 1.0
+    print("stage timings (thread-seconds):")
+    for stage in STAGES:
+        seconds = report['stage_seconds'][stage]
+        print(f"  {stage:<8} {seconds:>10.3f} s  {seconds / total:>6.1%}  ({report['stage_calls'][stage]} calls)")
+    for failure in report['failures']:
+        print(f"failed: {failure['key']}: {failure['response']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=10)
+    parser.add_argument('--chapters', type=int, default=20)
+    parser.add_argument('--transcript-words', type=int, default=600)
+    parser.add_argument('--summary-words', type=int, default=80)
+    parser.add_argument('--chapter-summary-words', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=1, help="Videos ingested in parallel")
+    parser.add_argument('--latency-ms', type=float, default=50.0, help="Bedrock latency per embedding call")
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of Bedrock calls throttled")
+    parser.add_argument('--max-attempts', type=int, default=3, help="Attempts per call, as botocore retries")
+    parser.add_argument('--write-latency-ms', type=float, default=5.0, help="Latency per in-memory database call")
+    parser.add_argument('--qos', action='store_true', help="Pace writes as with INGEST_QOS=true")
+    parser.add_argument('--write-rate', type=float, default=0.0, help="INGEST_WRITE_DOCS_PER_SECOND with --qos")
+    parser.add_argument('--mongodb-uri', help="Write to this MongoDB instead of the in-memory stand-in")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    parser.add_argument('--verbose', action='store_true', help="Keep the ingest function's own output")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Replay recorded queries against the search handler at a target rate
+
+Drives search_video.lambda_handler in-process from a query log written by
+QUERY_LOG_DESTINATION (records need QUERY_LOG_INCLUDE_TEXT=true to be
+replayable) or from a plain file with one query per line, at a fixed
+concurrency and, optionally, a target QPS, and reports throughput and the
+latency distribution.
+
+By default DocumentDB and Bedrock are in-process stand-ins (see standins.py)
+with configurable latency over a synthetic corpus, so the numbers measure the
+handler's own overhead, concurrency behaviour and caching under a latency
+model. With --live the handler uses whatever the environment configures
+(DB_ENDPOINT or MONGODB_URI, AWS credentials), e.g. from a host in the VPC.
+
+    python benchmarks/search_replay.py --log /tmp/query-log --concurrency 16 --qps 50 --requests 2000
+    python benchmarks/search_replay.py --queries queries.txt --mode transcripts --db-latency-ms 8
+"""
+import argparse
+import collections
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+from standins import MemoryClient, MemoryDatabase, StubBedrock, load_synthetic_corpus
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_PATHS = [os.path.join(ROOT, 'assets', 'lambda', 'search-video'),
+                os.path.join(ROOT, 'assets', 'lambda-layer', 'python')]
+
+
+class ReplayContext:
+    """Lambda context stand-in: every request starts with the full function timeout left"""
+
+    def __init__(self, timeout_ms):
+        self.timeout_ms = timeout_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.timeout_ms
+
+
+def load_requests(args):
+    """Request bodies to replay, in log order"""
+    bodies = []
+    skipped = 0
+    if args.queries:
+        with open(args.queries) as f:
+            for line in f:
+                if line.strip():
+                    bodies.append({'query': line.strip(), 'mode': args.mode, 'top_k': args.top_k})
+        return bodies, skipped
+
+    paths = [args.log]
+    if os.path.isdir(args.log):
+        paths = sorted(os.path.join(directory, name) for directory, _, names in os.walk(args.log)
+                       for name in names if name.endswith('.jsonl'))
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                request = record.get('request') or {}
+                if request.get('query') or request.get('queries') or request.get('similar_to'):
+                    bodies.append(request)
+                else:
+                    skipped += 1
+    return bodies, skipped
+
+
+def load_search_module(args):
+    """Import search_video, with the stand-ins in place of DocumentDB and Bedrock unless --live"""
+    sys.path[:0] = LAMBDA_PATHS
+    os.environ['QUERY_LOG_SAMPLE_RATE'] = '0'
+    os.environ.setdefault('DEPLOY_REGION', 'us-west-2')
+    if not args.verbose:
+        os.environ['LOG_LEVEL'] = 'ERROR'
+    if args.no_cache:
+        os.environ['SEARCH_CACHE_SIZE'] = '0'
+        os.environ['SEARCH_CACHE_SHARED'] = 'false'
+
+    import docdb_pool
+
+    bedrock = database = None
+    if not args.live:
+        import embedding_backends
+
+        bedrock = StubBedrock(args.embed_latency_ms, args.bedrock_jitter_ms, args.throttle_rate,
+                              seed=args.seed, rerank_latency_ms=args.rerank_latency_ms)
+        # Built around the stub first, so search_video's init picks up this cached backend
+        backend = embedding_backends.get_embedding_backend(bedrock_client=bedrock)
+        database = MemoryDatabase(args.db_latency_ms, args.db_jitter_ms, backend.dimensions, args.seed)
+        load_synthetic_corpus(database[os.environ.get('COLLECTION_NAME', 'videodata')],
+                              videos=args.corpus_videos, chapters=args.corpus_chapters,
+                              backend_id=backend.backend_id, seed=args.seed)
+        client = MemoryClient(database)
+        docdb_pool.get_client = lambda role='search', connect=True, shard=None: client
+
+    import search_video
+
+    if bedrock is not None:
+        search_video._bedrock_client = bedrock
+        search_video._cohere_reranker = None
+    return search_video, bedrock, database
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return round(sorted_values[index], 1)
+
+
+def run(args):
+    bodies, skipped = load_requests(args)
+    if not bodies:
+        raise SystemExit(f"No replayable requests found ({skipped} records without query text)")
+    search_video, bedrock, database = load_search_module(args)
+    context = ReplayContext(args.timeout_ms)
+
+    total = args.requests or len(bodies)
+    interval = 1.0 / args.qps if args.qps else 0.0
+    next_index = itertools.count()
+    lock = threading.Lock()
+    latencies = []
+    lags = []
+    statuses = collections.Counter()
+    search_paths = collections.Counter()
+
+    def worker(start):
+        while True:
+            index = next(next_index)
+            if index >= total:
+                return
+            scheduled = start + index * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            began = time.perf_counter()
+            body = bodies[index % len(bodies)]
+            try:
+                response = search_video.lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body)}, context)
+                status = response['statusCode']
+                path = json.loads(response['body']).get('search_path') if status == 200 else None
+            except Exception as e:
+                status, path = f"exception: {type(e).__name__}", None
+            elapsed_ms = (time.perf_counter() - began) * 1000
+            with lock:
+                latencies.append(elapsed_ms)
+                if interval:
+                    lags.append(max(0.0, began - scheduled) * 1000)
+                statuses[status] += 1
+                if path:
+                    search_paths[path] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(start,)) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    lags.sort()
+    return {
+        'config': {key: value for key, value in vars(args).items() if key not in ('json', 'verbose')},
+        'requests': len(latencies),
+        'skipped_records': skipped,
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_qps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'target_qps': args.qps or None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 1) if latencies else None,
+            'p50': percentile(latencies, 0.50),
+            'p90': percentile(latencies, 0.90),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': round(latencies[-1], 1) if latencies else None,
+        },
+        # How far behind schedule requests started; a growing lag means the target QPS was not sustained
+        'schedule_lag_ms': {'p50': percentile(lags, 0.50), 'p99': percentile(lags, 0.99)},
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'search_paths': dict(search_paths),
+        'bedrock': {'calls': bedrock.calls, 'throttled': bedrock.throttled} if bedrock else None,
+        'database_operations': database.operations if database else None,
+    }
+
+
+def print_report(report):
+    latency = report['latency_ms']
+    print(f"requests:        {report['requests']} in {report['elapsed_seconds']} s "
+          f"({report['skipped_records']} log records skipped)")
+    print(f"throughput:      {report['throughput_qps']} qps (target {report['target_qps'] or 'unpaced'})")
+    print(f"latency (ms):    mean {latency['mean']}  p50 {latency['p50']}  p90 {latency['p90']}  "
+          f"p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    if report['target_qps']:
+        print(f"schedule lag:    p50 {report['schedule_lag_ms']['p50']} ms  "
+              f"p99 {report['schedule_lag_ms']['p99']} ms")
+    print(f"statuses:        {report['statuses']}")
+    print(f"search paths:    {report['search_paths']}")
+    if report['bedrock']:
+        print(f"bedrock:         {report['bedrock']['calls']} calls, {report['bedrock']['throttled']} throttled")
+    if report['database_operations'] is not None:
+        print(f"database:        {report['database_operations']} operations")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--log', help="Query log file or directory of .jsonl files")
+    source.add_argument('--queries', help="File with one query per line")
+    parser.add_argument('--mode', default='scene', help="Mode for --queries")
+    parser.add_argument('--top-k', type=int, default=10, help="top_k for --queries")
+    parser.add_argument('--requests', type=int, default=0, help="Requests to send, cycling the input (default: once)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--qps', type=float, default=0.0, help="Target request rate (default: as fast as possible)")
+    parser.add_argument('--timeout-ms', type=int, default=30000, help="Lambda timeout the deadline is derived from")
+    parser.add_argument('--no-cache', action='store_true', help="Disable the search response cache")
+    parser.add_argument('--live', action='store_true', help="Use the configured DocumentDB and Bedrock")
+    parser.add_argument('--db-latency-ms', type=float, default=5.0)
+    parser.add_argument('--db-jitter-ms', type=float, default=2.0)
+    parser.add_argument('--embed-latency-ms', type=float, default=60.0)
+    parser.add_argument('--rerank-latency-ms', type=float, default=250.0)
+    parser.add_argument('--bedrock-jitter-ms', type=float, default=20.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--corpus-videos', type=int, default=20)
+    parser.add_argument('--corpus-chapters', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    parser.add_argument('--verbose', action='store_true', help="Keep the handler's log output")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+"""
+In-process stand-ins for S3, Bedrock and DocumentDB used by the benchmarks
+
+They implement only what the Lambda functions call, with configurable
+latency, so a benchmark measures this repository's code plus a latency model
+rather than a network.
+"""
+import hashlib
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+
+from synthetic_bda import generate_result
+
+
+class Latency:
+    """Sleeps for a mean latency with uniform jitter"""
+
+    def __init__(self, mean_ms, jitter_ms=0.0, seed=0):
+        self.mean = mean_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def random(self):
+        with self.lock:
+            return self.rng.random()
+
+    def wait(self):
+        if self.mean or self.jitter:
+            time.sleep(max(0.0, self.mean + (self.random() * 2 - 1) * self.jitter))
+
+
+def fake_embedding(text, dimensions):
+    """Deterministic unit vector derived from the text"""
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class StubBedrock:
+    """
+    Titan embeddings and Cohere rerank stand-in with latency and throttling
+
+    Throttled calls are retried with the same capped exponential backoff as
+    botocore's standard retry mode, up to max_attempts.
+    """
+
+    def __init__(self, latency_ms, jitter_ms=0.0, throttle_rate=0.0, max_attempts=3, seed=0,
+                 rerank_latency_ms=None):
+        self.embed_latency = Latency(latency_ms, jitter_ms, seed)
+        self.rerank_latency = Latency(latency_ms if rerank_latency_ms is None else rerank_latency_ms,
+                                      jitter_ms, seed + 1)
+        self.throttle_rate = throttle_rate
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.backoff_seconds = 0.0
+
+    def invoke_model(self, modelId, body, **kwargs):
+        from botocore.exceptions import ClientError
+
+        request = json.loads(body)
+        latency = self.rerank_latency if 'documents' in request else self.embed_latency
+        for attempt in range(self.max_attempts):
+            latency.wait()
+            with self.lock:
+                self.calls += 1
+            if latency.random() >= self.throttle_rate:
+                return {'body': io.BytesIO(json.dumps(self._respond(request)).encode('utf-8'))}
+            with self.lock:
+                self.throttled += 1
+            if attempt < self.max_attempts - 1:
+                delay = latency.random() * min(20.0, 2 ** attempt)
+                with self.lock:
+                    self.backoff_seconds += delay
+                time.sleep(delay)
+        raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'InvokeModel')
+
+    def _respond(self, request):
+        if 'documents' in request:
+            terms = set(request['query'].lower().split())
+            scores = [len(terms & set(str(document).lower().split())) / (len(terms) or 1)
+                      for document in request['documents']]
+            ranked = sorted(range(len(scores)), key=lambda index: scores[index], reverse=True)
+            return {'results': [{'index': index, 'relevance_score': scores[index]}
+                                for index in ranked[:request.get('top_n', len(scores))]]}
+        return {'embedding': fake_embedding(request['inputText'], request.get('dimensions', 1024))}
+
+
+class StubS3:
+    """Serves objects from memory"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+
+def _get_field(document, path):
+    for part in path.split('.'):
+        if not isinstance(document, dict) or part not in document:
+            return None
+        document = document[part]
+    return document
+
+
+def matches(document, query):
+    """Evaluate the subset of MongoDB query operators the Lambda functions use"""
+    for field, condition in query.items():
+        if field == '$and':
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif field == '$or':
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif field == '$nor':
+            if any(matches(document, clause) for clause in condition):
+                return False
+        elif field == '$text':
+            continue
+        elif isinstance(condition, dict) and any(key.startswith('$') for key in condition):
+            value = _get_field(document, field)
+            for operator, operand in condition.items():
+                if operator == '$in' and value not in operand:
+                    return False
+                if operator == '$nin' and value in operand:
+                    return False
+                if operator == '$ne' and value == operand:
+                    return False
+                if operator == '$exists' and (value is not None) != bool(operand):
+                    return False
+                if operator == '$regex' and not (isinstance(value, str) and re.search(operand, value)):
+                    return False
+                if operator in ('$gt', '$gte', '$lt', '$lte'):
+                    if value is None:
+                        return False
+                    if ((operator == '$gt' and not value > operand) or (operator == '$gte' and not value >= operand) or
+                            (operator == '$lt' and not value < operand) or
+                            (operator == '$lte' and not value <= operand)):
+                        return False
+        elif _get_field(document, field) != condition:
+            return False
+    return True
+
+
+def _project(document, projection):
+    if not projection:
+        return dict(document)
+    fields = [value for key, value in projection.items() if key != '_id']
+    if fields and not any(fields):
+        return {key: value for key, value in document.items() if key not in projection}
+    return {key: document[key] for key in ['_id', *projection] if key in document and projection.get(key, 1)}
+
+
+class MemoryCursor(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, count):
+        return MemoryCursor(self[:count]) if count else self
+
+    def batch_size(self, size):
+        return self
+
+    def close(self):
+        pass
+
+
+class MemoryCollection:
+    """The subset of pymongo's Collection the Lambda functions use, over a dict of documents"""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.docs = {}
+        self.lock = threading.Lock()
+
+    def _operation(self, writes=0):
+        self.database.latency.wait()
+        with self.database.lock:
+            self.database.operations += 1
+            if writes:
+                self.database.writes += 1
+                self.database.documents += writes
+
+    # Writes
+
+    def insert_many(self, documents, **kwargs):
+        from pymongo.errors import DuplicateKeyError
+
+        self._operation(len(documents))
+        with self.lock:
+            for document in documents:
+                if document['_id'] in self.docs:
+                    raise DuplicateKeyError(f"E11000 duplicate key error: {document['_id']}")
+                self.docs[document['_id']] = document
+        return type('InsertManyResult', (), {'inserted_ids': [document['_id'] for document in documents]})()
+
+    def insert_one(self, document, **kwargs):
+        return self.insert_many([document])
+
+    def replace_one(self, query, document, upsert=False, **kwargs):
+        self._operation(1)
+        with self.lock:
+            if query['_id'] in self.docs or upsert:
+                self.docs[query['_id']] = dict(document, _id=query['_id'])
+
+    def bulk_write(self, requests, **kwargs):
+        self._operation(len(requests))
+
+    def _update(self, query, update, upsert):
+        """Apply $set/$inc/$setOnInsert to the first match (under self.lock); return it or None"""
+        document = next((document for document in self.docs.values() if matches(document, query)), None)
+        if document is None:
+            if not upsert or '_id' not in query:
+                return None
+            document = self.docs[query['_id']] = {'_id': query['_id'], **update.get('$setOnInsert', {})}
+        document.update(update.get('$set', {}))
+        for field in update.get('$unset', {}):
+            document.pop(field, None)
+        for field, amount in update.get('$inc', {}).items():
+            document[field] = document.get(field, 0) + amount
+        return document
+
+    def update_one(self, query, update, upsert=False, **kwargs):
+        self._operation(1)
+        with self.lock:
+            document = self._update(query, update, upsert)
+        return type('UpdateResult', (), {'modified_count': int(document is not None)})()
+
+    def find_one_and_update(self, query, update, upsert=False, **kwargs):
+        self._operation(1)
+        with self.lock:
+            document = self._update(query, update, upsert)
+            return dict(document) if document is not None else None
+
+    def delete_many(self, query, **kwargs):
+        self._operation(1)
+        with self.lock:
+            doomed = [key for key, document in self.docs.items() if matches(document, query)]
+            for key in doomed:
+                del self.docs[key]
+        return type('DeleteResult', (), {'deleted_count': len(doomed)})()
+
+    def delete_one(self, query, **kwargs):
+        self._operation(1)
+        with self.lock:
+            key = next((key for key, document in self.docs.items() if matches(document, query)), None)
+            if key is not None:
+                del self.docs[key]
+        return type('DeleteResult', (), {'deleted_count': int(key is not None)})()
+
+    # Reads
+
+    def _select(self, query):
+        with self.lock:
+            documents = list(self.docs.values())
+        return [document for document in documents if matches(document, query or {})]
+
+    def _with_embeddings(self, documents):
+        for document in documents:
+            if 'embedding' not in document:
+                document['embedding'] = fake_embedding(document.get('text') or document['_id'],
+                                                       self.database.dimensions)
+        return documents
+
+    def find_one(self, query=None, projection=None, **kwargs):
+        self._operation()
+        selected = self._select(query)
+        if not selected:
+            return None
+        if projection and projection.get('embedding'):
+            self._with_embeddings(selected[:1])
+        return _project(selected[0], projection)
+
+    def find(self, query=None, projection=None, **kwargs):
+        self._operation()
+        selected = self._select(query)
+        if projection and projection.get('embedding'):
+            self._with_embeddings(selected)
+        return MemoryCursor(_project(document, projection) for document in selected)
+
+    def count_documents(self, query, limit=0, **kwargs):
+        self._operation()
+        count = len(self._select(query))
+        return min(count, limit) if limit else count
+
+    def aggregate(self, pipeline, **kwargs):
+        """
+        $search vectorSearch returns a pseudo-random sample (the stand-in
+        models latency, not relevance); $text matches by query terms
+        """
+        self._operation()
+        with self.lock:
+            documents = list(self.docs.values())
+        text_terms = None
+        for stage in pipeline:
+            if '$search' in stage:
+                search = stage['$search']['vectorSearch']
+                rng = random.Random(hashlib.sha256(json.dumps(search['vector'][:8]).encode('utf-8')).digest())
+                documents = rng.sample(documents, min(search['k'], len(documents)))
+            elif '$match' in stage:
+                query = stage['$match']
+                if '$text' in query:
+                    text_terms = set(query['$text']['$search'].lower().split())
+                    scored = []
+                    for document in documents:
+                        words = set((document.get('text') or '').lower().split())
+                        hits = len(text_terms & words)
+                        if hits:
+                            scored.append(dict(document, _text_score=float(hits)))
+                    documents = scored
+                documents = [document for document in documents if matches(document, query)]
+            elif '$sample' in stage:
+                documents = random.sample(documents, min(stage['$sample']['size'], len(documents)))
+            elif '$sort' in stage:
+                if text_terms is not None:
+                    documents.sort(key=lambda document: document.get('_text_score', 0.0), reverse=True)
+            elif '$limit' in stage:
+                documents = documents[:stage['$limit']]
+            elif '$project' in stage:
+                projection = stage['$project']
+                projected = []
+                for document in documents:
+                    result = {key: document[key] for key in ['_id', *projection]
+                              if key in document and not isinstance(projection.get(key), dict)}
+                    for key, value in projection.items():
+                        if isinstance(value, dict) and value.get('$meta') == 'textScore':
+                            result[key] = document.get('_text_score', 0.0)
+                    projected.append(result)
+                documents = projected
+        return iter(documents)
+
+
+class MemoryDatabase:
+    """Collections created on first access, sharing one latency model and operation counters"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, dimensions=1024, seed=0):
+        self.latency = Latency(latency_ms, jitter_ms, seed)
+        self.dimensions = dimensions
+        self.collections = {}
+        self.lock = threading.Lock()
+        self.operations = 0
+        self.writes = 0
+        self.documents = 0
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = MemoryCollection(self, name)
+            return self.collections[name]
+
+
+class MemoryClient:
+    """Stands in for MongoClient: every database name maps to the same MemoryDatabase"""
+
+    def __init__(self, database):
+        self.database = database
+        self.admin = type('Admin', (), {'command': staticmethod(lambda *args, **kwargs: {'ok': 1})})()
+
+    def __getitem__(self, name):
+        return self.database
+
+    def server_info(self):
+        return {'version': 'memory'}
+
+
+def load_synthetic_corpus(collection, videos=20, chapters=10, transcript_words=300, chunk_words=80,
+                          backend_id='titan-v2', seed=0):
+    """Fill a collection with flattened segments of synthetic videos, as ingest would store them"""
+    for number in range(videos):
+        video_name = f"synthetic_{number:04d}.mp4"
+        result = generate_result(chapters, transcript_words, seed=seed + number)
+        segments = [{'source': 'video_summary', 'text': result['video']['summary'],
+                     'start_timestamp_millis': None, 'end_timestamp_millis': None}]
+        for chapter in result['chapters']:
+            timestamps = {'start_timestamp_millis': chapter['start_timestamp_millis'],
+                          'end_timestamp_millis': chapter['end_timestamp_millis']}
+            segments.append({'source': f"chapter_{chapter['chapter_index']}_summary",
+                             'text': chapter['summary'], **timestamps})
+            words = chapter['transcript']['representation']['text'].split()
+            for index, start in enumerate(range(0, len(words), chunk_words)):
+                segments.append({
+                    'source': f"chapter_{chapter['chapter_index']}_transcript_chunk_{index}",
+                    'text': ' '.join(words[start:start + chunk_words]), **timestamps
+                })
+        for index, segment in enumerate(segments):
+            segment.update({'_id': f"{video_name}:{index}", 'video_name': video_name,
+                            'embedding_backend': backend_id})
+            collection.docs[segment['_id']] = segment
@@ -0,0 +1,107 @@
+"""
+Synthetic Bedrock Data Automation (BDA) standard-output result.json files
+
+The documents follow the shape extract-video-data reads: a video summary and
+a list of chapters, each with timestamps, a summary and a transcript. Text is
+drawn from a fixed vocabulary with a seeded RNG, so the same arguments always
+produce the same files.
+
+    python benchmarks/synthetic_bda.py --videos 5 --chapters 40 --out /tmp/bda
+"""
+import argparse
+import json
+import os
+import random
+
+VOCABULARY = """
+actor agrees airport apartment argument arrives asks baby bar beach birthday boat book boss box
+breakfast brother building cab cafe call camera car cat chair child city class coat coffee
+couch date dinner doctor dog door dress driver evening family father friend game garden gift
+girlfriend guitar hallway hospital hotel house interview job key kitchen laugh letter lunch
+meeting mother movie museum music neighbor night office park party phone piano plan police
+question rain restaurant ring road roommate running school secret shop sister snow song stairs
+street student surprise table taxi teacher television ticket train trip truck vacation wedding
+window winter work writes yells
+""".split()
+FILLER = "the a and to of in on with at for from his her their is was".split()
+
+
+def _sentence(rng):
+    words = [rng.choice(VOCABULARY if rng.random() < 0.6 else FILLER) for _ in range(rng.randint(6, 18))]
+    return ' '.join(words).capitalize() + rng.choice('...!?')
+
+
+def _text(rng, words):
+    """Roughly `words` words of punctuated sentences"""
+    sentences = []
+    count = 0
+    while count < words:
+        sentence = _sentence(rng)
+        sentences.append(sentence)
+        count += len(sentence.split())
+    return ' '.join(sentences)
+
+
+def generate_result(chapters=20, transcript_words=600, summary_words=80, chapter_summary_words=40,
+                    chapter_millis=60000, seed=0):
+    """
+    Return one synthetic result.json document
+
+    Args:
+        chapters (int): Number of chapters
+        transcript_words (int): Approximate transcript length per chapter, in words
+        summary_words (int): Approximate video summary length, in words
+        chapter_summary_words (int): Approximate summary length per chapter, in words
+        chapter_millis (int): Chapter duration in milliseconds
+        seed (int): RNG seed
+    """
+    rng = random.Random(seed)
+    frames_per_chapter = chapter_millis * 30 // 1000
+    result = {
+        'metadata': {'semantic_modality': 'VIDEO', 'duration_millis': chapters * chapter_millis},
+        'video': {'summary': _text(rng, summary_words)},
+        'chapters': []
+    }
+    for index in range(chapters):
+        result['chapters'].append({
+            'chapter_index': index,
+            'start_timestamp_millis': index * chapter_millis,
+            'end_timestamp_millis': (index + 1) * chapter_millis,
+            'start_frame_index': index * frames_per_chapter,
+            'end_frame_index': (index + 1) * frames_per_chapter - 1,
+            'duration_millis': chapter_millis,
+            'summary': _text(rng, chapter_summary_words),
+            'transcript': {'representation': {'text': _text(rng, transcript_words)}}
+        })
+    return result
+
+
+def result_key(video_name):
+    """S3 key in the layout the BDA trigger writes (video name is the second path part)"""
+    return f"video-output/{video_name}/synthetic/0/standard_output/0/result.json"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=1)
+    parser.add_argument('--chapters', type=int, default=20)
+    parser.add_argument('--transcript-words', type=int, default=600)
+    parser.add_argument('--summary-words', type=int, default=80)
+    parser.add_argument('--chapter-summary-words', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True, help="Directory to write <video>/result.json files to")
+    args = parser.parse_args()
+
+    for number in range(args.videos):
+        video_name = f"synthetic_{number:04d}.mp4"
+        result = generate_result(args.chapters, args.transcript_words, args.summary_words,
+                                 args.chapter_summary_words, seed=args.seed + number)
+        directory = os.path.join(args.out, video_name)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'result.json'), 'w') as f:
+            json.dump(result, f)
+    print(f"Wrote {args.videos} result.json files to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The Lambda functions import their layer and sibling modules as top-level modules
+for path in ('assets/lambda-layer/python', 'assets/lambda/search-video', 'assets/lambda/extract-video-data',
+             'benchmarks'):
+    sys.path.insert(0, os.path.join(ROOT, path))
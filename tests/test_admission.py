@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+
+import admission
+from standins import MemoryDatabase
+
+
+class UnavailableCollection:
+    def __getattr__(self, name):
+        def unavailable(*args, **kwargs):
+            raise ServerSelectionTimeoutError("No primary available")
+        return unavailable
+
+
+class UnavailableDatabase:
+    def __getitem__(self, name):
+        return UnavailableCollection()
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """Admission store the test can switch between available and unavailable"""
+    state = {'db': MemoryDatabase()}
+    monkeypatch.setattr(admission, '_store_database', lambda: state['db'])
+    return state
+
+
+def controller(**kwargs):
+    kwargs.setdefault('max_inflight', 10)
+    return admission.AdmissionController(rate_limiter=admission.RateLimiter(rate=0), **kwargs)
+
+
+def inflight_count(db):
+    return sum(doc.get('count', 0) for doc in db[admission.RATE_LIMIT_COLLECTION_NAME].docs.values())
+
+
+def test_counts_admitted_requests_in_and_out(store):
+    gate = controller()
+    ticket, rejection = gate.admit({}, {'query': 'cat'}, {})
+    assert rejection is None
+    assert inflight_count(store['db']) == 1
+    gate.release(ticket)
+    assert inflight_count(store['db']) == 0
+
+
+def test_sheds_above_the_limit(store):
+    gate = controller(max_inflight=1)
+    first, _ = gate.admit({}, {'query': 'cat'}, {})
+    ticket, rejection = gate.admit({}, {'query': 'dog'}, {})
+    assert ticket is None
+    assert rejection['statusCode'] == 503
+    assert 'Retry-After' in rejection['headers']
+    gate.release(first)
+    assert inflight_count(store['db']) == 0
+
+
+def test_unavailable_counter_admits_against_the_container_limit(store):
+    store['db'] = UnavailableDatabase()
+    gate = controller(local_max_inflight=3, shed_after_failures=0)
+    tickets = [gate.admit({}, {'query': 'cat'}, {})[0] for _ in range(3)]
+    assert all(ticket is not None and ticket.local for ticket in tickets)
+
+    ticket, rejection = gate.admit({}, {'query': 'dog'}, {})
+    assert ticket is None
+    assert rejection['statusCode'] == 503
+
+    gate.release(tickets[0])
+    ticket, rejection = gate.admit({}, {'query': 'dog'}, {})
+    assert rejection is None
+
+
+def test_unavailable_counter_sheds_only_after_repeated_failures(store):
+    store['db'] = UnavailableDatabase()
+    gate = controller(local_max_inflight=0, shed_after_failures=3)
+    for _ in range(2):
+        ticket, rejection = gate.admit({}, {'query': 'cat'}, {})
+        assert rejection is None
+        gate.release(ticket)
+
+    ticket, rejection = gate.admit({}, {'query': 'cat'}, {})
+    assert rejection['statusCode'] == 503
+    assert json.loads(rejection['body'])['error'] == "Search is overloaded"
+
+    # A counter that answers again resets the failure streak
+    store['db'] = MemoryDatabase()
+    ticket, rejection = gate.admit({}, {'query': 'cat'}, {})
+    assert rejection is None
+    assert gate.counter_failures == 0
+
+
+def test_failed_release_is_retried_with_the_next_release(store):
+    db = store['db']
+    gate = controller()
+    first, _ = gate.admit({}, {'query': 'cat'}, {})
+    second, _ = gate.admit({}, {'query': 'dog'}, {})
+
+    store['db'] = UnavailableDatabase()
+    gate.release(first)
+    assert inflight_count(db) == 2
+
+    store['db'] = db
+    gate.release(second)
+    assert inflight_count(db) == 0
+    assert gate.pending_releases == {}
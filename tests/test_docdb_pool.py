@@ -0,0 +1,54 @@
+import time
+
+import pymongo
+import pytest
+from pymongo.errors import AutoReconnect, NetworkTimeout
+
+import docdb_pool
+
+
+class Flaky:
+    """Operation failing with error the first failures times, then returning 'ok'"""
+
+    def __init__(self, error, failures, delay_seconds=0.0):
+        self.error = error
+        self.failures = failures
+        self.delay_seconds = delay_seconds
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay_seconds)
+        if self.calls <= self.failures:
+            raise self.error
+        return 'ok'
+
+
+def test_with_retries_retries_transient_errors():
+    operation = Flaky(AutoReconnect('connection reset'), failures=2)
+    assert docdb_pool.with_retries(operation, backoff_seconds=0.001) == 'ok'
+    assert operation.calls == 3
+
+
+def test_with_retries_gives_up_after_attempts():
+    operation = Flaky(AutoReconnect('connection reset'), failures=5)
+    with pytest.raises(AutoReconnect):
+        docdb_pool.with_retries(operation, attempts=3, backoff_seconds=0.001)
+    assert operation.calls == 3
+
+
+def test_with_retries_does_not_retry_past_the_timeout_budget():
+    operation = Flaky(NetworkTimeout('timed out'), failures=5, delay_seconds=0.06)
+    started = time.monotonic()
+    with pytest.raises(NetworkTimeout):
+        with pymongo.timeout(0.05):
+            docdb_pool.with_retries(operation)
+    assert operation.calls == 1
+    assert time.monotonic() - started < 0.15
+
+
+def test_with_retries_retries_within_the_timeout_budget():
+    operation = Flaky(AutoReconnect('connection reset'), failures=1)
+    with pymongo.timeout(5):
+        assert docdb_pool.with_retries(operation, backoff_seconds=0.01) == 'ok'
+    assert operation.calls == 2
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+import docdb_pool
+import embedding_backends
+import search_video
+from semantic_cache import SemanticCache
+from standins import MemoryClient, MemoryDatabase, StubBedrock, load_synthetic_corpus
+
+
+class SameEmbeddingBedrock(StubBedrock):
+    """Embeds queries differing only in trailing punctuation identically"""
+
+    def _respond(self, request):
+        if 'inputText' in request:
+            request = dict(request, inputText=request['inputText'].rstrip('!?'))
+        return super()._respond(request)
+
+
+@pytest.fixture
+def legs(monkeypatch):
+    """Counts of the search legs run against the database"""
+    bedrock = SameEmbeddingBedrock(0)
+    # Fresh per-container state: the backend holds its Bedrock client
+    monkeypatch.setattr(embedding_backends, '_backends', {})
+    monkeypatch.setattr(search_video, 'response_cache', search_video.SearchCache())
+    monkeypatch.setattr(search_video, 'embedding_cache', search_video.LocalCache(16, 60))
+    backend = embedding_backends.get_embedding_backend(bedrock_client=bedrock)
+    db = MemoryDatabase(0, 0, backend.dimensions)
+    load_synthetic_corpus(db['videodata'], 3, 3, backend_id=backend.backend_id)
+    client = MemoryClient(db)
+    monkeypatch.setattr(docdb_pool, 'get_client', lambda *args, **kwargs: client)
+    monkeypatch.setattr(search_video, '_bedrock_client', bedrock)
+    monkeypatch.setattr(search_video, '_cohere_reranker', None)
+    monkeypatch.setattr(search_video, 'SEMANTIC_CACHE_ENABLED', True)
+    monkeypatch.setattr(search_video, 'semantic_cache', SemanticCache())
+
+    counts = {'vector': 0, 'text': 0}
+    vector_search, text_search = search_video.VideoSearch.vector_search, search_video.VideoSearch.text_search
+
+    def counted_vector_search(self, *args, **kwargs):
+        counts['vector'] += 1
+        return vector_search(self, *args, **kwargs)
+
+    def counted_text_search(self, *args, **kwargs):
+        counts['text'] += 1
+        return text_search(self, *args, **kwargs)
+
+    monkeypatch.setattr(search_video.VideoSearch, 'vector_search', counted_vector_search)
+    monkeypatch.setattr(search_video.VideoSearch, 'text_search', counted_text_search)
+    return counts
+
+
+def test_semantic_cache_hit_skips_the_vector_leg(legs):
+    search = search_video.VideoSearch()
+    first = search.search_and_rerank('dog park', 'scene', 5)
+    assert first['search_path'].startswith('vector+text')
+    assert legs['vector'] == 1
+
+    second = search.search_and_rerank('dog park!', 'scene', 5)
+    assert second['semantic_cache']['similarity'] == pytest.approx(1.0)
+    # The combined search runs in the background; give a leg that was not cancelled time to run
+    time.sleep(0.2)
+    assert legs['vector'] == 1
+
+
+def test_semantic_cache_miss_runs_both_legs(legs):
+    search = search_video.VideoSearch()
+    search.search_and_rerank('dog park', 'scene', 5)
+    response = search.search_and_rerank('cat house', 'scene', 5)
+    assert 'semantic_cache' not in response
+    assert legs == {'vector': 2, 'text': 2}
@@ -0,0 +1,15 @@
+import pytest
+
+import lambda_function
+
+
+@pytest.mark.parametrize('key, expected', [
+    ('video-input/Friends.mp4', True),
+    ('video-input/', False),
+    ('video-output/Friends.mp4', False),
+    ('index.html', False),
+    ('assets/logo.png', False),
+    ('video-input/Friends.mp4/extra', False),
+])
+def test_is_source_video_key(key, expected):
+    assert lambda_function.VideoDataProcessor().is_source_video_key(key) is expected
@@ -0,0 +1,37 @@
+import docdb_pool
+import search_video
+from standins import MemoryClient, MemoryDatabase
+from visibility import VIDEO_CATALOG_COLLECTION_NAME, VisibilityFilter, build_visibility_filter
+
+
+def test_build_visibility_filter_hides_deleting_and_staged_segments():
+    visibility = build_visibility_filter([
+        {'_id': 'A.mp4', 'state': 'deleting'},
+        {'_id': 'B.mp4', 'state': 'replacing', 'active_ingest': 'i1'},
+        {'_id': 'C.mp4', 'state': 'stable'},
+    ])
+    assert visibility == {'$nor': [{'video_name': 'A.mp4'},
+                                   {'video_name': 'B.mp4', 'ingest_id': {'$ne': 'i1'}}]}
+
+
+def test_build_visibility_filter_is_empty_without_transitions():
+    assert build_visibility_filter([{'_id': 'C.mp4', 'state': 'stable'}]) == {}
+
+
+def test_get_texts_leaves_out_hidden_segments(monkeypatch):
+    db = MemoryDatabase()
+    db['videodata'].insert_many([
+        {'_id': 'a1', 'video_name': 'A.mp4', 'ingest_id': 'i1', 'text': 'being deleted'},
+        {'_id': 'b1', 'video_name': 'B.mp4', 'ingest_id': 'i1', 'text': 'active'},
+        {'_id': 'b2', 'video_name': 'B.mp4', 'ingest_id': 'i2', 'text': 'staged'},
+    ])
+    db[VIDEO_CATALOG_COLLECTION_NAME].insert_many([
+        {'_id': 'A.mp4', 'state': 'deleting'},
+        {'_id': 'B.mp4', 'state': 'replacing', 'active_ingest': 'i1'},
+    ])
+    client = MemoryClient(db)
+    monkeypatch.setattr(docdb_pool, 'get_client', lambda *args, **kwargs: client)
+    monkeypatch.setattr(search_video, 'visibility_filter', VisibilityFilter())
+
+    texts = search_video.VideoSearch().get_texts(['a1', 'b1', 'b2'])
+    assert [doc['_id'] for doc in texts] == ['b1']
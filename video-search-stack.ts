@@ -95,6 +95,8 @@ export class VideoSearchStack extends cdk.Stack {
     const api = new apigateway.RestApi(this, 'VideoSearchApi', {
       restApiName: 'Video Search API',
       description: 'API for searching video content',
+      // 响应超过1KB且客户端接受gzip时由API Gateway压缩
+      minimumCompressionSize: 1024,
       defaultCorsPreflightOptions: {
         allowOrigins: apigateway.Cors.ALL_ORIGINS,
         allowMethods: apigateway.Cors.ALL_METHODS,
@@ -748,6 +750,34 @@ export class VideoSearchStack extends cdk.Stack {
     // 添加Lambda目标
     s3VideoDataExtractRule.addTarget(new targets.LambdaFunction(extractVideoDataFunction));
 
+    // 创建EventBridge规则 - 监听源视频或结果文件被删除，删除视频的检索数据
+    // （存储桶已启用EventBridge通知；版本化存储桶删除时产生的删除标记同样发出Object Deleted事件）
+    const s3VideoDeleteRule = new events.Rule(this, 'S3VideoDeleteRule', {
+      ruleName: 's3-video-delete',
+      eventPattern: {
+        source: ['aws.s3'],
+        detailType: ['Object Deleted'],
+        detail: {
+          bucket: {
+            name: [unifiedBucket.bucketName],
+          },
+          object: {
+            key: [
+              { prefix: 'video-input/' },
+              { wildcard: 'video-output/*/result.json' },
+            ],
+          },
+        },
+      },
+    });
+
+    // 添加Lambda目标，并允许该规则调用函数
+    s3VideoDeleteRule.addTarget(new targets.LambdaFunction(extractVideoDataFunction));
+    extractVideoDataFunction.addPermission('S3VideoDeleteRuleInvoke', {
+      principal: new iam.ServicePrincipal('events.amazonaws.com'),
+      sourceArn: s3VideoDeleteRule.ruleArn,
+    });
+
     // 输出重要资源信息
     new cdk.CfnOutput(this, 'UnifiedBucketName', {
       value: unifiedBucket.bucketName,